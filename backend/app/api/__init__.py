@@ -4,6 +4,9 @@ from .routes_uploads import router as uploads_router
 from .routes_events import router as events_router
 from .routes_anomalies import router as anomalies_router
 from .routes_query import router as query_router
+from .routes_incidents import router as incidents_router
+from .routes_stats import router as stats_router
+from .routes_cache import router as cache_router
 
 
 router = APIRouter()
@@ -11,4 +14,7 @@ router.include_router(auth_router, prefix="/auth", tags=["auth"])
 router.include_router(uploads_router, prefix="/uploads", tags=["uploads"])
 router.include_router(events_router, prefix="/events", tags=["events"])
 router.include_router(anomalies_router, prefix="/anomalies", tags=["anomalies"])
-router.include_router(query_router, prefix="/query", tags=["query"])
\ No newline at end of file
+router.include_router(query_router, prefix="/query", tags=["query"])
+router.include_router(incidents_router, prefix="/incidents", tags=["incidents"])
+router.include_router(stats_router, prefix="/stats", tags=["stats"])
+router.include_router(cache_router, prefix="/cache", tags=["cache"])
\ No newline at end of file
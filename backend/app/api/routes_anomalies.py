@@ -1,32 +1,74 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from shared.db import get_db
-from ..crud import query_anomalies
+from ..crud import query_anomalies, parse_time
+from ..export import stream_export, check_format, filename, media_type, anomalies_select, ANOMALY_FIELDS
 from ..auth import get_current_user
-from typing import Optional
-from sqlalchemy import select
-from shared import models
+from ..pagination import encode_cursor, decode_cursor
+from ..cache import ResponseCache, get_response_cache
+from typing import Optional, Literal
 
 
 router = APIRouter()
 
 
 @router.get("")
-async def list_anomalies(page: int = Query(1), perPage: int = Query(50), db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
-    offset = (page - 1) * perPage
-    stmt = select(models.Anomaly).order_by(models.Anomaly.created_at.desc()).offset(offset).limit(perPage)
-    res = await db.execute(stmt)
-    anomalies = res.scalars().all()
-
-
-    out = []
-    for a in anomalies:
-        out.append({
-            "id": a.id,
-            "event_id": a.event_id,
-            "detector": a.detector,
-            "score": float(a.score) if a.score else None,
-            "reason": a.reason,
-            "created_at": a.created_at.isoformat() if a.created_at else None
-        })
-    return {"anomalies": out, "page": page}
\ No newline at end of file
+async def list_anomalies(
+    request: Request,
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    page: Optional[int] = Query(None, ge=1, description="Legacy offset pagination; ignores cursor"),
+    perPage: int = Query(50, ge=1, le=10000),
+    db: AsyncSession = Depends(get_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    user=Depends(get_current_user)
+):
+    async def compute():
+        if page is not None:
+            anomalies = await query_anomalies(db, offset=(page - 1) * perPage, limit=perPage)
+        else:
+            try:
+                after = decode_cursor(cursor) if cursor else None
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            anomalies = await query_anomalies(db, limit=perPage, after=after)
+
+
+        out = []
+        for a in anomalies:
+            out.append({
+                "id": a.id,
+                "event_id": a.event_id,
+                "detector": a.detector,
+                "score": a.score,
+                "reason": a.reason,
+                "created_at": a.created_at.isoformat() if a.created_at else None
+            })
+        if page is not None:
+            return {"anomalies": out, "page": page}
+        next_cursor = encode_cursor(out[-1]["created_at"], out[-1]["id"]) if len(out) == perPage else None
+        return {"anomalies": out, "next_cursor": next_cursor}
+
+    return await cache.respond(request, compute)
+
+
+@router.get("/export")
+async def export_anomalies(
+    format: Literal["ndjson", "csv", "parquet"] = Query("ndjson"),
+    gzip: bool = Query(False),
+    start: Optional[str] = Query(None, description="Lower bound on the anomalous event's time"),
+    end: Optional[str] = Query(None, description="Upper bound on the anomalous event's time"),
+    min_score: Optional[float] = Query(None),
+    user=Depends(get_current_user)
+):
+    """Every anomaly in range, streamed from a server-side cursor."""
+    try:
+        check_format(format)
+        stmt = anomalies_select(parse_time(start), parse_time(end), min_score)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        stream_export(stmt, ANOMALY_FIELDS, format, gzip),
+        media_type=media_type(format, gzip),
+        headers={"Content-Disposition": f'attachment; filename="{filename("anomalies", format, gzip)}"'},
+    )
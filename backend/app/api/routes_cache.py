@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Depends
+from ..auth import get_current_user
+from ..cache import ResponseCache, get_response_cache
+
+
+router = APIRouter()
+
+
+@router.get("/stats")
+async def cache_stats(cache: ResponseCache = Depends(get_response_cache), user=Depends(get_current_user)):
+    return await cache.stats()
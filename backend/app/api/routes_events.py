@@ -1,28 +1,172 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from shared.db import get_db
-from ..crud import query_events_with_features, get_event
+from ..crud import query_events_with_features, get_event, events_select, search_events, SEARCH_MIN_LENGTH
+from ..export import stream_export, check_format, filename, media_type
 from ..auth import get_current_user
-from typing import Optional
+from ..pagination import encode_cursor, decode_cursor
+from ..cache import ResponseCache, get_response_cache, encode_json
+from ..similarity import SimilarityIndex, SimilarityUnavailable, get_similarity_index, nearest_events, event_text
+from ..core.config import settings
+from typing import Optional, Literal
 from shared import models
+from shared.raw_lines import fetch_raw_line
 
 router = APIRouter()
 
 
 @router.get("")
 async def list_events(
+    request: Request,
     start: Optional[str] = Query(None),
     end: Optional[str] = Query(None),
     ip: Optional[str] = Query(None),
-    page: int = Query(1, ge=1),
+    fields: Optional[str] = Query(None, description="Comma-separated event fields to return (id and timestamp always are)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    page: Optional[int] = Query(None, ge=1, description="Legacy offset pagination; ignores cursor"),
     perPage: int = Query(50, ge=1, le=10000),
     db: AsyncSession = Depends(get_db),
+    cache: ResponseCache = Depends(get_response_cache),
     user=Depends(get_current_user)
 ):
-    offset = (page - 1) * perPage
-    events = await query_events_with_features(db, start=start, end=end, ip=ip, offset=offset, limit=perPage)
-    return {"events": events, "page": page}
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+
+    async def compute():
+        try:
+            if page is not None:
+                events = await query_events_with_features(
+                    db, start=start, end=end, ip=ip, offset=(page - 1) * perPage, limit=perPage, fields=selected
+                )
+                return {"events": events, "page": page}
+            after = decode_cursor(cursor) if cursor else None
+            events = await query_events_with_features(
+                db, start=start, end=end, ip=ip, limit=perPage, after=after, fields=selected
+            )
+        except ValueError as e:
+            # Unparseable ip/CIDR, time bound, cursor or field name
+            raise HTTPException(status_code=400, detail=str(e))
+        last = events[-1] if len(events) == perPage else None
+        next_cursor = encode_cursor(last["timestamp"].isoformat(), last["id"]) if last else None
+        return {"events": events, "next_cursor": next_cursor}
+
+    return await cache.respond(request, compute)
+
+
+@router.get("/search")
+async def search(
+    request: Request,
+    q: str = Query(..., min_length=SEARCH_MIN_LENGTH, description="Substring to look for, e.g. /wp-admin or sqlmap"),
+    search_in: str = Query("url,user_agent", alias="in", description="Comma-separated columns to search: url, user_agent"),
+    order: Literal["recent", "relevance"] = Query("recent"),
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    ip: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated event fields to return (id and timestamp always are)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (order=recent)"),
+    page: Optional[int] = Query(None, ge=1, description="Offset pagination; always used with order=relevance"),
+    perPage: int = Query(50, ge=1, le=10000),
+    db: AsyncSession = Depends(get_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    user=Depends(get_current_user)
+):
+    """Case-insensitive substring search served by the pg_trgm indexes, each hit ranked by trigram similarity."""
+    columns = [c.strip() for c in search_in.split(",") if c.strip()]
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    if order == "relevance" and page is None:
+        page = 1
+
+    async def compute():
+        kwargs = dict(columns=columns, start=start, end=end, ip=ip, order=order, limit=perPage, fields=selected)
+        try:
+            if page is not None:
+                events = await search_events(db, q, offset=(page - 1) * perPage, **kwargs)
+                return {"events": events, "page": page}
+            after = decode_cursor(cursor) if cursor else None
+            events = await search_events(db, q, after=after, **kwargs)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        last = events[-1] if len(events) == perPage else None
+        next_cursor = encode_cursor(last["timestamp"].isoformat(), last["id"]) if last else None
+        return {"events": events, "next_cursor": next_cursor}
+
+    return await cache.respond(request, compute)
+
+
+@router.get("/similar")
+async def similar_to_text(
+    q: str = Query(..., min_length=1, description="Free text, e.g. a request line or user agent"),
+    k: int = Query(10, ge=1, le=settings.SIMILARITY_MAX_K),
+    fields: Optional[str] = Query(None, description="Comma-separated event fields to return (id and timestamp always are)"),
+    db: AsyncSession = Depends(get_db),
+    index: SimilarityIndex = Depends(get_similarity_index),
+    user=Depends(get_current_user)
+):
+    """Indexed events nearest to the embedding of q."""
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        neighbors = await nearest_events(db, index, await index.embed(q), k, fields=selected)
+    except SimilarityUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(encode_json({"query": q, "neighbors": neighbors}), media_type="application/json")
+
+
+@router.get("/export")
+async def export_events(
+    format: Literal["ndjson", "csv", "parquet"] = Query("ndjson"),
+    gzip: bool = Query(False),
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    ip: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated event fields to export (id and timestamp always are)"),
+    user=Depends(get_current_user)
+):
+    """Every event matching the list_events filters, newest first, streamed from a server-side cursor."""
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        check_format(format)
+        stmt, names = events_select(start, end, ip, selected)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        stream_export(stmt, names, format, gzip),
+        media_type=media_type(format, gzip),
+        headers={"Content-Disposition": f'attachment; filename="{filename("events", format, gzip)}"'},
+    )
+
+
+@router.get("/{event_id}/similar")
+async def similar_events(
+    event_id: int,
+    k: int = Query(10, ge=1, le=settings.SIMILARITY_MAX_K),
+    fields: Optional[str] = Query(None, description="Comma-separated event fields to return (id and timestamp always are)"),
+    db: AsyncSession = Depends(get_db),
+    index: SimilarityIndex = Depends(get_similarity_index),
+    user=Depends(get_current_user)
+):
+    """Indexed events nearest to this one: its stored vector, or its text embedded on the fly when it was not embedded at ingest."""
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        vector = index.vector_of(event_id)
+        source = "index"
+        if vector is None:
+            event = await get_event(db, event_id)
+            if not event:
+                raise HTTPException(status_code=404, detail="Event not found")
+            vector = await index.embed(event_text(event))
+            source = "embedded"
+        neighbors = await nearest_events(db, index, vector, k, exclude=event_id, fields=selected)
+    except SimilarityUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(
+        encode_json({"event_id": event_id, "vector_source": source, "neighbors": neighbors}),
+        media_type="application/json",
+    )
 
 
 @router.get("/{event_id}")
@@ -32,7 +176,10 @@ async def get_single_event(event_id: int, db: AsyncSession = Depends(get_db), us
         raise HTTPException(status_code=404, detail="Event not found")
 
     # Attempt to fetch anomalies for this event
-    stmt = select(models.Anomaly).where(models.Anomaly.event_id == event.id)
+    stmt = select(models.Anomaly).where(
+        models.Anomaly.event_id == event.id,
+        models.Anomaly.event_timestamp == event.timestamp,
+    )
     res = await db.execute(stmt)
     anomalies = res.scalars().all()
 
@@ -41,7 +188,12 @@ async def get_single_event(event_id: int, db: AsyncSession = Depends(get_db), us
         "timestamp": event.timestamp.isoformat() if event.timestamp else None,
         "src_ip": str(event.src_ip) if event.src_ip else None,
         "url": event.url,
-        "raw_line": event.raw_line,
+        "raw_line": await fetch_raw_line(db, event.id, event.upload_id),
+        "src_country": event.src_country,
+        "src_asn": event.src_asn,
+        "count": event.count,
+        "first_seen": (event.first_seen or event.timestamp).isoformat(),
+        "last_seen": (event.last_seen or event.timestamp).isoformat(),
         "anomalies": [
             {
                 "id": a.id,
@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, Query, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from shared.db import get_db
+from ..crud import query_incidents, get_incident, query_incident_anomalies
+from ..auth import get_current_user
+from typing import Optional
+from uuid import UUID
+
+
+router = APIRouter()
+
+
+def _incident_out(i):
+    return {
+        "id": i.id,
+        "upload_id": str(i.upload_id) if i.upload_id else None,
+        "entity_type": i.entity_type,
+        "entity": i.entity,
+        "detector": i.detector,
+        "reason_class": i.reason_class,
+        "reason": i.reason,
+        "count": i.count,
+        "max_score": i.max_score,
+        "first_seen": i.first_seen.isoformat() if i.first_seen else None,
+        "last_seen": i.last_seen.isoformat() if i.last_seen else None,
+        "representative_event_id": i.representative_event_id,
+    }
+
+
+@router.get("")
+async def list_incidents(
+    upload_id: Optional[UUID] = Query(None),
+    page: int = Query(1, ge=1),
+    perPage: int = Query(50, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+    user=Depends(get_current_user)
+):
+    offset = (page - 1) * perPage
+    incidents = await query_incidents(db, upload_id=upload_id, offset=offset, limit=perPage)
+    return {"incidents": [_incident_out(i) for i in incidents], "page": page}
+
+
+@router.get("/{incident_id}")
+async def get_single_incident(
+    incident_id: int,
+    page: int = Query(1, ge=1),
+    perPage: int = Query(50, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+    user=Depends(get_current_user)
+):
+    incident = await get_incident(db, incident_id)
+    if not incident:
+        raise HTTPException(status_code=404, detail="Incident not found")
+
+    anomalies = await query_incident_anomalies(db, incident_id, offset=(page - 1) * perPage, limit=perPage)
+    incident_out = _incident_out(incident)
+    incident_out["anomalies"] = [
+        {
+            "id": a.id,
+            "event_id": a.event_id,
+            "detector": a.detector,
+            "score": float(a.score) if a.score else None,
+            "reason": a.reason,
+            "created_at": a.created_at.isoformat() if a.created_at else None
+        }
+        for a in anomalies
+    ]
+    incident_out["page"] = page
+    return incident_out
@@ -0,0 +1,105 @@
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from shared.db import get_db
+from .. import stats
+from ..crud import parse_time
+from ..auth import get_current_user
+from ..cache import ResponseCache, get_response_cache
+from typing import Optional, Literal
+from uuid import UUID
+
+
+router = APIRouter()
+
+Bucket = Literal["minute", "hour", "day"]
+
+
+class StatsFilter:
+    """Time range and upload accepted by every stats endpoint."""
+
+    def __init__(
+        self,
+        start: Optional[str] = Query(None),
+        end: Optional[str] = Query(None),
+        upload_id: Optional[UUID] = Query(None),
+    ):
+        try:
+            self.start, self.end = parse_time(start), parse_time(end)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        self.upload_id = upload_id
+
+    def kwargs(self):
+        return {"start": self.start, "end": self.end, "upload_id": self.upload_id}
+
+
+@router.get("/summary")
+async def get_summary(
+    request: Request,
+    f: StatsFilter = Depends(),
+    db: AsyncSession = Depends(get_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    user=Depends(get_current_user)
+):
+    return await cache.respond(request, lambda: stats.summary(db, **f.kwargs()))
+
+
+@router.get("/top/{field}")
+async def get_top(
+    request: Request,
+    field: Literal["src_ip", "dest_ip", "domain", "url", "username", "user_agent"],
+    limit: int = Query(10, ge=1, le=1000),
+    f: StatsFilter = Depends(),
+    db: AsyncSession = Depends(get_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    user=Depends(get_current_user)
+):
+    async def compute():
+        return {"field": field, "items": await stats.top_values(db, field, limit=limit, **f.kwargs())}
+
+    return await cache.respond(request, compute)
+
+
+@router.get("/histogram/{field}")
+async def get_histogram(
+    request: Request,
+    field: Literal["status", "method", "src_country"],
+    f: StatsFilter = Depends(),
+    db: AsyncSession = Depends(get_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    user=Depends(get_current_user)
+):
+    async def compute():
+        return {"field": field, "items": await stats.histogram(db, field, **f.kwargs())}
+
+    return await cache.respond(request, compute)
+
+
+@router.get("/timeline")
+async def get_timeline(
+    request: Request,
+    bucket: Bucket = Query("hour"),
+    f: StatsFilter = Depends(),
+    db: AsyncSession = Depends(get_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    user=Depends(get_current_user)
+):
+    async def compute():
+        return {"bucket": bucket, "items": await stats.timeline(db, bucket, **f.kwargs())}
+
+    return await cache.respond(request, compute)
+
+
+@router.get("/anomalies/trend")
+async def get_anomaly_trend(
+    request: Request,
+    bucket: Bucket = Query("hour"),
+    f: StatsFilter = Depends(),
+    db: AsyncSession = Depends(get_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    user=Depends(get_current_user)
+):
+    async def compute():
+        return {"bucket": bucket, "items": await stats.anomaly_trend(db, bucket, **f.kwargs())}
+
+    return await cache.respond(request, compute)
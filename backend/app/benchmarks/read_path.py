@@ -0,0 +1,135 @@
+"""
+Events read-path benchmark: p50/p99 latency of one /api/events page.
+
+Times the ORM path the events listing used to take (hydrate Event objects,
+a second query for their anomalies, dicts built field by field, FastAPI's
+JSON encoding) against the lean one (a single query with a lateral
+json_agg of anomalies, plain rows, orjson), query plus serialization, at
+several page sizes:
+
+    python -m app.benchmarks.read_path --sizes 50 500 5000 --runs 30
+"""
+import json
+import time
+import asyncio
+import argparse
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from shared import models
+from app.core.config import settings
+from app.cache import encode_json
+from app.crud import query_events_with_features
+
+
+async def orm_page(db, limit: int) -> bytes:
+    events = (await db.execute(
+        select(models.Event).order_by(models.Event.timestamp.desc(), models.Event.id.desc()).limit(limit)
+    )).scalars().all()
+    anomalies = {}
+    if events:
+        res = await db.execute(select(models.Anomaly).where(
+            models.Anomaly.event_id.in_([e.id for e in events]),
+            models.Anomaly.event_timestamp.between(events[-1].timestamp, events[0].timestamp),
+        ))
+        for a in res.scalars().all():
+            anomalies.setdefault(a.event_id, []).append(a)
+    out = []
+    for e in events:
+        out.append({
+            "id": e.id,
+            "upload_id": str(e.upload_id) if e.upload_id else None,
+            "timestamp": e.timestamp.isoformat() if e.timestamp else None,
+            "src_ip": str(e.src_ip) if e.src_ip else None,
+            "dest_ip": str(e.dest_ip) if e.dest_ip else None,
+            "user_agent": e.user_agent,
+            "username": e.username,
+            "url": e.url,
+            "method": e.method,
+            "status": e.status,
+            "bytes": e.bytes,
+            "src_country": e.src_country,
+            "src_asn": e.src_asn,
+            "dest_country": e.dest_country,
+            "dest_asn": e.dest_asn,
+            "count": e.count,
+            "first_seen": (e.first_seen or e.timestamp).isoformat(),
+            "last_seen": (e.last_seen or e.timestamp).isoformat(),
+            "anomalies": [
+                {
+                    "id": a.id,
+                    "detector": a.detector,
+                    "score": a.score,
+                    "reason": a.reason,
+                    "created_at": a.created_at.isoformat() if a.created_at else None,
+                }
+                for a in anomalies.get(e.id, [])
+            ],
+        })
+    return json.dumps(jsonable_encoder({"events": out})).encode("utf-8")
+
+
+async def lean_page(db, limit: int) -> bytes:
+    return encode_json({"events": await query_events_with_features(db, limit=limit)})
+
+
+PATHS = {"orm": orm_page, "lean": lean_page}
+
+
+def _percentile(timings, q: float) -> float:
+    return round(timings[min(len(timings) - 1, int(len(timings) * q))], 3)
+
+
+async def run(sizes, runs: int) -> dict:
+    engine = create_async_engine(settings.DATABASE_URL)
+    result = {}
+    try:
+        async with async_sessionmaker(engine)() as db:
+            for size in sizes:
+                result[size] = {}
+                for name, page in PATHS.items():
+                    body = await page(db, size)  # warm-up
+                    db.expunge_all()
+                    timings = []
+                    for _ in range(runs):
+                        started = time.perf_counter()
+                        await page(db, size)
+                        timings.append((time.perf_counter() - started) * 1000)
+                        db.expunge_all()
+                    timings.sort()
+                    result[size][name] = {
+                        "p50": _percentile(timings, 0.5),
+                        "p99": _percentile(timings, 0.99),
+                        "bytes": len(body),
+                    }
+    finally:
+        await engine.dispose()
+    return result
+
+
+def print_table(result: dict) -> None:
+    print(f"{'perPage':>8}{'orm p50':>10}{'orm p99':>10}{'lean p50':>10}{'lean p99':>10}{'speedup':>9}")
+    for size, paths in result.items():
+        orm, lean = paths["orm"], paths["lean"]
+        speedup = f"{orm['p50'] / lean['p50']:.1f}x" if lean["p50"] else "-"
+        print(f"{size:>8}{orm['p50']:>10.1f}{orm['p99']:>10.1f}{lean['p50']:>10.1f}{lean['p99']:>10.1f}{speedup:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000], help="page sizes (perPage)")
+    parser.add_argument("--runs", type=int, default=30, help="timed runs per path and size")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.sizes, args.runs))
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(result, fh, indent=2)
+    print_table(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Storage benchmark: table/index sizes and typical query latency.
+
+Run it before and after app.migrate_db to compare the old schema (varchar
+scores and addresses, inline raw_line) with the compact one:
+
+    python -m app.benchmarks.storage --output before.json
+    python -m app.migrate_db
+    python -m app.benchmarks.storage --output after.json --compare before.json
+
+Queries adapt to whichever schema they find, so both runs measure the same
+question answered the way each schema allows.
+"""
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import timedelta
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.core.config import settings
+from shared.raw_lines import fetch_raw_line
+
+TABLES = ("events", "anomalies", "event_raw_blocks")
+TOP_K = 100
+CIDR = "10.0.0.0/8"
+
+
+async def _column_type(db, table: str, column: str):
+    res = await db.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+    ), {"table": table, "column": column})
+    return res.scalar()
+
+
+async def table_sizes(db) -> dict:
+    """Heap+TOAST and index bytes per table, summed over its partitions."""
+    sizes = {}
+    for table in TABLES:
+        if await _column_type(db, table, "id") is None:
+            continue
+        res = await db.execute(text(
+            "SELECT COALESCE(sum(pg_table_size(c.oid)), 0), COALESCE(sum(pg_indexes_size(c.oid)), 0) "
+            "FROM pg_class c WHERE c.oid = to_regclass(:table) "
+            "OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:table))"
+        ), {"table": table})
+        data, indexes = res.first()
+        rows = (await db.execute(text(f"SELECT count(*) FROM {table}"))).scalar()
+        sizes[table] = {"rows": rows, "table_bytes": int(data), "index_bytes": int(indexes)}
+    return sizes
+
+
+async def build_queries(db) -> dict:
+    """name -> coroutine factory, using the columns the current schema has."""
+    numeric_score = await _column_type(db, "anomalies", "score") == "double precision"
+    inet_ip = await _column_type(db, "events", "src_ip") == "inet"
+    inline_raw = await _column_type(db, "events", "raw_line") is not None
+
+    await db.execute(text(
+        "CREATE OR REPLACE FUNCTION pg_temp.try_inet(v text) RETURNS inet AS $$ "
+        "BEGIN RETURN v::inet; EXCEPTION WHEN others THEN RETURN NULL; END $$ "
+        "LANGUAGE plpgsql IMMUTABLE"
+    ))
+    hi = (await db.execute(text("SELECT max(timestamp) FROM events"))).scalar()
+    sample = (await db.execute(text("SELECT id, upload_id FROM events ORDER BY id DESC LIMIT 1"))).first()
+
+    score = "score" if numeric_score else "score::double precision"
+    ip_match = "src_ip <<= CAST(:cidr AS inet)" if inet_ip else "pg_temp.try_inet(src_ip) <<= CAST(:cidr AS inet)"
+
+    async def top_anomalies():
+        await db.execute(text(f"SELECT id, event_id, {score} FROM anomalies ORDER BY {score} DESC LIMIT :k"), {"k": TOP_K})
+
+    async def cidr_filter():
+        await db.execute(text(f"SELECT count(*) FROM events WHERE {ip_match}"), {"cidr": CIDR})
+
+    async def time_range():
+        await db.execute(
+            text("SELECT count(*) FROM events WHERE timestamp >= :start AND timestamp <= :end"),
+            {"start": hi - timedelta(days=1), "end": hi},
+        )
+
+    async def events_page():
+        await db.execute(text("SELECT * FROM events ORDER BY timestamp DESC LIMIT 50"))
+
+    async def event_detail():
+        if inline_raw:
+            await db.execute(text("SELECT raw_line FROM events WHERE id = :id"), {"id": sample.id})
+        else:
+            await fetch_raw_line(db, sample.id, sample.upload_id)
+
+    queries = {"top_anomalies": top_anomalies, "cidr_filter": cidr_filter, "events_page": events_page}
+    if hi is not None:
+        queries["time_range"] = time_range
+    if sample is not None:
+        queries["event_detail"] = event_detail
+    return queries
+
+
+async def run(runs: int) -> dict:
+    engine = create_async_engine(settings.DATABASE_URL)
+    try:
+        async with async_sessionmaker(engine)() as db:
+            result = {"sizes": await table_sizes(db), "latency_ms": {}}
+            for name, query in (await build_queries(db)).items():
+                await query()  # warm-up
+                timings = []
+                for _ in range(runs):
+                    started = time.perf_counter()
+                    await query()
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                result["latency_ms"][name] = {
+                    "p50": round(statistics.median(timings), 3),
+                    "p95": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+                    "mean": round(statistics.fmean(timings), 3),
+                }
+    finally:
+        await engine.dispose()
+    return result
+
+
+def _ratio(before, after) -> str:
+    return f"{after / before:.2f}x" if before else "-"
+
+
+def print_comparison(before: dict, after: dict) -> None:
+    print(f"{'table':<20}{'before MB':>12}{'after MB':>12}{'ratio':>8}")
+    for table in sorted(set(before["sizes"]) | set(after["sizes"])):
+        b = before["sizes"].get(table, {})
+        a = after["sizes"].get(table, {})
+        b_total = b.get("table_bytes", 0) + b.get("index_bytes", 0)
+        a_total = a.get("table_bytes", 0) + a.get("index_bytes", 0)
+        print(f"{table:<20}{b_total / 2**20:>12.1f}{a_total / 2**20:>12.1f}{_ratio(b_total, a_total):>8}")
+    print(f"\n{'query':<20}{'before p50':>12}{'after p50':>12}{'ratio':>8}")
+    for name in sorted(set(before["latency_ms"]) | set(after["latency_ms"])):
+        b = before["latency_ms"].get(name, {}).get("p50", 0)
+        a = after["latency_ms"].get(name, {}).get("p50", 0)
+        print(f"{name:<20}{b:>12.2f}{a:>12.2f}{_ratio(b, a):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20, help="timed runs per query")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.runs))
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(result, fh, indent=2)
+    if args.compare:
+        with open(args.compare) as fh:
+            print_comparison(json.load(fh), result)
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Redis-backed cache of read-endpoint responses.
+
+Responses are stored as serialized JSON bytes under a key made of the
+current data version (see shared.data_version), the route and the
+normalized query parameters, so a cached page is served without touching
+Postgres or re-encoding JSON. Bodies are encoded with orjson and returned
+as raw Responses, bypassing FastAPI's own serialization. The worker bumps
+the data version when an upload finishes, which orphans every older entry
+at once; anything that changes between bumps (batches of a running
+upload, new explanations) shows up after RESPONSE_CACHE_TTL_SECONDS at
+the latest.
+
+Memory is bounded by RESPONSE_CACHE_MAX_BYTES: a sorted set of last-access
+times and a hash of entry sizes let writes evict the least recently used
+entries, orphaned versions first since nobody reads them. The byte total is
+kept by Lua scripts, so it stays exact under concurrent writers: a re-put
+is charged only its size difference, and entries leave the total when they
+are evicted or, through a sorted set of expiry times, once their TTL has
+passed (reclaimed on the next write). Hits, misses and the time spent
+serving each are counted per route in Redis, so the numbers cover every
+backend process.
+
+Redis errors never fail a request; the response is computed uncached.
+"""
+import hashlib
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+import orjson
+import redis.asyncio as aioredis
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from shared.data_version import DATA_VERSION_KEY, get_data_version, response_cache_settings
+from .core.config import settings
+
+logger = logging.getLogger("backend.cache")
+
+KEY_PREFIX = "respcache:v"
+LRU_KEY = "respcache:lru"
+SIZES_KEY = "respcache:sizes"
+EXPIRES_KEY = "respcache:expires"
+BYTES_KEY = "respcache:bytes"
+STATS_KEY = "respcache:stats"
+EVICT_BATCH = 64
+
+# Store an entry and charge the byte total with its size difference.
+# KEYS: entry, LRU, expires, sizes, bytes; ARGV: body, ttl, now. Returns the new total.
+PUT_SCRIPT = """
+local old = tonumber(redis.call('HGET', KEYS[4], KEYS[1]) or '0')
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+redis.call('ZADD', KEYS[3], ARGV[3] + ARGV[2], KEYS[1])
+redis.call('HSET', KEYS[4], KEYS[1], #ARGV[1])
+return redis.call('INCRBY', KEYS[5], #ARGV[1] - old)
+"""
+
+# Drop up to ARGV[3] entries, expired ones first, then least recently used
+# ones until ARGV[2] bytes are freed, and take them off the byte total.
+# KEYS: LRU, expires, sizes, bytes; ARGV: now, overflow, limit. Returns {entries, bytes}.
+# Entry keys come from the sorted sets, so this assumes a single Redis node.
+RECLAIM_SCRIPT = """
+local limit = tonumber(ARGV[3])
+local freed, dropped = 0, 0
+local function drop(key)
+    freed = freed + tonumber(redis.call('HGET', KEYS[3], key) or '0')
+    dropped = dropped + 1
+    redis.call('DEL', key)
+    redis.call('ZREM', KEYS[1], key)
+    redis.call('ZREM', KEYS[2], key)
+    redis.call('HDEL', KEYS[3], key)
+end
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, limit)) do
+    drop(key)
+end
+while freed < tonumber(ARGV[2]) and dropped < limit do
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0)
+    if #oldest == 0 then break end
+    drop(oldest[1])
+end
+if freed > 0 then redis.call('DECRBY', KEYS[4], freed) end
+return {dropped, freed}
+"""
+
+
+def normalized_query(request: Request) -> str:
+    """Query string with parameters sorted and empty values dropped."""
+    items = sorted((k, v) for k, v in request.query_params.multi_items() if v != "")
+    return "&".join(f"{k}={v}" for k, v in items)
+
+
+def route_name(request: Request) -> str:
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or request.url.path
+
+
+def encode_json(payload: Any) -> bytes:
+    """orjson handles datetimes, UUIDs and numpy scalars natively; anything else goes through FastAPI's encoder."""
+    return orjson.dumps(payload, default=jsonable_encoder, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class ResponseCache:
+    """Data-versioned JSON response cache with TTL and byte-bounded LRU eviction."""
+
+    def __init__(self, url: str = response_cache_settings.RESPONSE_CACHE_REDIS_URL):
+        self.client = aioredis.Redis.from_url(url)
+        self._put_script = self.client.register_script(PUT_SCRIPT)
+        self._reclaim_script = self.client.register_script(RECLAIM_SCRIPT)
+        self.ttl = settings.RESPONSE_CACHE_TTL_SECONDS
+        self.max_bytes = settings.RESPONSE_CACHE_MAX_BYTES
+
+    async def respond(self, request: Request, compute: Callable[[], Awaitable[Any]]) -> Response:
+        """Serve the cached body for this request, or compute, store and serve it."""
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return Response(encode_json(await compute()), media_type="application/json")
+
+        started = time.perf_counter()
+        route = route_name(request)
+        try:
+            version = await get_data_version(self.client)
+            digest = hashlib.sha1(f"{request.url.path}?{normalized_query(request)}".encode("utf-8")).hexdigest()
+            key = f"{KEY_PREFIX}{version}:{digest}"
+            body = await self.client.get(key)
+        except Exception:
+            logger.exception("Response cache lookup failed; serving uncached")
+            return Response(encode_json(await compute()), media_type="application/json")
+
+        if body is not None:
+            await self._record(route, "hits", "hit_ms", started, touch=key)
+            return Response(body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+        body = encode_json(await compute())
+        try:
+            await self._put(key, body)
+            await self._record(route, "misses", "miss_ms", started)
+        except Exception:
+            logger.exception("Failed storing a response in the cache")
+        return Response(body, media_type="application/json", headers={"X-Cache": "MISS"})
+
+    async def _put(self, key: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        total = await self._put_script(
+            keys=[key, LRU_KEY, EXPIRES_KEY, SIZES_KEY, BYTES_KEY], args=[body, self.ttl, time.time()]
+        )
+        await self._reclaim(max(0, total - self.max_bytes))
+
+    async def _reclaim(self, overflow: int) -> None:
+        """Drop expired entries, then least recently used ones until overflow bytes are freed."""
+        freed = dropped = 0
+        while True:
+            entries, batch_bytes = await self._reclaim_script(
+                keys=[LRU_KEY, EXPIRES_KEY, SIZES_KEY, BYTES_KEY],
+                args=[time.time(), overflow - freed, EVICT_BATCH],
+            )
+            freed += batch_bytes
+            dropped += entries
+            if entries < EVICT_BATCH or freed >= overflow:
+                break
+        if dropped:
+            logger.info("Dropped %d expired or evicted cached responses (%d bytes)", dropped, freed)
+
+    async def _record(self, route: str, counter: str, timer: str, started: float, touch: str = None) -> None:
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            if touch:
+                # xx: an entry evicted since the lookup is not re-added
+                pipe.zadd(LRU_KEY, {touch: time.time()}, xx=True)
+            pipe.hincrby(STATS_KEY, f"{route}|{counter}", 1)
+            pipe.hincrbyfloat(STATS_KEY, f"{route}|{timer}", elapsed_ms)
+            await pipe.execute()
+        except Exception:
+            logger.exception("Failed recording response cache stats")
+
+    async def stats(self) -> Dict:
+        """Hit ratio and mean serving latency of hits and misses, overall and per route."""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(STATS_KEY)
+        pipe.get(DATA_VERSION_KEY)
+        pipe.zcard(LRU_KEY)
+        pipe.get(BYTES_KEY)
+        raw, version, entries, size = await pipe.execute()
+
+        routes: Dict[str, Dict[str, float]] = {}
+        for field, value in raw.items():
+            route, metric = field.decode("utf-8").rsplit("|", 1)
+            routes.setdefault(route, {"hits": 0, "misses": 0, "hit_ms": 0.0, "miss_ms": 0.0})[metric] = float(value)
+
+        def summarize(c: Dict[str, float]) -> Dict:
+            lookups = c["hits"] + c["misses"]
+            return {
+                "hits": int(c["hits"]),
+                "misses": int(c["misses"]),
+                "hit_ratio": c["hits"] / lookups if lookups else None,
+                "avg_hit_ms": c["hit_ms"] / c["hits"] if c["hits"] else None,
+                "avg_miss_ms": c["miss_ms"] / c["misses"] if c["misses"] else None,
+            }
+
+        totals = {"hits": 0, "misses": 0, "hit_ms": 0.0, "miss_ms": 0.0}
+        for c in routes.values():
+            for metric in totals:
+                totals[metric] += c[metric]
+        return {
+            "enabled": settings.RESPONSE_CACHE_ENABLED,
+            "data_version": int(version) if version is not None else 0,
+            "entries": entries,
+            "bytes": int(size) if size is not None else 0,
+            "max_bytes": self.max_bytes,
+            **summarize(totals),
+            "routes": {route: summarize(c) for route, c in sorted(routes.items())},
+        }
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+response_cache = ResponseCache()
+
+
+def get_response_cache() -> ResponseCache:
+    return response_cache
@@ -7,6 +7,18 @@ class Settings(BaseSettings):
     JWT_SECRET: str = "MySuperSecretKeyForParamsToken12"
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24
+    STATS_USE_ROLLUPS: bool = True  # Serve /api/stats from event_rollups/anomaly_rollups
+    STATS_RAW_MAX_HOURS: int = 6  # Ranges up to this long are aggregated from raw events instead
+    RESPONSE_CACHE_ENABLED: bool = True  # Cache list/stats responses in Redis (RESPONSE_CACHE_REDIS_URL)
+    RESPONSE_CACHE_TTL_SECONDS: int = 300  # Upper bound on staleness between data-version bumps
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # Least recently used responses are evicted beyond this
+    EXPORT_BATCH_ROWS: int = 5000  # Rows fetched from the export cursor and encoded per streamed chunk
+    MODEL_DIR: str = "/data/models"  # Shared with the worker; holds faiss_index.bin and faiss_metadata.pkl
+    OLLAMA_BASE_URL: str = "http://ollama:11434"
+    EMBEDDINGS_MODEL: str = "nomic-embed-text"  # Must match the worker's model for comparable vectors
+    EMBEDDING_TIMEOUT: int = 30
+    SIMILARITY_RELOAD_SECONDS: int = 60  # How often the Faiss files are checked for a newer index
+    SIMILARITY_MAX_K: int = 100
 
     class Config:
         env_file = ".env"
@@ -1,5 +1,8 @@
-from sqlalchemy import select, insert, func
+from sqlalchemy import select, insert, func, tuple_, or_, literal, literal_column, true, BigInteger, DateTime, Text
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from shared import models
+import ipaddress
+import orjson
 import logging
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -9,64 +12,166 @@ import uuid
 logger = logging.getLogger("backend.crud")
 
 
-async def query_events_with_features(db: AsyncSession, start=None, end=None, ip=None, offset=0, limit=50):
-    """Query events and join anomalies (if present) and include advanced feature metadata stored in anomalies.reason (if structured).
-    Assumes anomalies.reason may contain LLM explanation or a JSON blob with metadata; adapt storage schema as needed.
+def parse_time(value):
+    """Accept ISO strings or datetimes; typed bounds let Postgres prune events partitions."""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def _keyset_after(time_column, id_column, after):
+    """Rows strictly after (time, id) in descending (time, id) order."""
+    ts, row_id = after
+    return tuple_(time_column, id_column) < tuple_(
+        literal(ts, DateTime(timezone=True)), literal(row_id, BigInteger)
+    )
+
+
+def _ip_filter(ip: str):
+    """Exact match for an address, containment (GiST-indexed) for a CIDR. Raises ValueError if invalid."""
+    if "/" in ip:
+        return models.Event.src_ip.op("<<=")(str(ipaddress.ip_network(ip, strict=False)))
+    return models.Event.src_ip == str(ipaddress.ip_address(ip))
+
+
+E = models.Event.__table__
+A = models.Anomaly.__table__
+
+# Output fields of query_events_with_features -> SQL expression. Addresses
+# come back as text and missing first/last seen fall back to the timestamp,
+# so rows need no per-field conversion in Python.
+EVENT_FIELDS = {
+    "id": E.c.id,
+    "upload_id": E.c.upload_id,
+    "timestamp": E.c.timestamp,
+    "src_ip": func.host(E.c.src_ip),
+    "dest_ip": func.host(E.c.dest_ip),
+    "user_agent": E.c.user_agent,
+    "username": E.c.username,
+    "url": E.c.url,
+    "method": E.c.method,
+    "status": E.c.status,
+    "bytes": E.c.bytes,
+    "src_country": E.c.src_country,
+    "src_asn": E.c.src_asn,
+    "dest_country": E.c.dest_country,
+    "dest_asn": E.c.dest_asn,
+    "count": E.c.count,
+    "first_seen": func.coalesce(E.c.first_seen, E.c.timestamp),
+    "last_seen": func.coalesce(E.c.last_seen, E.c.timestamp),
+}
+# Always returned: they are the keyset cursor
+KEY_FIELDS = ("id", "timestamp")
+
+
+def _event_anomalies():
+    """LATERAL subquery: an event's anomalies as one JSON array (NULL when there are none)."""
+    anomaly = func.json_build_object(
+        literal_column("'id'"), A.c.id,
+        literal_column("'detector'"), A.c.detector,
+        literal_column("'score'"), A.c.score,
+        literal_column("'reason'"), A.c.reason,
+        literal_column("'created_at'"), A.c.created_at,
+    )
+    return (
+        select(func.json_agg(aggregate_order_by(anomaly, A.c.id)).cast(Text).label("anomalies"))
+        .where(A.c.event_id == E.c.id, A.c.event_timestamp == E.c.timestamp)
+        .lateral("event_anomalies")
+    )
+
+
+def events_select(start=None, end=None, ip=None, fields=None):
+    """Select of EVENT_FIELDS (plus "anomalies" as a JSON text array) matching the
+    listing filters, newest first, or only the requested fields; id and timestamp
+    are always included. Returns (statement, field names). Raises ValueError for
+    unknown fields, an unparseable time bound or ip/CIDR.
     """
-    # Simple approach: fetch events, then fetch anomalies for event ids
-    stmt = select(models.Event).order_by(models.Event.timestamp.desc()).offset(offset).limit(limit)
+    names = list(EVENT_FIELDS) + ["anomalies"]
+    if fields:
+        unknown = set(fields) - set(names)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        names = [n for n in names if n in fields or n in KEY_FIELDS]
+
+    start, end = parse_time(start), parse_time(end)
+    columns = [EVENT_FIELDS[n].label(n) for n in names if n != "anomalies"]
+    stmt = select(*columns).select_from(E)
+    if "anomalies" in names:
+        event_anomalies = _event_anomalies()
+        stmt = stmt.add_columns(event_anomalies.c.anomalies).outerjoin(event_anomalies, true())
+    stmt = stmt.order_by(E.c.timestamp.desc(), E.c.id.desc())
     if start:
-        stmt = stmt.where(models.Event.timestamp >= start)
+        stmt = stmt.where(E.c.timestamp >= start)
     if end:
-        stmt = stmt.where(models.Event.timestamp <= end)
+        stmt = stmt.where(E.c.timestamp <= end)
     if ip:
-        stmt = stmt.where(models.Event.src_ip == ip)
-    res = await db.execute(stmt)
-    events = res.scalars().all()
-
-
-    event_ids = [e.id for e in events]
-    anomalies = {}
-    if event_ids:
-        stmt2 = select(models.Anomaly).where(models.Anomaly.event_id.in_(event_ids))
-        res2 = await db.execute(stmt2)
-        for a in res2.scalars().all():
-            anomalies.setdefault(a.event_id, []).append(a)
-
-
-    # Build unified output
-    out = []
-    for e in events:
-        e_out = {
-            "id": e.id,
-            "upload_id": str(e.upload_id) if e.upload_id else None,
-            "timestamp": e.timestamp.isoformat() if e.timestamp else None,
-            "src_ip": str(e.src_ip) if e.src_ip else None,
-            "dest_ip": str(e.dest_ip) if e.dest_ip else None,
-            "user_agent": e.user_agent,
-            "username": e.username,
-            "url": e.url,
-            "method": e.method,
-            "status": e.status,
-            "bytes": e.bytes,
-            "raw_line": e.raw_line,
-            "anomalies": []
-        }
-        for a in anomalies.get(e.id, []):
-            # try parse numeric score
-            try:
-                score = float(a.score)
-            except Exception:
-                score = None
-            e_out["anomalies"].append({
-                "id": a.id,
-                "detector": a.detector,
-                "score": score,
-                "reason": a.reason,
-                "created_at": a.created_at.isoformat() if a.created_at else None
-            })
-        out.append(e_out)
-    return out
+        stmt = stmt.where(_ip_filter(ip))
+    return stmt, names
+
+
+def _decode_anomalies(rows, names):
+    if "anomalies" in names:
+        for r in rows:
+            r["anomalies"] = orjson.loads(r["anomalies"]) if r["anomalies"] else []
+    return rows
+
+
+async def query_events_with_features(db: AsyncSession, start=None, end=None, ip=None, offset=0, limit=50, after=None, fields=None):
+    """Events with their anomalies, in one round trip.
+    Events are ordered by (timestamp, id) descending; after=(timestamp, id) selects the
+    rows following that key (keyset pagination) instead of using offset. fields limits
+    the output as in events_select. Rows are plain dicts with datetime/UUID values,
+    meant for orjson. Raises ValueError like events_select.
+    """
+    stmt, names = events_select(start, end, ip, fields)
+    stmt = stmt.limit(limit)
+    if after:
+        stmt = stmt.where(_keyset_after(E.c.timestamp, E.c.id, after))
+    else:
+        stmt = stmt.offset(offset)
+
+    rows = [dict(r) for r in (await db.execute(stmt)).mappings()]
+    return _decode_anomalies(rows, names)
+
+# Columns searched by search_events, each with a pg_trgm GIN index
+SEARCH_COLUMNS = {"url": E.c.url, "user_agent": E.c.user_agent}
+SEARCH_MIN_LENGTH = 3  # Shorter terms have no trigrams to look up
+
+
+def _like_escape(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_events(db: AsyncSession, q: str, columns=None, start=None, end=None, ip=None,
+                        order="recent", offset=0, limit=50, after=None, fields=None):
+    """Events whose searched columns contain q (case-insensitive substring), with a
+    "rank": the best pg_trgm word_similarity of q to the matched columns.
+    order="recent" lists matches newest first and pages with after (keyset) like
+    query_events_with_features; order="relevance" sorts by rank and pages with offset.
+    Raises ValueError for unknown columns, a too short term and the events_select errors.
+    """
+    columns = columns or list(SEARCH_COLUMNS)
+    unknown = set(columns) - set(SEARCH_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown search columns: {', '.join(sorted(unknown))}")
+    if len(q) < SEARCH_MIN_LENGTH:
+        raise ValueError(f"Search terms need at least {SEARCH_MIN_LENGTH} characters")
+
+    stmt, names = events_select(start, end, ip, fields)
+    pattern = f"%{_like_escape(q)}%"
+    searched = [SEARCH_COLUMNS[c] for c in columns]
+    rank = func.greatest(*[func.word_similarity(literal(q, Text), c) for c in searched])
+    stmt = stmt.add_columns(func.coalesce(rank, 0.0).label("rank")).where(or_(*[c.ilike(pattern) for c in searched]))
+    if order == "relevance":
+        stmt = stmt.order_by(None).order_by(literal_column("rank").desc(), E.c.timestamp.desc(), E.c.id.desc())
+        stmt = stmt.offset(offset)
+    elif after:
+        stmt = stmt.where(_keyset_after(E.c.timestamp, E.c.id, after))
+    else:
+        stmt = stmt.offset(offset)
+
+    rows = [dict(r) for r in (await db.execute(stmt.limit(limit))).mappings()]
+    return _decode_anomalies(rows, names)
 
 async def get_user_by_username(db: AsyncSession, username: str):
     stmt = select(models.User).where(models.User.username == username)
@@ -105,13 +210,14 @@ async def insert_event_bulk(db: AsyncSession, events: list):
 
 
 async def query_events(db: AsyncSession, start=None, end=None, ip=None, offset=0, limit=50):
+    start, end = parse_time(start), parse_time(end)
     stmt = select(models.Event)
     if start:
         stmt = stmt.where(models.Event.timestamp >= start)
     if end:
         stmt = stmt.where(models.Event.timestamp <= end)
     if ip:
-        stmt = stmt.where(models.Event.src_ip == ip)
+        stmt = stmt.where(_ip_filter(ip))
     stmt = stmt.offset(offset).limit(limit).order_by(models.Event.timestamp.desc())
     res = await db.execute(stmt)
     return res.scalars().all()
@@ -123,12 +229,44 @@ async def get_event(db: AsyncSession, event_id: int):
     return res.scalars().first()
 
 
-async def query_anomalies(db: AsyncSession, offset=0, limit=50):
-    stmt = select(models.Anomaly).offset(offset).limit(limit).order_by(models.Anomaly.created_at.desc())
+async def query_anomalies(db: AsyncSession, offset=0, limit=50, after=None):
+    """Newest first by (created_at, id); after=(created_at, id) for keyset pagination."""
+    stmt = select(models.Anomaly).order_by(models.Anomaly.created_at.desc(), models.Anomaly.id.desc()).limit(limit)
+    if after:
+        stmt = stmt.where(_keyset_after(models.Anomaly.created_at, models.Anomaly.id, after))
+    else:
+        stmt = stmt.offset(offset)
     res = await db.execute(stmt)
     return res.scalars().all()
 
 async def get_user_count(db: AsyncSession):
     stmt = select(func.count()).select_from(models.User)
     res = await db.execute(stmt)
-    return res.scalar() or 0
\ No newline at end of file
+    return res.scalar() or 0
+
+
+async def query_incidents(db: AsyncSession, upload_id=None, offset=0, limit=50):
+    stmt = select(models.Incident)
+    if upload_id:
+        stmt = stmt.where(models.Incident.upload_id == upload_id)
+    stmt = stmt.order_by(models.Incident.last_seen.desc().nulls_last(), models.Incident.id.desc()).offset(offset).limit(limit)
+    res = await db.execute(stmt)
+    return res.scalars().all()
+
+
+async def get_incident(db: AsyncSession, incident_id: int):
+    stmt = select(models.Incident).where(models.Incident.id == incident_id)
+    res = await db.execute(stmt)
+    return res.scalars().first()
+
+
+async def query_incident_anomalies(db: AsyncSession, incident_id: int, offset=0, limit=50):
+    stmt = (
+        select(models.Anomaly)
+        .where(models.Anomaly.incident_id == incident_id)
+        .order_by(models.Anomaly.id)
+        .offset(offset)
+        .limit(limit)
+    )
+    res = await db.execute(stmt)
+    return res.scalars().all()
@@ -0,0 +1,205 @@
+"""
+Streaming bulk export of events and anomalies.
+
+Rows are read through a server-side cursor (AsyncSession.stream with
+yield_per) EXPORT_BATCH_ROWS at a time and each batch is encoded and
+handed to the StreamingResponse before the next one is fetched, so memory
+stays constant whatever the size of the export:
+
+- ndjson: one JSON object per line (orjson); event anomalies are nested.
+- csv: header plus one line per row; nested anomalies are a JSON string.
+- parquet: one row group per batch, written with pyarrow (imported only
+  when a Parquet export is requested).
+
+With gzip, NDJSON and CSV are sent as a .gz file; Parquet, whose pages are
+already compressed, uses gzip as its internal codec instead of snappy.
+
+The stream opens its own session: the request's session dependency is
+closed once the endpoint returns, before the body is streamed.
+"""
+import csv
+import io
+import zlib
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Sequence
+
+import orjson
+from sqlalchemy import select, types as sqltypes
+
+from shared import models
+from shared.db import AsyncSessionLocal
+from .core.config import settings
+
+logger = logging.getLogger("backend.export")
+
+FORMATS = ("ndjson", "csv", "parquet")
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+ANOMALY_FIELDS = ("id", "event_id", "event_timestamp", "detector", "score", "reason", "created_at")
+
+
+
+def anomalies_select(start=None, end=None, min_score=None):
+    """Anomalies in an event-time range, in table order (bounds prune the anomalies partitions)."""
+    A = models.Anomaly
+    stmt = select(*[getattr(A, name).label(name) for name in ANOMALY_FIELDS])
+    if start:
+        stmt = stmt.where(A.event_timestamp >= start)
+    if end:
+        stmt = stmt.where(A.event_timestamp <= end)
+    if min_score is not None:
+        stmt = stmt.where(A.score >= min_score)
+    return stmt
+
+
+def check_format(fmt: str) -> None:
+    """Raises ValueError for formats that cannot be produced here, before any byte is streamed."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt!r}")
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ValueError("Parquet export requires pyarrow")
+
+
+def filename(kind: str, fmt: str, gzip: bool) -> str:
+    return f"{kind}.{fmt}" + (".gz" if gzip and fmt != "parquet" else "")
+
+
+def media_type(fmt: str, gzip: bool) -> str:
+    return "application/gzip" if gzip and fmt != "parquet" else MEDIA_TYPES[fmt]
+
+
+async def _batches(stmt) -> AsyncIterator[List[Dict]]:
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=settings.EXPORT_BATCH_ROWS))
+        async for partition in result.mappings().partitions():
+            yield [dict(r) for r in partition]
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _ndjson(rows: Sequence[Dict]) -> bytes:
+    for r in rows:
+        if "anomalies" in r:
+            r["anomalies"] = orjson.loads(r["anomalies"]) if r["anomalies"] else []
+    return b"".join(orjson.dumps(r) + b"\n" for r in rows)
+
+
+def _csv(rows: Iterable[Iterable]) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last take();
+    tell() keeps counting so the Parquet footer offsets stay right."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def arrow_type(pa, sql_type):
+    """Arrow type for a column's SQL type; text, UUIDs, addresses and anything else are strings."""
+    if isinstance(sql_type, sqltypes.Integer):
+        return pa.int64()
+    if isinstance(sql_type, (sqltypes.Float, sqltypes.Numeric)):
+        return pa.float64()
+    if isinstance(sql_type, sqltypes.Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, sqltypes.DateTime):
+        return pa.timestamp("us", tz="UTC" if sql_type.timezone else None)
+    return pa.string()
+
+
+def arrow_schema(pa, stmt, names: Sequence[str]):
+    """Schema of stmt's labelled columns, typed from the table columns they select."""
+    columns = stmt.selected_columns
+    return pa.schema([(n, arrow_type(pa, columns[n].type)) for n in names])
+
+
+class _ParquetEncoder:
+    def __init__(self, stmt, names: Sequence[str], compression: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = arrow_schema(pa, stmt, names)
+        self.stringify = [n for n in names if self.schema.field(n).type == pa.string()]
+        self.sink = _Sink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression=compression)
+
+    def __call__(self, rows: Sequence[Dict]) -> bytes:
+        for r in rows:
+            for n in self.stringify:
+                if r[n] is not None and not isinstance(r[n], str):
+                    r[n] = str(r[n])
+        self.writer.write_table(self.pa.Table.from_pylist(list(rows), schema=self.schema))
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.take()
+
+
+async def stream_export(stmt, names: Iterable[str], fmt: str, gzip: bool = False) -> AsyncIterator[bytes]:
+    """Encoded export of stmt's rows (labelled with names) in chunks of one batch."""
+    names = list(names)
+    check_format(fmt)
+    head = b""
+    if fmt == "parquet":
+        encode = _ParquetEncoder(stmt, names, "gzip" if gzip else "snappy")
+        gzip = False
+    elif fmt == "csv":
+        head = _csv([names])
+        encode = lambda rows: _csv([_text(r[n]) for n in names] for r in rows)
+    else:
+        encode = _ndjson
+    # wbits=31 writes a gzip container rather than a raw zlib stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    if head:
+        yield compressor.compress(head) if compressor else head
+    rows = 0
+    async for batch in _batches(stmt):
+        rows += len(batch)
+        chunk = encode(batch)
+        if compressor:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    tail = encode.close() if fmt == "parquet" else b""
+    if compressor:
+        tail = compressor.compress(tail) + compressor.flush()
+    if tail:
+        yield tail
+    logger.info("Exported %d rows as %s%s", rows, fmt, " (gzip)" if compressor else "")
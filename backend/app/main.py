@@ -8,6 +8,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from .core.config import settings
 from shared.db import init_db, engine
 from .api import router as api_router
+from .cache import response_cache
+from .similarity import similarity_index
 
 
 logger = logging.getLogger("backend")
@@ -29,11 +31,15 @@ async def on_startup():
     logger.info("Starting up application")
     # Initialize DB (create missing tables in dev) - optional
     await init_db()
+    # Warm the similarity index so the first search does not pay for loading it
+    await similarity_index.refresh(force=True)
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
     logger.info("Shutting down application")
+    await response_cache.close()
+    await similarity_index.close()
 
 
 # Health check
@@ -0,0 +1,28 @@
+"""
+Opaque keyset cursors.
+
+A cursor holds the sort key (a timestamp and an id) of the last row of a
+page; the next page is the rows strictly after it in the listing order.
+Unlike OFFSET, the cost of a page does not depend on how deep it is, and
+rows inserted meanwhile cannot shift or repeat rows across pages.
+"""
+import json
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+def encode_cursor(timestamp: Optional[str], row_id: int) -> str:
+    """timestamp is the ISO string already used in the response."""
+    payload = json.dumps([timestamp, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    """Raises ValueError for malformed tokens."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
@@ -0,0 +1,34 @@
+"""
+Backfill or rebuild the dashboard rollup tables from events and anomalies.
+
+    python -m app.rebuild_rollups                      # everything
+    python -m app.rebuild_rollups --start 2025-01-01 --end 2025-01-08
+"""
+import asyncio
+import argparse
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.core.config import settings
+from app.crud import parse_time
+from shared.db import Base
+from shared import models  # noqa: F401 - registers tables on Base.metadata
+from shared.rollups import rebuild_rollups
+
+
+async def rebuild(start=None, end=None):
+    print(f"Connecting to {settings.DATABASE_URL}")
+    engine = create_async_engine(settings.DATABASE_URL)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        print(f"Rebuilding rollups for {start or 'the beginning'} - {end or 'now'}...")
+        counts = await rebuild_rollups(conn, parse_time(start), parse_time(end))
+        print(f"Inserted {counts['event_rollups']} event and {counts['anomaly_rollups']} anomaly rollup rows.")
+
+    await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild event/anomaly rollups")
+    parser.add_argument("--start", help="ISO time; rebuilt from the start of its hour")
+    parser.add_argument("--end", help="ISO time; rebuilt up to the end of its hour")
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.start, args.end))
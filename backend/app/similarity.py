@@ -0,0 +1,218 @@
+"""
+Nearest-neighbour search over the worker's Faiss index of event embeddings.
+
+The worker appends the vectors of embedded events to faiss_index.bin and
+their {event_id, upload_id, timestamp} to faiss_metadata.pkl in the models
+volume after each upload. SimilarityIndex keeps that index loaded for the
+lifetime of the backend process: it is read once at startup and re-read in
+a worker thread when the files change (checked at most every
+SIMILARITY_RELOAD_SECONDS), while queries keep using the previous copy, so
+a search is an in-memory Faiss lookup with no SQL scan.
+
+Query vectors are the stored vector of an event when it was embedded, or
+else an embedding of the same text the worker embeds, requested from
+Ollama like free-text queries. Distances are Faiss IndexFlatL2 distances
+(squared L2), lower is closer.
+"""
+import asyncio
+import logging
+import os
+import pickle
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import orjson
+from filelock import FileLock
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+    logging.warning("Faiss not installed, similarity search will not work")
+
+from .core.config import settings
+from .crud import events_select, parse_time, E
+
+logger = logging.getLogger("backend.similarity")
+
+FAISS_INDEX_PATH = os.path.join(settings.MODEL_DIR, "faiss_index.bin")
+FAISS_METADATA_PATH = os.path.join(settings.MODEL_DIR, "faiss_metadata.pkl")
+
+
+class SimilarityUnavailable(Exception):
+    """The index is not loaded or a query vector could not be produced."""
+
+
+def event_text(event) -> str:
+    """Same text as the worker's prepare_log_text, so embeddings are comparable."""
+    parts = []
+    if event.timestamp:
+        parts.append(str(event.timestamp))
+    if event.src_ip:
+        parts.append(f"IP:{event.src_ip}")
+    parts.append(f"{event.method or 'UNKNOWN'} {event.url or '/'} {event.status or 0}")
+    if event.user_agent:
+        parts.append(f"UA:{event.user_agent[:100]}")
+    if event.username:
+        parts.append(f"User:{event.username}")
+    return " | ".join(parts)
+
+
+class _Snapshot:
+    """One loaded copy of the index with its metadata."""
+
+    def __init__(self, index, metadata: List[Dict], mtime: float):
+        self.index = index
+        self.metadata = metadata
+        self.mtime = mtime
+        self.positions = {m["event_id"]: i for i, m in enumerate(metadata)}
+
+
+class SimilarityIndex:
+    """Warm, periodically refreshed Faiss index with event lookups and kNN search."""
+
+    def __init__(self, index_path: str = FAISS_INDEX_PATH, metadata_path: str = FAISS_METADATA_PATH):
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.snapshot: Optional[_Snapshot] = None
+        self._checked_at = 0.0
+        self._reload_lock = asyncio.Lock()
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return max(os.path.getmtime(self.index_path), os.path.getmtime(self.metadata_path))
+        except OSError:
+            return None
+
+    def _load(self, mtime: float) -> _Snapshot:
+        # Same lock file as the worker's FaissVectorStore.save()
+        with FileLock(f"{self.index_path}.lock", timeout=10):
+            index = faiss.read_index(self.index_path)
+            with open(self.metadata_path, "rb") as f:
+                metadata = pickle.load(f)["metadata"]
+        return _Snapshot(index, metadata, mtime)
+
+    async def refresh(self, force: bool = False) -> None:
+        """Load the index if the files changed since the last load."""
+        if faiss is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < settings.SIMILARITY_RELOAD_SECONDS:
+            return
+        async with self._reload_lock:
+            if not force and now - self._checked_at < settings.SIMILARITY_RELOAD_SECONDS:
+                return
+            self._checked_at = now
+            mtime = self._mtime()
+            if mtime is None or (self.snapshot and self.snapshot.mtime >= mtime):
+                return
+            try:
+                started = time.perf_counter()
+                self.snapshot = await asyncio.to_thread(self._load, mtime)
+                logger.info(
+                    "Loaded Faiss index with %d vectors in %.0f ms",
+                    self.snapshot.index.ntotal, (time.perf_counter() - started) * 1000,
+                )
+            except Exception:
+                logger.exception("Failed loading the Faiss index; keeping the previous one")
+
+    def _ready(self) -> _Snapshot:
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.index.ntotal == 0:
+            raise SimilarityUnavailable("No event embeddings have been indexed yet")
+        return snapshot
+
+    def vector_of(self, event_id: int) -> Optional[np.ndarray]:
+        """Stored vector of an event, or None when it was not embedded."""
+        snapshot = self._ready()
+        position = snapshot.positions.get(event_id)
+        if position is None:
+            return None
+        return snapshot.index.reconstruct(position)
+
+    async def embed(self, text: str) -> np.ndarray:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=settings.EMBEDDING_TIMEOUT)
+        try:
+            response = await self._http.post(
+                f"{settings.OLLAMA_BASE_URL}/api/embeddings",
+                json={"model": settings.EMBEDDINGS_MODEL, "prompt": text},
+            )
+            response.raise_for_status()
+            vector = np.asarray(response.json()["embedding"], dtype=np.float32)
+        except Exception as e:
+            logger.exception("Failed embedding a similarity query")
+            raise SimilarityUnavailable("Embedding service unavailable") from e
+        if not vector.any():
+            raise SimilarityUnavailable("Embedding service returned an empty vector")
+        return vector
+
+    async def search(self, vector: np.ndarray, k: int, exclude: Optional[int] = None) -> List[Tuple[Dict, float]]:
+        """(metadata, distance) of the k nearest indexed events, closest first."""
+        snapshot = self._ready()
+        query = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, -1)
+        if query.shape[1] != snapshot.index.d:
+            raise SimilarityUnavailable(f"Query dimension {query.shape[1]} does not match the index ({snapshot.index.d})")
+        # Faiss releases the GIL, so large flat scans do not stall the event loop
+        n = min(k + (1 if exclude is not None else 0), snapshot.index.ntotal)
+        distances, positions = await asyncio.to_thread(snapshot.index.search, query, n)
+        out = []
+        for distance, position in zip(distances[0], positions[0]):
+            if position < 0:
+                continue
+            meta = snapshot.metadata[position]
+            if meta["event_id"] == exclude:
+                continue
+            out.append((meta, float(distance)))
+        return out[:k]
+
+    def stats(self) -> Dict:
+        snapshot = self.snapshot
+        return {
+            "available": faiss is not None,
+            "vectors": snapshot.index.ntotal if snapshot else 0,
+            "dimension": snapshot.index.d if snapshot else None,
+            "loaded_mtime": snapshot.mtime if snapshot else None,
+        }
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+
+
+async def nearest_events(db, index: SimilarityIndex, vector: np.ndarray, k: int,
+                         exclude: Optional[int] = None, fields=None) -> List[Dict]:
+    """Nearest events as listing rows plus "distance", closest first. Neighbours
+    whose events are gone (retention) are skipped."""
+    hits = await index.search(vector, k, exclude)
+    if not hits:
+        return []
+    stmt, _ = events_select(fields=fields)
+    stmt = stmt.order_by(None).where(E.c.id.in_([meta["event_id"] for meta, _ in hits]))
+    timestamps = [parse_time(meta.get("timestamp")) for meta, _ in hits]
+    if all(timestamps):
+        # Bounds the lookup to the partitions holding the neighbours
+        stmt = stmt.where(E.c.timestamp.between(min(timestamps), max(timestamps)))
+    rows = {r["id"]: dict(r) for r in (await db.execute(stmt)).mappings()}
+
+    out = []
+    for meta, distance in hits:
+        row = rows.get(meta["event_id"])
+        if row is None:
+            continue
+        if "anomalies" in row:
+            row["anomalies"] = orjson.loads(row["anomalies"]) if row["anomalies"] else []
+        row["distance"] = distance
+        out.append(row)
+    return out
+
+
+similarity_index = SimilarityIndex()
+
+
+async def get_similarity_index() -> SimilarityIndex:
+    await similarity_index.refresh()
+    return similarity_index
@@ -40,8 +40,8 @@ Rules:
 6. If the user asks something impossible or unrelated to data, return a simple SELECT that returns zero rows.
 
 Database Schema:
-- events(id, upload_id, timestamp, src_ip, dest_ip, user_agent, username, url, method, status, bytes)
-- anomalies(id, event_id, detector, score, reason, created_at)
+- events(id, upload_id, timestamp, src_ip INET, dest_ip INET, user_agent, username, url, method, status, bytes)
+- anomalies(id, event_id, detector, score DOUBLE PRECISION, reason, created_at)
 - uploads(id, filename, size_bytes, status, created_at)
 """
 
@@ -104,8 +104,8 @@ async def process_natural_language_query(user_prompt: str) -> str:
         system_prompt = """You are a helpful cybersecurity analyst assistant with access to a PostgreSQL database.
 
 The database contains the following tables:
-- events(id, upload_id, timestamp, src_ip, dest_ip, user_agent, username, url, method, status, bytes)
-- anomalies(id, event_id, detector, score, reason, created_at)
+- events(id, upload_id, timestamp, src_ip INET, dest_ip INET, user_agent, username, url, method, status, bytes)
+- anomalies(id, event_id, detector, score DOUBLE PRECISION, reason, created_at)
 - uploads(id, filename, size_bytes, status, created_at)
 
 When users ask questions about their data:
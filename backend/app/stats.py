@@ -0,0 +1,299 @@
+"""
+Dashboard aggregations computed in SQL over the whole dataset.
+
+Every query takes an optional time range and upload. Queries are served
+from the rollup tables (see shared.rollups) when the dimension is rolled
+up, at minute resolution for minute buckets and ranges up to two days and
+hourly otherwise; rollup ranges are widened to whole buckets. Ranges up to
+STATS_RAW_MAX_HOURS, and dimensions without rollups, are aggregated from
+the raw tables, with time bounds on the partition keys
+(events.timestamp, anomalies.event_timestamp) so Postgres only scans the
+partitions in range. Request volumes sum events.count, so collapsed
+duplicate lines count as all their occurrences.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, func, and_, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared import models
+from shared.rollups import EVENT_DIMENSIONS, truncate
+from .core.config import settings
+
+logger = logging.getLogger("backend.stats")
+
+Event = models.Event
+Anomaly = models.Anomaly
+EventRollup = models.EventRollup
+AnomalyRollup = models.AnomalyRollup
+
+BUCKETS = ("minute", "hour", "day")
+MINUTE_ROLLUP_MAX_RANGE = timedelta(days=2)
+
+# Host part of absolute URLs, like urlparse().netloc in the parser. Constants
+# are inlined so grouped expressions compare equal to the selected ones.
+DOMAIN = func.substring(Event.url, literal_column(r"'^[A-Za-z][A-Za-z0-9+.-]*://([^/?#]+)'"))
+
+TOP_FIELDS = {
+    "src_ip": Event.src_ip,
+    "dest_ip": Event.dest_ip,
+    "domain": DOMAIN,
+    "url": Event.url,
+    "username": Event.username,
+    "user_agent": Event.user_agent,
+}
+HISTOGRAM_FIELDS = {
+    "status": Event.status,
+    "method": Event.method,
+    "src_country": Event.src_country,
+}
+
+REQUESTS = func.coalesce(func.sum(Event.count), literal_column("0"))
+
+
+def event_filters(start=None, end=None, upload_id=None) -> list:
+    filters = []
+    if start:
+        filters.append(Event.timestamp >= start)
+    if end:
+        filters.append(Event.timestamp <= end)
+    if upload_id:
+        filters.append(Event.upload_id == upload_id)
+    return filters
+
+
+def anomaly_filters(start=None, end=None) -> list:
+    filters = []
+    if start:
+        filters.append(Anomaly.event_timestamp >= start)
+    if end:
+        filters.append(Anomaly.event_timestamp <= end)
+    return filters
+
+
+def _anomalies_from(stmt, start=None, end=None, upload_id=None):
+    """Anomalies in range; the upload lives on the event, joined only when filtering by it."""
+    stmt = stmt.where(*anomaly_filters(start, end))
+    if upload_id:
+        stmt = stmt.join(
+            Event, and_(Event.id == Anomaly.event_id, Event.timestamp == Anomaly.event_timestamp)
+        ).where(*event_filters(start, end, upload_id))
+    return stmt
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Aware UTC datetime; naive values (e.g. ISO strings without an offset) are taken as UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def rollup_resolution(start=None, end=None, bucket: Optional[str] = None) -> Optional[str]:
+    """Rollup resolution to answer a query from, or None to aggregate raw rows."""
+    if not settings.STATS_USE_ROLLUPS:
+        return None
+    # A naive bound minus an aware one raises TypeError
+    start, end = as_utc(start), as_utc(end)
+    bounded = start is not None and end is not None
+    if bounded and end - start <= timedelta(hours=settings.STATS_RAW_MAX_HOURS):
+        return None
+    if bucket == "minute" or (bounded and end - start <= MINUTE_ROLLUP_MAX_RANGE):
+        return "minute"
+    return "hour"
+
+
+def rollup_filters(model, resolution: str, start=None, end=None, upload_id=None) -> list:
+    filters = [model.resolution == resolution]
+    if start:
+        # Rollup buckets are UTC minutes and hours
+        filters.append(model.bucket >= truncate(as_utc(start), resolution))
+    if end:
+        filters.append(model.bucket <= end)
+    if upload_id:
+        filters.append(model.upload_id == upload_id)
+    return filters
+
+
+def _bucket(column, bucket: str):
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unsupported bucket: {bucket!r}")
+    return func.date_trunc(literal_column(f"'{bucket}'"), column)
+
+
+def _rollup_bucket(model, resolution: str, bucket: str):
+    """Rollup buckets, coarsened to the requested bucket when it is wider."""
+    if bucket == resolution:
+        return model.bucket.label("bucket")
+    return _bucket(model.bucket, bucket).label("bucket")
+
+
+def _iso(value) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+async def summary(db: AsyncSession, start=None, end=None, upload_id=None) -> Dict:
+    resolution = rollup_resolution(start, end)
+    if resolution:
+        filters = rollup_filters(EventRollup, resolution, start, end, upload_id)
+        requests, events = (await db.execute(
+            select(func.coalesce(func.sum(EventRollup.requests), 0), func.coalesce(func.sum(EventRollup.events), 0))
+            .where(EventRollup.dimension == "total", *filters)
+        )).one()
+        unique_ips = (await db.execute(
+            select(func.count(func.distinct(EventRollup.value)))
+            .where(EventRollup.dimension == "src_ip", EventRollup.value != "", *filters)
+        )).scalar()
+        anomalies = (await db.execute(
+            select(func.coalesce(func.sum(AnomalyRollup.count), 0))
+            .where(*rollup_filters(AnomalyRollup, resolution, start, end, upload_id))
+        )).scalar()
+        # First/last event times are cheap on the (timestamp, id) index
+        first, last = (await db.execute(
+            select(func.min(Event.timestamp), func.max(Event.timestamp)).where(*event_filters(start, end, upload_id))
+        )).one()
+    else:
+        res = await db.execute(
+            select(
+                REQUESTS,
+                func.count(),
+                func.count(func.distinct(Event.src_ip)),
+                func.min(Event.timestamp),
+                func.max(Event.timestamp),
+            ).where(*event_filters(start, end, upload_id))
+        )
+        requests, events, unique_ips, first, last = res.one()
+        anomalies = (await db.execute(
+            _anomalies_from(select(func.count()).select_from(Anomaly), start, end, upload_id)
+        )).scalar()
+    return {
+        "requests": int(requests),
+        "events": int(events),
+        "anomalies": int(anomalies),
+        "unique_ips": unique_ips,
+        "first_seen": _iso(first),
+        "last_seen": _iso(last),
+    }
+
+
+async def top_values(db: AsyncSession, field: str, limit: int = 10, start=None, end=None, upload_id=None) -> List[Dict]:
+    column = TOP_FIELDS.get(field)
+    if column is None:
+        raise ValueError(f"Unsupported field: {field!r}")
+    resolution = rollup_resolution(start, end) if field in EVENT_DIMENSIONS else None
+    if resolution:
+        stmt = _rollup_values(field, resolution, start, end, upload_id).limit(limit)
+    else:
+        value, requests = column.label("value"), REQUESTS.label("count")
+        stmt = (
+            select(value, requests)
+            .where(column.is_not(None), *event_filters(start, end, upload_id))
+            .group_by(value)
+            .order_by(requests.desc())
+            .limit(limit)
+        )
+    return [{"value": str(v), "count": int(c)} for v, c in (await db.execute(stmt)).all()]
+
+
+def _rollup_values(dimension: str, resolution: str, start=None, end=None, upload_id=None, skip_missing=True):
+    """Requests per value of a rolled-up dimension, heaviest first."""
+    requests = func.sum(EventRollup.requests).label("count")
+    filters = rollup_filters(EventRollup, resolution, start, end, upload_id)
+    if skip_missing:
+        filters.append(EventRollup.value != "")
+    return (
+        select(EventRollup.value, requests)
+        .where(EventRollup.dimension == dimension, *filters)
+        .group_by(EventRollup.value)
+        .order_by(requests.desc())
+    )
+
+
+async def histogram(db: AsyncSession, field: str, start=None, end=None, upload_id=None) -> List[Dict]:
+    column = HISTOGRAM_FIELDS.get(field)
+    if column is None:
+        raise ValueError(f"Unsupported field: {field!r}")
+    resolution = rollup_resolution(start, end) if field in EVENT_DIMENSIONS else None
+    if resolution:
+        rows = (await db.execute(_rollup_values(field, resolution, start, end, upload_id, skip_missing=False))).all()
+        # Rollup values are text with "" for missing; status codes go back to numbers
+        return [
+            {"value": (int(v) if field == "status" else v) if v else None, "count": int(c)}
+            for v, c in rows
+        ]
+    value, requests = column.label("value"), REQUESTS.label("count")
+    stmt = (
+        select(value, requests)
+        .where(*event_filters(start, end, upload_id))
+        .group_by(value)
+        .order_by(requests.desc())
+    )
+    return [{"value": v, "count": int(c)} for v, c in (await db.execute(stmt)).all()]
+
+
+async def timeline(db: AsyncSession, bucket: str = "hour", start=None, end=None, upload_id=None) -> List[Dict]:
+    """Requests and anomalies per time bucket."""
+    resolution = rollup_resolution(start, end, bucket)
+    if resolution:
+        events_bucket = _rollup_bucket(EventRollup, resolution, bucket)
+        rows = (await db.execute(
+            select(events_bucket, func.sum(EventRollup.requests))
+            .where(EventRollup.dimension == "total", *rollup_filters(EventRollup, resolution, start, end, upload_id))
+            .group_by(events_bucket)
+        )).all()
+        anomalies_bucket = _rollup_bucket(AnomalyRollup, resolution, bucket)
+        anomaly_rows = (await db.execute(
+            select(anomalies_bucket, func.sum(AnomalyRollup.count))
+            .where(*rollup_filters(AnomalyRollup, resolution, start, end, upload_id))
+            .group_by(anomalies_bucket)
+        )).all()
+    else:
+        events_bucket = _bucket(Event.timestamp, bucket).label("bucket")
+        rows = (await db.execute(
+            select(events_bucket, REQUESTS)
+            .where(*event_filters(start, end, upload_id))
+            .group_by(events_bucket)
+        )).all()
+        anomalies_bucket = _bucket(Anomaly.event_timestamp, bucket).label("bucket")
+        anomaly_rows = (await db.execute(
+            _anomalies_from(select(anomalies_bucket, func.count()).select_from(Anomaly), start, end, upload_id)
+            .group_by(anomalies_bucket)
+        )).all()
+
+    out: Dict = {b: {"requests": int(n), "anomalies": 0} for b, n in rows}
+    for b, n in anomaly_rows:
+        out.setdefault(b, {"requests": 0, "anomalies": 0})["anomalies"] = int(n)
+    return [{"bucket": _iso(b), **counts} for b, counts in sorted(out.items())]
+
+
+async def anomaly_trend(db: AsyncSession, bucket: str = "hour", start=None, end=None, upload_id=None) -> List[Dict]:
+    """Anomaly count and scores per time bucket and detector."""
+    resolution = rollup_resolution(start, end, bucket)
+    if resolution:
+        b = _rollup_bucket(AnomalyRollup, resolution, bucket)
+        count = func.sum(AnomalyRollup.count)
+        stmt = (
+            select(b, AnomalyRollup.detector, count, func.sum(AnomalyRollup.score_sum) / count, func.max(AnomalyRollup.max_score))
+            .where(*rollup_filters(AnomalyRollup, resolution, start, end, upload_id))
+            .group_by(b, AnomalyRollup.detector)
+            .order_by(b, AnomalyRollup.detector)
+        )
+    else:
+        b = _bucket(Anomaly.event_timestamp, bucket).label("bucket")
+        stmt = _anomalies_from(
+            select(b, Anomaly.detector, func.count(), func.avg(Anomaly.score), func.max(Anomaly.score)).select_from(Anomaly),
+            start, end, upload_id,
+        ).group_by(b, Anomaly.detector).order_by(b, Anomaly.detector)
+    return [
+        {
+            "bucket": _iso(bucket_start),
+            "detector": detector or None,
+            "count": int(count),
+            "avg_score": float(avg) if avg is not None else None,
+            "max_score": float(max_score) if max_score is not None else None,
+        }
+        for bucket_start, detector, count, avg, max_score in (await db.execute(stmt)).all()
+    ]
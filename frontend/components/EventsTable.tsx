@@ -1,9 +1,40 @@
+'use client';
+
+import { useState } from 'react';
+import api from '@/lib/api';
 import type { Event } from '@/types/event';
 
 export interface EventsTableProps {
     rows: Event[];
 }
 
+// Raw lines are not part of the listing; fetch one from the detail endpoint when asked
+function RawLineCell({ eventId }: { eventId: number }) {
+    const [line, setLine] = useState<string | null>(null);
+    const [loading, setLoading] = useState(false);
+
+    const load = async () => {
+        setLoading(true);
+        try {
+            const res = await api.get<Event>(`/events/${eventId}`);
+            setLine(res.data.raw_line || '-');
+        } catch {
+            setLine('Failed to load');
+        } finally {
+            setLoading(false);
+        }
+    };
+
+    if (line !== null) {
+        return <span className="font-mono break-all">{line}</span>;
+    }
+    return (
+        <button onClick={load} disabled={loading} className="text-blue-600 hover:underline disabled:text-gray-400">
+            {loading ? 'Loading...' : 'Show'}
+        </button>
+    );
+}
+
 export default function EventsTable({ rows }: EventsTableProps) {
     return (
         <div className="bg-white rounded-lg border border-gray-200 shadow overflow-auto">
@@ -59,9 +90,7 @@ export default function EventsTable({ rows }: EventsTableProps) {
                                     {r.upload_id || '-'}
                                 </td> */}
                                 <td className="p-3 text-sm" >
-                                    <div className="flex flex-wrap gap-1">
-                                        {r.raw_line || '-'}
-                                    </div>
+                                    <RawLineCell eventId={r.id} />
                                 </td>
                                 <td className="p-3 text-sm">
                                     {r.anomalies?.length ? (
@@ -7,7 +7,8 @@ export interface UploadResponse {
 export interface Upload {
     id: string;
     filename: string;
-    status: 'pending' | 'processing' | 'completed' | 'failed';
+    status: 'pending' | 'processing' | 'completed' | 'partial' | 'failed';
+    failed_batches?: number;
     uploadedAt: string;
     processedAt?: string;
     error?: string;
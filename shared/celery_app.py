@@ -21,6 +21,17 @@ celery_app.conf.update(
     accept_content=['json'],
     task_acks_late=True,
     worker_prefetch_multiplier=1,
+    task_routes={
+        'tasks.parse_file': {'queue': 'parser'},
+        'tasks.explain_anomalies': {'queue': 'explainer'},
+        'tasks.maintain_partitions': {'queue': 'parser'},
+    },
+    beat_schedule={
+        'maintain-partitions': {
+            'task': 'tasks.maintain_partitions',
+            'schedule': 3600.0,
+        },
+    },
 )
 
 # Auto-discover tasks from worker.tasks and worker.tasks_advanced
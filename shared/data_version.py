@@ -0,0 +1,46 @@
+"""
+Data version for invalidating the backend's response cache.
+
+The backend caches read responses under the current data version; the
+worker bumps the version when an upload finishes persisting or retention
+drops partitions, which makes every cached response unreachable at once
+(the stale entries age out by TTL or LRU eviction).
+"""
+import logging
+from typing import Optional
+
+import redis.asyncio as aioredis
+from pydantic_settings import BaseSettings
+
+logger = logging.getLogger("shared.data_version")
+
+DATA_VERSION_KEY = "respcache:data_version"
+
+
+class ResponseCacheSettings(BaseSettings):
+    RESPONSE_CACHE_REDIS_URL: str = "redis://redis:6379/3"
+
+    class Config:
+        env_file = ".env"
+
+
+response_cache_settings = ResponseCacheSettings()
+
+
+async def get_data_version(client: aioredis.Redis) -> int:
+    value = await client.get(DATA_VERSION_KEY)
+    return int(value) if value is not None else 0
+
+
+async def bump_data_version(reason: str = "") -> Optional[int]:
+    """Increment the data version. Failures are logged, never raised: a missed bump only delays freshness to the TTL."""
+    client = aioredis.Redis.from_url(response_cache_settings.RESPONSE_CACHE_REDIS_URL)
+    try:
+        version = await client.incr(DATA_VERSION_KEY)
+        logger.info("Data version bumped to %d (%s)", version, reason or "unspecified")
+        return version
+    except Exception:
+        logger.exception("Failed bumping the data version (%s)", reason)
+        return None
+    finally:
+        await client.aclose()
@@ -4,6 +4,7 @@ Database utilities (async SQLAlchemy engine + session helper).
 Import with: from shared.db import engine, AsyncSessionLocal, Base, get_db
 """
 import logging
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from pydantic_settings import BaseSettings
@@ -26,6 +27,8 @@ Base = declarative_base()
 async def init_db():
     """Create tables (DEV only - use Alembic for migrations in prod)."""
     async with engine.begin() as conn:
+        # Trigram indexes on events need the extension
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(Base.metadata.create_all)
     logger.info("shared.db: initialized DB (created tables)")
 
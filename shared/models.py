@@ -2,7 +2,9 @@
 SQLAlchemy models shared between backend and worker.
 Keep this file strictly only for table definitions.
 """
-from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey, BigInteger
+from sqlalchemy import (
+    Column, String, Integer, Text, DateTime, ForeignKey, ForeignKeyConstraint, BigInteger, Float, Index, LargeBinary,
+)
 from sqlalchemy.dialects.postgresql import UUID, INET
 from sqlalchemy.sql import func
 import uuid
@@ -25,30 +27,128 @@ class Upload(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL"))
     filename = Column(String(512))
     size_bytes = Column(BigInteger)
-    status = Column(String(50), default="queued")
+    status = Column(String(50), default="queued")  # queued, processing, completed, partial or failed
+    failed_batches = Column(Integer, default=0)  # Micro-batches whose events or anomalies could not be written
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Event(Base):
+    # Range-partitioned by timestamp; partitions are managed by shared.partitions.
+    # Raw lines live compressed in event_raw_blocks (see shared.raw_lines).
     __tablename__ = "events"
+    __table_args__ = (
+        # The btree on (timestamp, id) serves ordered listings and keyset pages, BRIN cheap range scans
+        Index("ix_events_timestamp_id", "timestamp", "id"),
+        Index("ix_events_timestamp_brin", "timestamp", postgresql_using="brin"),
+        # Serves both = and CIDR (<<=) lookups, so src_ip has no btree index to maintain on COPY
+        Index("ix_events_src_ip_gist", "src_ip", postgresql_using="gist", postgresql_ops={"src_ip": "inet_ops"}),
+        # pg_trgm indexes for substring search; the GIN pending list absorbs bulk COPYs
+        # and is merged in the background by autovacuum
+        Index(
+            "ix_events_url_trgm", "url", postgresql_using="gin", postgresql_ops={"url": "gin_trgm_ops"},
+            postgresql_with={"fastupdate": "on", "gin_pending_list_limit": 16384},
+        ),
+        Index(
+            "ix_events_user_agent_trgm", "user_agent", postgresql_using="gin",
+            postgresql_ops={"user_agent": "gin_trgm_ops"},
+            postgresql_with={"fastupdate": "on", "gin_pending_list_limit": 16384},
+        ),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     upload_id = Column(UUID(as_uuid=True), ForeignKey("uploads.id", ondelete="CASCADE"), index=True)
-    timestamp = Column(DateTime(timezone=True), index=True)
-    src_ip = Column(String(45), index=True)
-    dest_ip = Column(String(45), nullable=True)
+    timestamp = Column(DateTime(timezone=True), primary_key=True)
+    src_ip = Column(INET)
+    dest_ip = Column(INET, nullable=True)
     user_agent = Column(Text, nullable=True)
     username = Column(String(256), nullable=True)
     url = Column(Text, nullable=True)
     method = Column(String(16), nullable=True)
     status = Column(Integer, nullable=True)
     bytes = Column(BigInteger, nullable=True)
-    raw_line = Column(Text)
+    src_country = Column(String(2), nullable=True)
+    src_asn = Column(Integer, nullable=True)
+    dest_country = Column(String(2), nullable=True)
+    dest_asn = Column(Integer, nullable=True)
+    # Occurrences of collapsed duplicate lines; first/last_seen are only set when count > 1
+    count = Column(Integer, nullable=False, server_default="1")
+    first_seen = Column(DateTime(timezone=True), nullable=True)
+    last_seen = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class EventRawBlock(Base):
+    # zlib-compressed raw lines of a run of events of one upload
+    __tablename__ = "event_raw_blocks"
+    __table_args__ = (
+        Index("ix_event_raw_blocks_event_range", "upload_id", "first_event_id", "last_event_id"),
+    )
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    upload_id = Column(UUID(as_uuid=True), ForeignKey("uploads.id", ondelete="CASCADE"))
+    first_event_id = Column(BigInteger, nullable=False)
+    last_event_id = Column(BigInteger, nullable=False)
+    last_timestamp = Column(DateTime(timezone=True), nullable=True, index=True)  # for retention
+    line_count = Column(Integer)
+    data = Column(LargeBinary, nullable=False)
+
 class Anomaly(Base):
+    # Partitioned like events, on the timestamp of the anomaly's event
     __tablename__ = "anomalies"
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["event_id", "event_timestamp"], ["events.id", "events.timestamp"], ondelete="CASCADE"
+        ),
+        Index("ix_anomalies_created_at_id", "created_at", "id"),  # listing order and keyset pages
+        {"postgresql_partition_by": "RANGE (event_timestamp)"},
+    )
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    event_id = Column(BigInteger, ForeignKey("events.id", ondelete="CASCADE"), index=True)
+    event_id = Column(BigInteger, index=True)
+    event_timestamp = Column(DateTime(timezone=True), primary_key=True)
     detector = Column(String(128))
-    score = Column(String(32))
+    score = Column(Float, index=True)
     reason = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    incident_id = Column(BigInteger, ForeignKey("incidents.id", ondelete="SET NULL"), nullable=True, index=True)
+    explained_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class EventRollup(Base):
+    # Events and requests per time bucket and upload, in total and per dimension value (see shared.rollups)
+    __tablename__ = "event_rollups"
+    __table_args__ = (
+        Index("ix_event_rollups_lookup", "resolution", "dimension", "bucket"),
+    )
+    resolution = Column(String(8), primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    upload_id = Column(UUID(as_uuid=True), ForeignKey("uploads.id", ondelete="CASCADE"), primary_key=True)
+    dimension = Column(String(16), primary_key=True)
+    value = Column(Text, primary_key=True)
+    events = Column(BigInteger, nullable=False, default=0)
+    requests = Column(BigInteger, nullable=False, default=0)
+
+class AnomalyRollup(Base):
+    __tablename__ = "anomaly_rollups"
+    __table_args__ = (
+        Index("ix_anomaly_rollups_lookup", "resolution", "bucket"),
+    )
+    resolution = Column(String(8), primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    upload_id = Column(UUID(as_uuid=True), ForeignKey("uploads.id", ondelete="CASCADE"), primary_key=True)
+    detector = Column(String(128), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    max_score = Column(Float, nullable=False, default=0.0)
+
+class Incident(Base):
+    __tablename__ = "incidents"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    upload_id = Column(UUID(as_uuid=True), ForeignKey("uploads.id", ondelete="CASCADE"), index=True)
+    entity_type = Column(String(16))
+    entity = Column(String(256), index=True)
+    detector = Column(String(128))
+    reason_class = Column(String(256))
+    reason = Column(Text)
+    count = Column(Integer, default=0)
+    max_score = Column(Float)
+    first_seen = Column(DateTime(timezone=True), nullable=True)
+    last_seen = Column(DateTime(timezone=True), nullable=True, index=True)
+    representative_event_id = Column(BigInteger, nullable=True)  # events is partitioned, so no FK on id alone
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
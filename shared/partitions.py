@@ -0,0 +1,236 @@
+"""
+Time-range partitions for events and anomalies.
+
+events is partitioned on timestamp and anomalies on event_timestamp, with
+identical bounds, so each period is one pair of partitions named
+"<table>_p<YYYYMMDD>" (the period start). Partitions are created ahead of
+time by the maintenance task and on demand before a batch is written, for
+the periods the batch actually has rows in; partitions whose period ended
+more than EVENT_RETENTION_DAYS ago are detached and dropped, anomalies
+first (they reference events), along with the raw-line blocks and
+per-minute rollups of the dropped periods.
+
+A "<table>_default" partition catches rows outside every period, including
+batch outliers outside partition_window, which never get partitions of
+their own; its rows expire with the same cutoff.
+Functions take an AsyncSession or AsyncConnection and do not commit.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from pydantic_settings import BaseSettings
+from sqlalchemy import text
+
+logger = logging.getLogger("shared.partitions")
+
+# Dropped in this order: anomalies reference events
+PARTITIONED_TABLES = ("anomalies", "events")
+PARTITION_KEYS = {"anomalies": "event_timestamp", "events": "timestamp"}
+
+
+class PartitionSettings(BaseSettings):
+    PARTITION_INTERVAL: str = "week"  # day, week or month
+    PARTITION_PREMAKE: int = 4  # Future periods created ahead of time
+    EVENT_RETENTION_DAYS: int = 90  # Periods ending before this are dropped
+
+    class Config:
+        env_file = ".env"
+
+
+partition_settings = PartitionSettings()
+
+# duplicate_table, and unique_violation on pg_type when two CREATEs race
+DUPLICATE_SQLSTATES = ("42P07", "23505")
+
+
+def period_start(ts: datetime, interval: Optional[str] = None) -> datetime:
+    """Start (UTC midnight) of the period containing ts."""
+    interval = interval or partition_settings.PARTITION_INTERVAL
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    day = ts.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "day":
+        return day
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unsupported partition interval: {interval!r}")
+
+
+def next_period(start: datetime, interval: Optional[str] = None) -> datetime:
+    interval = interval or partition_settings.PARTITION_INTERVAL
+    if interval == "day":
+        return start + timedelta(days=1)
+    if interval == "week":
+        return start + timedelta(days=7)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return f"{table}_p{start:%Y%m%d}"
+
+
+async def existing_partitions(db, table: str) -> List[str]:
+    res = await db.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": table})
+    return [row[0] for row in res.all()]
+
+
+def period_starts(timestamps: Iterable[Optional[datetime]], interval: Optional[str] = None) -> List[datetime]:
+    """Distinct period starts of timestamps, oldest first (naive values are UTC)."""
+    days = {
+        (ts.astimezone(timezone.utc) if ts.tzinfo else ts).date()
+        for ts in timestamps if ts is not None
+    }
+    return sorted({
+        period_start(datetime(d.year, d.month, d.day, tzinfo=timezone.utc), interval) for d in days
+    })
+
+
+def partition_window(now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """
+    [oldest, end) of the periods that get their own partitions: from the
+    oldest one retention keeps through PARTITION_PREMAKE periods ahead.
+    """
+    now = now or datetime.now(timezone.utc)
+    oldest = period_start(now - timedelta(days=partition_settings.EVENT_RETENTION_DAYS))
+    end = period_start(now)
+    for _ in range(partition_settings.PARTITION_PREMAKE + 1):
+        end = next_period(end)
+    return oldest, end
+
+
+def batch_periods(timestamps: Iterable[Optional[datetime]], now: Optional[datetime] = None) -> List[datetime]:
+    """
+    Periods of a batch's timestamps that need a partition. Outliers outside
+    partition_window (bad clocks, mis-parsed years) are left to the default
+    partition instead of creating partitions of their own.
+    """
+    oldest, end = partition_window(now)
+    return [p for p in period_starts(timestamps) if oldest <= p < end]
+
+
+def _is_duplicate(exc: Exception) -> bool:
+    # Another session created the same table between our check and CREATE
+    return getattr(getattr(exc, "orig", None), "sqlstate", None) in DUPLICATE_SQLSTATES
+
+
+async def _missing(db, names: Sequence[str]) -> List[str]:
+    res = await db.execute(
+        text("SELECT n FROM unnest(CAST(:names AS text[])) AS n WHERE to_regclass(n) IS NULL"),
+        {"names": list(names)},
+    )
+    return [row[0] for row in res.all()]
+
+
+async def _create(db, name: str, ddl: str) -> bool:
+    """Run one CREATE TABLE IF NOT EXISTS; False when it lost a creation race or failed."""
+    try:
+        async with db.begin_nested():
+            await db.execute(text(ddl))
+        return True
+    except Exception as e:
+        if not _is_duplicate(e):
+            # e.g. rows for this period already sit in the default partition
+            logger.exception("Failed creating partition %s", name)
+        return False
+
+
+async def ensure_partitions(db, periods: Iterable[datetime]) -> int:
+    """
+    Create the partitions of the given period starts (and the default
+    partitions) for all partitioned tables. Returns the number created.
+
+    Existence is checked in the catalog on every call, so partitions made or
+    dropped by other processes, or rolled back, are always seen as they are.
+    """
+    periods = sorted(set(periods))
+    defaults = [f"{table}_default" for table in reversed(PARTITIONED_TABLES)]
+    names = defaults + [partition_name(table, p) for p in periods for table in reversed(PARTITIONED_TABLES)]
+    if not await _missing(db, names):
+        return 0
+
+    # Serialize partition DDL across workers; IF NOT EXISTS and the duplicate
+    # check cover creators that do not take the lock
+    await db.execute(text("SELECT pg_advisory_xact_lock(hashtext('partitions'))"))
+    missing = set(await _missing(db, names))
+
+    created = 0
+    for table in reversed(PARTITIONED_TABLES):
+        default = f"{table}_default"
+        if default in missing:
+            created += await _create(db, default, f"CREATE TABLE IF NOT EXISTS {default} PARTITION OF {table} DEFAULT")
+    for p in periods:
+        for table in reversed(PARTITIONED_TABLES):  # events before anomalies, which reference them
+            name = partition_name(table, p)
+            if name in missing:
+                created += await _create(db, name, (
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{p.isoformat()}') TO ('{next_period(p).isoformat()}')"
+                ))
+    if created:
+        logger.info("Created %d partitions", created)
+    return created
+
+
+async def drop_expired_partitions(db, now: Optional[datetime] = None) -> List[str]:
+    """Detach and drop partitions whose period ended before the retention cutoff."""
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=partition_settings.EVENT_RETENTION_DAYS)
+    dropped = []
+    await db.execute(text("SELECT pg_advisory_xact_lock(hashtext('partitions'))"))
+    for table in PARTITIONED_TABLES:
+        for name in sorted(await existing_partitions(db, table)):
+            prefix = f"{table}_p"
+            if not name.startswith(prefix):
+                continue
+            try:
+                start = datetime.strptime(name[len(prefix):], "%Y%m%d").replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue
+            if next_period(start) > cutoff:
+                continue
+            await db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            await db.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    # Outliers parked in the default partitions expire like everything else
+    outliers = 0
+    for table in PARTITIONED_TABLES:
+        res = await db.execute(
+            text(f"DELETE FROM {table}_default WHERE {PARTITION_KEYS[table]} < :start"),
+            {"start": period_start(cutoff)},
+        )
+        outliers += res.rowcount or 0
+    if outliers:
+        logger.info("Deleted %d expired rows from the default partitions", outliers)
+    if dropped:
+        # Blocks whose newest event precedes the oldest remaining period
+        await db.execute(
+            text("DELETE FROM event_raw_blocks WHERE last_timestamp < :start"),
+            {"start": period_start(cutoff)},
+        )
+        # Hourly rollups outlive the raw data; per-minute ones go with it
+        for table in ("event_rollups", "anomaly_rollups"):
+            await db.execute(
+                text(f"DELETE FROM {table} WHERE resolution = 'minute' AND bucket < :start"),
+                {"start": period_start(cutoff)},
+            )
+        logger.info("Dropped %d expired partitions: %s", len(dropped), ", ".join(dropped))
+    return dropped
+
+
+async def maintain_partitions(db, now: Optional[datetime] = None, drop_expired: bool = True) -> dict:
+    """Pre-create the current and next PARTITION_PREMAKE periods, then apply retention."""
+    now = now or datetime.now(timezone.utc)
+    periods = [period_start(now)]
+    for _ in range(partition_settings.PARTITION_PREMAKE):
+        periods.append(next_period(periods[-1]))
+    created = await ensure_partitions(db, periods)
+    dropped = await drop_expired_partitions(db, now) if drop_expired else []
+    return {"created": created, "dropped": dropped}
@@ -0,0 +1,67 @@
+"""
+Compressed cold storage for events' raw log lines.
+
+Raw lines are only shown on the event-detail endpoint, so they are kept out
+of the hot events table. The lines of consecutive events of an upload are
+packed into blocks of up to RAW_BLOCK_LINES lines and zlib-compressed
+together, which compresses far better than short lines one by one. A block
+records the id range of its events; a single line is read by decompressing
+its block.
+"""
+import json
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.models import EventRawBlock
+
+COMPRESSION_LEVEL = 6
+
+
+def pack_block(event_ids: Sequence[int], lines: Sequence[Optional[str]]) -> bytes:
+    payload = json.dumps({"ids": list(event_ids), "lines": list(lines)}, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def unpack_block(data: bytes) -> Dict[int, Optional[str]]:
+    payload = json.loads(zlib.decompress(data).decode("utf-8"))
+    return dict(zip(payload["ids"], payload["lines"]))
+
+
+def build_blocks(upload_id, events: Sequence[Dict], block_lines: int) -> List[Dict]:
+    """
+    EventRawBlock rows for event dicts that already carry their id,
+    timestamp and raw_line.
+    """
+    blocks = []
+    for i in range(0, len(events), block_lines):
+        chunk = events[i:i + block_lines]
+        ids = [e["id"] for e in chunk]
+        timestamps = [e["timestamp"] for e in chunk if e.get("timestamp") is not None]
+        blocks.append({
+            "upload_id": upload_id,
+            "first_event_id": min(ids),
+            "last_event_id": max(ids),
+            "last_timestamp": max(timestamps) if timestamps else None,
+            "line_count": len(chunk),
+            "data": pack_block(ids, [e.get("raw_line") for e in chunk]),
+        })
+    return blocks
+
+
+async def fetch_raw_line(db: AsyncSession, event_id: int, upload_id=None) -> Optional[str]:
+    """Raw line of one event, or None when it was not stored."""
+    stmt = select(EventRawBlock.data).where(
+        EventRawBlock.first_event_id <= event_id,
+        EventRawBlock.last_event_id >= event_id,
+    )
+    if upload_id is not None:
+        stmt = stmt.where(EventRawBlock.upload_id == upload_id)
+    # Blocks of concurrent uploads can have overlapping id ranges
+    for data in (await db.execute(stmt)).scalars():
+        lines = unpack_block(data)
+        if event_id in lines:
+            return lines[event_id]
+    return None
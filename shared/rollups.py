@@ -0,0 +1,181 @@
+"""
+Pre-aggregated rollups of events and anomalies for the dashboard.
+
+event_rollups holds, per resolution (minute, hour), time bucket and upload,
+the number of events and requests (events weighted by their duplicate
+count) in total and per value of src_ip, status, method and domain.
+anomaly_rollups holds anomaly counts and scores per bucket, upload and
+detector. Missing values are stored as "".
+
+The worker folds every persisted batch in with additive upserts, inside
+the transaction that writes the batch. rebuild_rollups() recomputes a
+time range from the raw tables, for backfills or after changing what is
+rolled up.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import text, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from shared.models import EventRollup, AnomalyRollup
+
+logger = logging.getLogger("shared.rollups")
+
+RESOLUTIONS = ("minute", "hour")
+EVENT_DIMENSIONS = ("src_ip", "status", "method", "domain")
+
+# SQL for each dimension's value, used by rebuilds. The domain expression
+# mirrors urlparse().netloc of absolute URLs, as set by the parser.
+DOMAIN_SQL = r"substring(url from '^[A-Za-z][A-Za-z0-9+.-]*://([^/?#]+)')"
+DIMENSION_SQL = {
+    "total": "''",
+    "src_ip": "COALESCE(host(src_ip), '')",
+    "status": "COALESCE(status::text, '')",
+    "method": "COALESCE(method, '')",
+    "domain": f"COALESCE({DOMAIN_SQL}, '')",
+}
+
+
+def truncate(ts: datetime, resolution: str) -> datetime:
+    """Python counterpart of date_trunc for the rollup resolutions."""
+    if resolution == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unsupported rollup resolution: {resolution!r}")
+
+
+def _value(value) -> str:
+    return "" if value is None else str(value)
+
+
+def event_rollup_rows(upload_id, events: Sequence[Dict]) -> List[Dict]:
+    """EventRollup rows for a batch of event rows (timestamp, count and the dimension fields)."""
+    minute: Dict[tuple, List[int]] = defaultdict(lambda: [0, 0])
+    for e in events:
+        bucket = truncate(e["timestamp"], "minute")
+        weight = e.get("count") or 1
+        for dimension in ("total",) + EVENT_DIMENSIONS:
+            acc = minute[(bucket, dimension, "" if dimension == "total" else _value(e.get(dimension)))]
+            acc[0] += 1
+            acc[1] += weight
+
+    # Hours are summed from the minutes rather than from the events again
+    hour: Dict[tuple, List[int]] = defaultdict(lambda: [0, 0])
+    for (bucket, dimension, value), (n, requests) in minute.items():
+        acc = hour[(truncate(bucket, "hour"), dimension, value)]
+        acc[0] += n
+        acc[1] += requests
+
+    rows = []
+    for resolution, acc in (("minute", minute), ("hour", hour)):
+        for (bucket, dimension, value), (n, requests) in acc.items():
+            rows.append({
+                "resolution": resolution, "bucket": bucket, "upload_id": upload_id,
+                "dimension": dimension, "value": value, "events": n, "requests": requests,
+            })
+    return rows
+
+
+def anomaly_rollup_rows(upload_id, anomalies: Sequence[Dict]) -> List[Dict]:
+    """AnomalyRollup rows for a batch of anomaly rows (event_timestamp, detector, score)."""
+    acc: Dict[tuple, List[float]] = {}
+    for a in anomalies:
+        score = float(a.get("score") or 0.0)
+        for resolution in RESOLUTIONS:
+            key = (resolution, truncate(a["event_timestamp"], resolution), _value(a.get("detector")))
+            if key in acc:
+                entry = acc[key]
+                entry[0] += 1
+                entry[1] += score
+                entry[2] = max(entry[2], score)
+            else:
+                acc[key] = [1, score, score]
+    return [
+        {
+            "resolution": resolution, "bucket": bucket, "upload_id": upload_id, "detector": detector,
+            "count": count, "score_sum": score_sum, "max_score": max_score,
+        }
+        for (resolution, bucket, detector), (count, score_sum, max_score) in acc.items()
+    ]
+
+
+def _primary_key(model) -> List[str]:
+    return [c.name for c in model.__table__.primary_key.columns]
+
+
+async def _upsert(db, model, rows: List[Dict], set_) -> None:
+    if not rows:
+        return
+    keys = _primary_key(model)
+    # A fixed key order keeps concurrent upserts from deadlocking on each other's rows
+    rows.sort(key=lambda r: tuple(str(r[k]) for k in keys))
+    stmt = pg_insert(model)
+    stmt = stmt.on_conflict_do_update(index_elements=keys, set_=set_(model, stmt.excluded))
+    await db.execute(stmt, rows)
+
+
+async def add_event_rollups(db, upload_id, events: Sequence[Dict]) -> None:
+    await _upsert(db, EventRollup, event_rollup_rows(upload_id, events), lambda t, new: {
+        "events": t.events + new.events,
+        "requests": t.requests + new.requests,
+    })
+
+
+async def add_anomaly_rollups(db, upload_id, anomalies: Sequence[Dict]) -> None:
+    await _upsert(db, AnomalyRollup, anomaly_rollup_rows(upload_id, anomalies), lambda t, new: {
+        "count": t.count + new.count,
+        "score_sum": t.score_sum + new.score_sum,
+        "max_score": func.greatest(t.max_score, new.max_score),
+    })
+
+
+async def rebuild_rollups(db, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Recompute rollups from events/anomalies, for all time or for the hours
+    overlapping [start, end). Does not commit. Run it while no upload
+    covering the range is being ingested.
+    """
+    lo = truncate(start, "hour") if start else None
+    hi = None
+    if end:
+        hi = truncate(end, "hour")
+        if hi < end:
+            hi += timedelta(hours=1)
+
+    def range_filter(column: str) -> str:
+        clauses = ["TRUE"]
+        if lo:
+            clauses.append(f"{column} >= :lo")
+        if hi:
+            clauses.append(f"{column} < :hi")
+        return " AND ".join(clauses)
+
+    params = {k: v for k, v in (("lo", lo), ("hi", hi)) if v is not None}
+    for table in ("event_rollups", "anomaly_rollups"):
+        await db.execute(text(f"DELETE FROM {table} WHERE {range_filter('bucket')}"), params)
+
+    events_inserted = anomalies_inserted = 0
+    for resolution in RESOLUTIONS:
+        for dimension, value_sql in DIMENSION_SQL.items():
+            res = await db.execute(text(
+                "INSERT INTO event_rollups (resolution, bucket, upload_id, dimension, value, events, requests) "
+                f"SELECT '{resolution}', date_trunc('{resolution}', timestamp), upload_id, '{dimension}', "
+                f"{value_sql}, count(*), sum(count) FROM events "
+                f"WHERE upload_id IS NOT NULL AND {range_filter('timestamp')} GROUP BY 2, 3, 5"
+            ), params)
+            events_inserted += res.rowcount
+        res = await db.execute(text(
+            "INSERT INTO anomaly_rollups (resolution, bucket, upload_id, detector, count, score_sum, max_score) "
+            f"SELECT '{resolution}', date_trunc('{resolution}', a.event_timestamp), e.upload_id, "
+            "COALESCE(a.detector, ''), count(*), COALESCE(sum(a.score), 0), COALESCE(max(a.score), 0) "
+            "FROM anomalies a JOIN events e ON e.id = a.event_id AND e.timestamp = a.event_timestamp "
+            f"WHERE e.upload_id IS NOT NULL AND {range_filter('a.event_timestamp')} GROUP BY 2, 3, 4"
+        ), params)
+        anomalies_inserted += res.rowcount
+    counts = {"event_rollups": events_inserted, "anomaly_rollups": anomalies_inserted}
+    logger.info("Rebuilt rollups %s - %s: %s", lo or "start", hi or "end", counts)
+    return counts
@@ -39,6 +39,7 @@ class UploadOut(BaseModel):
     filename: str
     size_bytes: int
     status: str
+    failed_batches: Optional[int] = 0
     created_at: datetime
 
     class Config:
@@ -56,7 +57,14 @@ class EventOut(BaseModel):
     method: Optional[str]
     status: Optional[int]
     bytes: Optional[int]
-    raw_line: Optional[str]
+    raw_line: Optional[str] = None  # only loaded for the event-detail endpoint
+    src_country: Optional[str]
+    src_asn: Optional[int]
+    dest_country: Optional[str]
+    dest_asn: Optional[int]
+    count: int = 1
+    first_seen: Optional[datetime] = None
+    last_seen: Optional[datetime] = None
 
     class Config:
         orm_mode = True
@@ -65,7 +73,7 @@ class AnomalyOut(BaseModel):
     id: int
     event_id: int
     detector: Optional[str]
-    score: Optional[str]
+    score: Optional[float]
     reason: Optional[str]
     created_at: Optional[datetime]
 
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from app import cache as cache_module
+from app.cache import ResponseCache, BYTES_KEY, LRU_KEY, SIZES_KEY, EXPIRES_KEY
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache_module.aioredis.Redis, "from_url",
+                        lambda url: fakeredis.FakeAsyncRedis(server=server))
+    c = ResponseCache("redis://fake")
+    c.ttl = 300
+    c.max_bytes = 250
+    return c
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    return now
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def total(c):
+    return int(await c.client.get(BYTES_KEY) or 0)
+
+
+def make_request(path="/api/events", query=b"page=1"):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query, "headers": []})
+
+
+def test_reput_charges_only_the_size_difference(cache):
+    async def scenario():
+        await cache._put("k", b"x" * 100)
+        await cache._put("k", b"x" * 100)
+        await cache._put("k", b"x" * 60)
+        return await total(cache), int(await cache.client.hget(SIZES_KEY, "k"))
+
+    assert run(scenario()) == (60, 60)
+
+
+def test_lru_eviction_keeps_total_within_budget(cache, clock):
+    async def scenario():
+        for i, key in enumerate(["a", "b", "c"]):
+            clock[0] += 1
+            await cache._put(key, b"x" * 100)
+        members = await cache.client.zrange(LRU_KEY, 0, -1)
+        return await total(cache), members, await cache.client.exists("a")
+
+    size, members, a_exists = run(scenario())
+    assert size == 200
+    assert members == [b"b", b"c"]
+    assert not a_exists
+
+
+def test_expired_entries_leave_the_total(cache, clock):
+    async def scenario():
+        cache.ttl = 10
+        await cache._put("old", b"x" * 100)
+        clock[0] += 11
+        await cache._put("new", b"x" * 40)
+        return (await total(cache), await cache.client.hexists(SIZES_KEY, "old"),
+                await cache.client.zscore(EXPIRES_KEY, "old"))
+
+    assert run(scenario()) == (40, False, None)
+
+
+def test_oversized_body_is_not_cached(cache):
+    async def scenario():
+        await cache._put("big", b"x" * 1000)
+        return await total(cache), await cache.client.exists("big")
+
+    assert run(scenario()) == (0, 0)
+
+
+def test_respond_miss_then_hit(cache):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"events": [1, 2]}
+
+    async def scenario():
+        first = await cache.respond(make_request(), compute)
+        second = await cache.respond(make_request(query=b"page=1&ip="), compute)
+        return first, second, await cache.stats()
+
+    first, second, stats = run(scenario())
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.body == first.body
+    assert len(calls) == 1
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["bytes"] == len(first.body)
+
+
+def test_redis_failure_serves_uncached(cache):
+    async def broken(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    cache.client.get = broken
+
+    async def compute():
+        return {"ok": True}
+
+    response = run(cache.respond(make_request(), compute))
+    assert response.body == b'{"ok":true}'
+    assert "X-Cache" not in response.headers
@@ -0,0 +1,85 @@
+import asyncio
+import gzip
+import io
+import json
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from app import export
+from app.crud import events_select
+
+UPLOAD = uuid.uuid4()
+TS = datetime(2025, 1, 14, 8, 15, tzinfo=timezone.utc)
+
+
+def event_rows():
+    return [
+        {"id": 2, "upload_id": UPLOAD, "timestamp": TS, "src_ip": "10.1.2.40", "src_asn": 4200000000,
+         "dest_asn": 15169, "status": 200, "bytes": 5120, "anomalies": '[{"id": 1, "score": 0.9}]'},
+        {"id": 1, "upload_id": None, "timestamp": TS, "src_ip": None, "src_asn": None,
+         "dest_asn": None, "status": None, "bytes": None, "anomalies": None},
+    ]
+
+
+def export_bytes(monkeypatch, fmt, gzip_=False):
+    stmt, names = events_select(fields=["upload_id", "src_ip", "src_asn", "dest_asn", "status", "bytes", "anomalies"])
+
+    async def batches(_stmt):
+        rows = event_rows()
+        yield rows[:1]
+        yield rows[1:]
+
+    monkeypatch.setattr(export, "_batches", batches)
+
+    async def collect():
+        return b"".join([chunk async for chunk in export.stream_export(stmt, names, fmt, gzip_)])
+
+    return asyncio.run(collect()), names
+
+
+def test_arrow_schema_follows_column_types():
+    pa = pytest.importorskip("pyarrow")
+    stmt, names = events_select()
+    schema = export.arrow_schema(pa, stmt, names)
+    assert schema.field("src_asn").type == pa.int64()
+    assert schema.field("dest_asn").type == pa.int64()
+    assert schema.field("status").type == pa.int64()
+    assert schema.field("timestamp").type == pa.timestamp("us", tz="UTC")
+    assert schema.field("first_seen").type == pa.timestamp("us", tz="UTC")
+    assert schema.field("src_ip").type == pa.string()
+    assert schema.field("upload_id").type == pa.string()
+
+    anomaly_schema = export.arrow_schema(pa, export.anomalies_select(), export.ANOMALY_FIELDS)
+    assert anomaly_schema.field("score").type == pa.float64()
+
+
+def test_parquet_export_with_integer_asns(monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    body, names = export_bytes(monkeypatch, "parquet")
+    table = pq.read_table(io.BytesIO(body))
+    assert table.column_names == names
+    assert table.num_rows == 2
+    assert table.column("src_asn").to_pylist() == [4200000000, None]
+    assert table.column("upload_id").to_pylist() == [str(UPLOAD), None]
+
+
+def test_ndjson_export_gzip(monkeypatch):
+    body, _ = export_bytes(monkeypatch, "ndjson", gzip_=True)
+    lines = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+    assert [r["id"] for r in lines] == [2, 1]
+    assert lines[0]["anomalies"] == [{"id": 1, "score": 0.9}]
+    assert lines[1]["anomalies"] == []
+
+
+def test_csv_export_has_header_and_rows(monkeypatch):
+    body, names = export_bytes(monkeypatch, "csv")
+    lines = body.decode("utf-8").splitlines()
+    assert lines[0].split(",") == names
+    assert len(lines) == 3
+
+
+def test_check_format_rejects_unknown():
+    with pytest.raises(ValueError):
+        export.check_format("xml")
@@ -0,0 +1,24 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    ts = datetime(2025, 1, 14, 8, 15, 30, 123456, tzinfo=timezone.utc)
+    token = encode_cursor(ts.isoformat(), 987654321)
+    assert "=" not in token
+    assert decode_cursor(token) == (ts, 987654321)
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "not a cursor!",
+    encode_cursor(None, 1),
+    encode_cursor("yesterday", 1),
+    encode_cursor("2025-01-14T08:15:30+00:00", "abc"),
+])
+def test_malformed_cursors_raise_value_error(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
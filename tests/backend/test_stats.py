@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import stats
+from app.stats import as_utc, rollup_filters, rollup_resolution
+from shared.models import EventRollup
+
+AWARE = datetime(2025, 1, 14, 8, 15, tzinfo=timezone.utc)
+NAIVE = datetime(2025, 1, 14, 8, 15)
+
+
+@pytest.fixture(autouse=True)
+def rollups_on(monkeypatch):
+    monkeypatch.setattr(stats.settings, "STATS_USE_ROLLUPS", True)
+    monkeypatch.setattr(stats.settings, "STATS_RAW_MAX_HOURS", 6)
+
+
+def test_as_utc():
+    assert as_utc(None) is None
+    assert as_utc(NAIVE) == AWARE and as_utc(NAIVE).tzinfo is timezone.utc
+    shifted = datetime(2025, 1, 14, 13, 45, tzinfo=timezone(timedelta(hours=5, minutes=30)))
+    assert as_utc(shifted) == AWARE and as_utc(shifted).tzinfo is timezone.utc
+
+
+@pytest.mark.parametrize("start, end", [
+    (NAIVE, AWARE + timedelta(days=1)),
+    (AWARE, NAIVE + timedelta(days=1)),
+])
+def test_rollup_resolution_mixes_naive_and_aware_bounds(start, end):
+    assert rollup_resolution(start, end) == "minute"
+
+
+@pytest.mark.parametrize("span, bucket, expected", [
+    (timedelta(hours=2), None, None),
+    (timedelta(days=1), None, "minute"),
+    (timedelta(days=10), None, "hour"),
+    (timedelta(days=10), "minute", "minute"),
+])
+def test_rollup_resolution_by_range(span, bucket, expected):
+    assert rollup_resolution(NAIVE, NAIVE + span, bucket) == expected
+
+
+def test_rollup_resolution_unbounded_and_disabled(monkeypatch):
+    assert rollup_resolution(AWARE, None) == "hour"
+    monkeypatch.setattr(stats.settings, "STATS_USE_ROLLUPS", False)
+    assert rollup_resolution(AWARE, AWARE + timedelta(days=10)) is None
+
+
+def test_rollup_filters_truncate_start_in_utc():
+    start = datetime(2025, 1, 14, 13, 45, 30, tzinfo=timezone(timedelta(hours=5, minutes=30)))
+    bound = rollup_filters(EventRollup, "hour", start=start)[1]
+    assert bound.right.value == datetime(2025, 1, 14, 8, 0, tzinfo=timezone.utc)
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from shared import partitions
+from shared.partitions import batch_periods, partition_window, period_starts
+
+NOW = datetime(2024, 5, 15, 12, 0, tzinfo=timezone.utc)  # a Wednesday
+
+
+@pytest.fixture(autouse=True)
+def weekly(monkeypatch):
+    monkeypatch.setattr(partitions.partition_settings, "PARTITION_INTERVAL", "week")
+    monkeypatch.setattr(partitions.partition_settings, "PARTITION_PREMAKE", 4)
+    monkeypatch.setattr(partitions.partition_settings, "EVENT_RETENTION_DAYS", 90)
+
+
+def test_period_starts_are_distinct_and_sorted():
+    timestamps = [NOW, NOW - timedelta(days=7), NOW + timedelta(hours=1), None, datetime(2024, 5, 13, 3, 0)]
+    assert period_starts(timestamps) == [
+        datetime(2024, 5, 6, tzinfo=timezone.utc),
+        datetime(2024, 5, 13, tzinfo=timezone.utc),
+    ]
+
+
+def test_period_starts_convert_to_utc():
+    # Sunday 23:30 at UTC-2 is Monday in UTC, the next week
+    ts = datetime(2024, 5, 12, 23, 30, tzinfo=timezone(timedelta(hours=-2)))
+    assert period_starts([ts]) == [datetime(2024, 5, 13, tzinfo=timezone.utc)]
+
+
+def test_partition_window_spans_retention_and_premake():
+    oldest, end = partition_window(NOW)
+    assert oldest == datetime(2024, 2, 12, tzinfo=timezone.utc)  # week of NOW - 90 days
+    assert end == datetime(2024, 6, 17, tzinfo=timezone.utc)  # current week + 4 ahead, exclusive
+
+
+def test_batch_periods_only_cover_periods_present():
+    # Two weeks a month apart: nothing in between is created
+    timestamps = [NOW, NOW - timedelta(days=35)]
+    assert batch_periods(timestamps, NOW) == [
+        datetime(2024, 4, 8, tzinfo=timezone.utc),
+        datetime(2024, 5, 13, tzinfo=timezone.utc),
+    ]
+
+
+def test_batch_periods_leave_outliers_to_the_default_partition():
+    timestamps = [NOW, datetime(1970, 1, 1), datetime(2099, 1, 1, tzinfo=timezone.utc), NOW + timedelta(days=40)]
+    assert batch_periods(timestamps, NOW) == [datetime(2024, 5, 13, tzinfo=timezone.utc)]
+
+
+@pytest.mark.parametrize("sqlstate, duplicate", [("42P07", True), ("23505", True), ("23514", False), (None, False)])
+def test_duplicate_creation_is_recognized(sqlstate, duplicate):
+    exc = Exception()
+    exc.orig = SimpleNamespace(sqlstate=sqlstate)
+    assert partitions._is_duplicate(exc) is duplicate
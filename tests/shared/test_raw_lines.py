@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta, timezone
+
+from shared.raw_lines import build_blocks, pack_block, unpack_block
+
+T0 = datetime(2025, 1, 14, 8, 0, tzinfo=timezone.utc)
+
+
+def test_pack_round_trip():
+    data = pack_block([3, 4, 5], ["GET / 200", None, "naïve ünïcode"])
+    assert unpack_block(data) == {3: "GET / 200", 4: None, 5: "naïve ünïcode"}
+
+
+def test_build_blocks_splits_and_records_ranges():
+    events = [
+        {"id": 100 + i, "timestamp": T0 + timedelta(seconds=i), "raw_line": f"line {i}"}
+        for i in range(5)
+    ]
+    events[4]["timestamp"] = None
+    blocks = build_blocks("upload", events, block_lines=2)
+
+    assert [(b["first_event_id"], b["last_event_id"], b["line_count"]) for b in blocks] == [
+        (100, 101, 2), (102, 103, 2), (104, 104, 1),
+    ]
+    assert blocks[0]["last_timestamp"] == T0 + timedelta(seconds=1)
+    assert blocks[2]["last_timestamp"] is None
+    assert all(b["upload_id"] == "upload" for b in blocks)
+    assert unpack_block(blocks[1]["data"]) == {102: "line 2", 103: "line 3"}
+
+
+def test_build_blocks_empty():
+    assert build_blocks("upload", [], block_lines=10) == []
@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from shared.rollups import anomaly_rollup_rows, event_rollup_rows, truncate
+
+T = datetime(2025, 1, 14, 8, 15, 42, 500, tzinfo=timezone.utc)
+
+
+def by_key(rows, *fields):
+    return {tuple(r[f] for f in fields): r for r in rows}
+
+
+def test_truncate():
+    assert truncate(T, "minute") == datetime(2025, 1, 14, 8, 15, tzinfo=timezone.utc)
+    assert truncate(T, "hour") == datetime(2025, 1, 14, 8, tzinfo=timezone.utc)
+    with pytest.raises(ValueError):
+        truncate(T, "day")
+
+
+def test_event_rollups_count_events_and_weighted_requests():
+    later = T.replace(minute=40)
+    events = [
+        {"timestamp": T, "count": 3, "src_ip": "10.0.0.1", "status": 200, "method": "GET", "domain": None},
+        {"timestamp": T, "count": 1, "src_ip": "10.0.0.2", "status": 200, "method": "GET", "domain": "a.com"},
+        {"timestamp": later, "count": None, "src_ip": "10.0.0.1", "status": 404, "method": "POST", "domain": None},
+    ]
+    rows = by_key(event_rollup_rows("u", events), "resolution", "bucket", "dimension", "value")
+    minute, hour = truncate(T, "minute"), truncate(T, "hour")
+
+    total = rows[("minute", minute, "total", "")]
+    assert (total["events"], total["requests"], total["upload_id"]) == (2, 4, "u")
+    assert rows[("minute", minute, "status", "200")]["requests"] == 4
+    assert rows[("minute", minute, "domain", "")]["events"] == 1  # missing values are ""
+    assert (rows[("hour", hour, "total", "")]["events"], rows[("hour", hour, "total", "")]["requests"]) == (3, 5)
+    assert rows[("hour", hour, "src_ip", "10.0.0.1")]["requests"] == 4
+
+
+def test_anomaly_rollups_sum_and_max_scores():
+    anomalies = [
+        {"event_timestamp": T, "detector": "rules", "score": 0.5},
+        {"event_timestamp": T, "detector": "rules", "score": 0.9},
+        {"event_timestamp": T.replace(minute=50), "detector": None, "score": None},
+    ]
+    rows = by_key(anomaly_rollup_rows("u", anomalies), "resolution", "bucket", "detector")
+    minute = rows[("minute", truncate(T, "minute"), "rules")]
+    assert (minute["count"], minute["score_sum"], minute["max_score"]) == (2, pytest.approx(1.4), 0.9)
+    assert rows[("hour", truncate(T, "hour"), "")]["count"] == 1
+    assert len(rows) == 4
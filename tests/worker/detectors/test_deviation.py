@@ -0,0 +1,56 @@
+from typing import Dict, List
+
+import numpy as np
+
+from worker.detectors.deviation import ProfileDeviationDetector
+from worker.profiles import ProfileStore, empty_profile
+
+
+class MemoryStore(ProfileStore):
+    def __init__(self):
+        self.profiles: Dict[str, Dict] = {}
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict]:
+        return {k: self.profiles.get(k) or empty_profile() for k in keys}
+
+    def put_many(self, profiles: Dict[str, Dict]) -> None:
+        self.profiles.update(profiles)
+
+
+def columns(ips, sizes):
+    n = len(ips)
+    return {
+        "src_ip": np.array(ips, dtype=object),
+        "username": np.array(["-"] * n, dtype=object),
+        "bytes": np.array(sizes, dtype=np.int64),
+        "status": np.full(n, 200, dtype=np.int32),
+        "hour": np.full(n, 10.0),
+        "url": np.array(["/"] * n, dtype=object),
+    }
+
+
+def detector_with_history(ip, n, size):
+    detector = ProfileDeviationDetector(MemoryStore())
+    detector.update(columns([ip] * n, [size] * n))
+    return detector
+
+
+def test_constant_sizes_do_not_flag_small_changes():
+    # std is 0 for an entity that always sends 1000 bytes; a 10% change is not an outlier
+    detector = detector_with_history("10.0.0.1", 200, 1000)
+    result = detector.score(columns(["10.0.0.1", "10.0.0.1"], [1100, 50000]))
+    assert result.scores[0] == 0
+    assert result.scores[1] == 1.0
+    assert "far from usual volume" in result.reasons[1]
+
+
+def test_bytes_need_a_minimum_history():
+    detector = detector_with_history("10.0.0.2", 60, 1000)
+    result = detector.score(columns(["10.0.0.2"], [10_000_000]))
+    assert result.scores[0] == 0
+
+
+def test_unknown_entities_are_not_scored():
+    detector = detector_with_history("10.0.0.3", 200, 1000)
+    result = detector.score(columns(["10.9.9.9"], [10_000_000]))
+    assert result.scores[0] == 0 and result.reasons[0] is None
@@ -0,0 +1,72 @@
+import numpy as np
+
+from worker.detectors import iplists
+from worker.detectors.iplists import IPMatcher, PrefixTable, country_code, load_cidr_lists, load_network_csv
+
+
+def addresses(*values):
+    return np.array(values, dtype=object)
+
+
+def test_longest_prefix_wins(tmp_path):
+    (tmp_path / "tor.txt").write_text("# exit nodes\n10.0.0.0/8\n10.1.2.0/24 ; narrower\nnot-a-cidr\n2001:db8::/32\n")
+    (tmp_path / "scanners.txt").write_text("10.1.2.3\n")
+    table = load_cidr_lists([str(tmp_path)])
+    assert table.size == 4
+
+    matcher = IPMatcher(table, PrefixTable().compile(), PrefixTable().compile(), PrefixTable().compile())
+    out = matcher.annotate({
+        "src_ip": addresses("10.1.2.3", "10.1.2.4", "10.9.9.9", "11.0.0.1", "2001:db8::1", "garbage", ""),
+        "dest_ip": addresses("", "", "", "", "", "", ""),
+    })
+    assert out["src_deny_list"].tolist() == ["scanners", "tor", "tor", "", "tor", "", ""]
+    assert out["src_deny"].tolist() == [True, True, True, False, True, False, False]
+    assert out["src_ip_valid"].tolist() == [True, True, True, True, True, False, False]
+    assert not out["src_allow"].any()
+
+
+def test_geo_and_asn_enrichment(tmp_path):
+    geo = tmp_path / "geo.csv"
+    geo.write_text("network,country_iso_code\n192.0.2.0/24,NL\n198.51.100.0/24,\n")
+    asn = tmp_path / "asn.csv"
+    asn.write_text(
+        "network,autonomous_system_number,autonomous_system_organization\n"
+        "192.0.2.0/25,64500,Example Hosting\n"
+    )
+    empty = PrefixTable().compile()
+    matcher = IPMatcher(empty, empty, load_network_csv(str(geo), ("country_iso_code",)),
+                        load_network_csv(str(asn), ("autonomous_system_number", "autonomous_system_organization")))
+    out = matcher.annotate({
+        "src_ip": addresses("192.0.2.10", "192.0.2.200", "203.0.113.1"),
+        "dest_ip": addresses("198.51.100.7", "", "192.0.2.1"),
+    })
+    assert out["src_country"].tolist() == ["NL", "NL", ""]
+    assert out["src_asn"].tolist() == [64500, -1, -1]
+    assert out["src_asn"].dtype == np.int64
+    assert out["src_asn_org"].tolist() == ["Example Hosting", "", ""]
+    assert out["dest_country"].tolist() == ["", "", "NL"]
+    assert out["dest_asn"].tolist() == [-1, -1, 64500]
+
+
+def test_missing_paths_load_empty_tables(tmp_path):
+    assert load_cidr_lists([str(tmp_path / "missing")]).size == 0
+    assert load_network_csv("", ("country_iso_code",)).size == 0
+
+
+def test_country_codes_are_validated_on_load(tmp_path):
+    geo = tmp_path / "geo.csv"
+    geo.write_text("network,country_iso_code\n192.0.2.0/24, nl \n198.51.100.0/24,Netherlands\n203.0.113.0/24,1A\n")
+    table = load_network_csv(str(geo), ("country_iso_code",), clean={"country_iso_code": country_code})
+    assert [p[0] for p in table.payloads] == ["NL", "", ""]
+
+
+def test_failed_first_load_gives_each_table_its_own_empty_table(monkeypatch):
+    def broken(cls):
+        raise OSError("unreadable")
+
+    monkeypatch.setattr(iplists.IPMatcher, "load", classmethod(broken))
+    monkeypatch.setattr(iplists, "_matcher", None)
+    matcher = iplists.get_ip_matcher()
+    tables = [matcher.deny, matcher.allow, matcher.geo, matcher.asn]
+    assert len({id(t) for t in tables}) == 4
+    assert all(t.size == 0 for t in tables)
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+from worker.detectors.isolation import FEATURES, IsolationForestDetector
+
+
+def batch(rng, n, start=0):
+    cols = {f: rng.normal(10, 1, n) for f in FEATURES}
+    cols["bytes"] = np.abs(cols["bytes"]) * 1000
+    cols["hour"] = (np.arange(start, start + n) % 24).astype(np.float64)
+    return cols
+
+
+def test_model_is_refitted_as_the_upload_grows_and_cached_at_the_end(tmp_path):
+    rng = np.random.default_rng(1)
+    detector = IsolationForestDetector("src", model_dir=str(tmp_path), max_fit_samples=2000)
+    fits = []
+    original_fit = detector._fit
+
+    def counting_fit():
+        fits.append(detector.sample.seen)
+        original_fit()
+
+    detector._fit = counting_fit
+    for i in range(10):
+        scores = detector.score(batch(rng, 500, i * 500))
+        assert scores.shape == (500,)
+    assert fits == [500, 1000, 2000, 4000]
+    assert not os.path.exists(detector.model_path)
+
+    detector.finish()
+    assert fits[-1] == 5000
+    assert os.path.exists(detector.model_path)
+    assert not detector.provisional
+
+    # A later upload from the same source reuses the cached model without sampling
+    reused = IsolationForestDetector("src", model_dir=str(tmp_path), max_fit_samples=2000)
+    reused.score(batch(rng, 50))
+    assert reused.model is not None and reused.sample.seen == 0
+
+
+def test_too_few_events_score_zero_until_the_sample_is_large_enough(tmp_path):
+    rng = np.random.default_rng(2)
+    detector = IsolationForestDetector("small", model_dir=str(tmp_path))
+    assert not detector.score(batch(rng, 10)).any()
+    assert detector.model is None
+    detector.finish()
+    assert not os.path.exists(detector.model_path)
+
+
+def test_outlier_scores_higher_than_inliers(tmp_path):
+    rng = np.random.default_rng(3)
+    detector = IsolationForestDetector("outliers", model_dir=str(tmp_path))
+    cols = batch(rng, 1000)
+    cols["url_length"][0] = 500.0
+    cols["entropy"][0] = 60.0
+    scores = detector.score(cols)
+    assert scores[0] > np.median(scores)
@@ -0,0 +1,37 @@
+import pytest
+
+from worker.detectors import keywords
+from worker.detectors.keywords import KeywordAutomaton
+
+KEYWORDS = ["union select", "../", "etc/passwd", "he", "she", "hers", "HE"]
+
+
+@pytest.fixture(params=["native", "fallback"])
+def automaton_kind(request, monkeypatch):
+    if request.param == "native":
+        pytest.importorskip("ahocorasick")
+    else:
+        monkeypatch.setattr(keywords, "ahocorasick", None)
+    return request.param
+
+
+def ids(automaton, *words):
+    return {automaton.index[w] for w in words}
+
+
+def test_keywords_are_lowercased_and_deduplicated(automaton_kind):
+    automaton = KeywordAutomaton(KEYWORDS + [""])
+    assert automaton.keywords == ["union select", "../", "etc/passwd", "he", "she", "hers"]
+
+
+def test_find_matches_overlapping_keywords(automaton_kind):
+    automaton = KeywordAutomaton(KEYWORDS)
+    assert automaton.find("USHERS") == ids(automaton, "he", "she", "hers")
+    assert automaton.find("/a/../../ETC/passwd?q=1 UNION SELECT") == ids(automaton, "../", "etc/passwd", "union select")
+
+
+def test_find_without_matches(automaton_kind):
+    automaton = KeywordAutomaton(KEYWORDS)
+    assert automaton.find("/index.html") == set()
+    assert automaton.find("") == set()
+    assert KeywordAutomaton([]).find("anything") == set()
@@ -0,0 +1,56 @@
+import numpy as np
+
+from worker.detectors.rate import SlidingWindowRate, rate_ratios
+
+
+def ips(*values):
+    return np.array(values, dtype=object)
+
+
+def test_counts_per_ip_within_each_window():
+    rate = SlidingWindowRate(windows=[10, 60])
+    counts = rate.update(ips("a", "a", "b", "a", "a"), np.array([0.0, 5.0, 5.0, 30.0, 40.0]))
+    assert counts[10].tolist() == [1, 2, 1, 1, 2]
+    assert counts[60].tolist() == [1, 2, 1, 3, 4]
+
+
+def test_windows_carry_over_consecutive_batches():
+    rate = SlidingWindowRate(windows=[60])
+    rate.update(ips("a", "a", "b"), np.array([0.0, 10.0, 20.0]))
+    counts = rate.update(ips("a", "b", "a"), np.array([50.0, 90.0, 100.0]))
+    # "a" at 100 only reaches back to 40: the earlier 0 and 10 have left the window
+    assert counts[60].tolist() == [3, 1, 2]
+
+
+def test_weights_are_summed():
+    rate = SlidingWindowRate(windows=[60])
+    counts = rate.update(ips("a", "a"), np.array([0.0, 1.0]), weights=np.array([5, 3]))
+    assert counts[60].tolist() == [5, 8]
+
+
+def test_untimestamped_events_count_their_ip_in_the_batch():
+    rate = SlidingWindowRate(windows=[10, 60])
+    counts = rate.update(ips("a", "a", "b", "a"), np.array([np.nan, np.nan, np.nan, 0.0]))
+    assert counts[10].tolist() == [2, 2, 1, 1]
+    assert counts[60].tolist() == [2, 2, 1, 1]
+
+
+def test_empty_batch():
+    counts = SlidingWindowRate(windows=[60]).update(ips(), np.array([]))
+    assert counts[60].tolist() == []
+
+
+def test_rate_ratios_pick_the_worst_window():
+    counts = {60: np.array([50, 10]), 600: np.array([100, 400])}
+    ratio, window, count = rate_ratios(counts, {60: 100, 600: 500})
+    assert ratio.tolist() == [0.5, 0.8]
+    assert window.tolist() == [60, 600]
+    assert count.tolist() == [50, 400]
+
+
+def test_far_apart_timestamps_do_not_overflow_the_sort_key():
+    # A span of ~2**62 ms makes an (ip code * span + ms) key wrap for a later IP and
+    # land inside the first one's run, the same overflow millions of IPs cause at real spans
+    rate = SlidingWindowRate(windows=[10])
+    counts = rate.update(ips("a", "a", "d", "e"), np.array([0.0, 5.0, 4611686018427378.0, 2.0]))
+    assert counts[10].tolist() == [1, 2, 1, 1]
@@ -0,0 +1,98 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from worker.detectors.rules import RuleEngine, RuleSet, load_rule_specs, RULES_PATH
+
+
+def columns(**overrides):
+    cols = {
+        "src_ip": np.array(["10.0.0.1", "10.0.0.2", "10.0.0.3"], dtype=object),
+        "method": np.array(["GET", "BREW", "POST"], dtype=object),
+        "user_agent": np.array(["Mozilla/5.0", "curl/7.77.0", "python-requests"], dtype=object),
+        "bytes": np.array([100, 6_000_000, 10], dtype=np.int64),
+        "rate_ratio": np.array([0.5, 2.0, 0.1]),
+        "src_deny": np.array([False, False, True]),
+        "src_deny_list": np.array(["", "", "tor"], dtype=object),
+    }
+    cols.update(overrides)
+    return cols
+
+
+def rule(name="r", score=0.5, reason=None, **cond):
+    spec = {"name": name, "when": [cond], "score": score}
+    if reason:
+        spec["reason"] = reason
+    return spec
+
+
+def test_default_rules_compile():
+    assert RuleSet(load_rule_specs(RULES_PATH)).rules
+
+
+def test_best_rule_wins_per_event():
+    ruleset = RuleSet([
+        rule("big", 0.8, "Large: {bytes}", field="bytes", op=">", value=5_000_000),
+        rule("method", 0.9, "Method {method}", field="method", op="not_in", value=["GET", "POST"]),
+        rule("ua", 0.6, field="user_agent", op="contains_any", value=["curl", "python"]),
+        rule("deny", 0.95, "Denied via {src_deny_list}", field="src_deny", op="==", value=True),
+    ])
+    matches = ruleset.evaluate(columns())
+    assert matches.rules == [None, "method", "deny"]
+    assert matches.reasons == [None, "Method BREW", "Denied via tor"]
+    np.testing.assert_allclose(matches.scores, [0.0, 0.9, 0.95])
+
+
+def test_score_scales_with_a_field():
+    ruleset = RuleSet([rule("rate", {"field": "rate_ratio", "scale": 0.25, "max": 1.0},
+                            field="rate_ratio", op=">", value=1.0)])
+    np.testing.assert_allclose(ruleset.evaluate(columns()).scores, [0.0, 0.5, 0.0])
+
+
+@pytest.mark.parametrize("spec", [
+    rule(field="no_such_column", op=">", value=1),
+    rule(field="bytes", op="~", value=1),
+    rule(field="bytes", op=">", value="big"),
+    rule(field="method", op=">", value=3),
+    rule(field="method", op="==", value=1),
+    rule(field="bytes", op="contains_any", value=["x"]),
+    rule(field="method", op="in", value="GET"),
+    rule(field="user_agent", op="contains_any", value=[""]),
+    rule(field="url", op="regex", value="(unclosed"),
+    rule(score="high", field="bytes", op=">", value=1),
+    rule(score={"field": "method"}, field="bytes", op=">", value=1),
+    rule(reason="{missing_field}", field="bytes", op=">", value=1),
+    {"when": [{"field": "bytes", "op": ">", "value": 1}]},
+    {"name": "empty", "when": []},
+])
+def test_invalid_rules_are_rejected_at_compile_time(spec):
+    with pytest.raises(ValueError):
+        RuleSet([spec])
+
+
+def test_one_invalid_rule_rejects_the_file_and_keeps_previous_rules(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": [rule("big", 0.8, field="bytes", op=">", value=5_000_000)]}))
+    engine = RuleEngine(str(path), reload_interval=0)
+    assert [r.name for r in engine.ruleset.rules] == ["big"]
+
+    path.write_text(json.dumps({"rules": [
+        rule("ok", 0.5, field="bytes", op=">", value=1),
+        rule("bad", 0.5, field="no_such_column", op=">", value=1),
+    ]}))
+    os.utime(path, (1, 1))
+    matches = engine.evaluate(columns())
+    assert [r.name for r in engine.ruleset.rules] == ["big"]
+    assert matches.rules == [None, "big", None]
+
+
+def test_rule_failing_on_a_batch_is_skipped():
+    ruleset = RuleSet([
+        rule("big", 0.8, field="bytes", op=">", value=5_000_000),
+        rule("rate", 0.9, field="rate_ratio", op=">", value=1.0),
+    ])
+    cols = columns()
+    del cols["rate_ratio"]  # column missing from this batch
+    assert ruleset.evaluate(cols).rules == [None, "big", None]
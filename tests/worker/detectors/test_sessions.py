@@ -0,0 +1,42 @@
+import numpy as np
+
+from worker.detectors.sessions import Sessionizer
+
+
+def batch(timestamps, ips, urls=None, status=None, byte_values=None):
+    n = len(timestamps)
+    return {
+        "timestamp": np.array(timestamps, dtype=np.float64),
+        "src_ip": np.array(ips, dtype=object),
+        "username": np.array([""] * n, dtype=object),
+        "user_agent": np.array(["curl/8"] * n, dtype=object),
+        "url": np.array(urls or ["/"] * n, dtype=object),
+        "status": np.array(status or [200] * n, dtype=np.int32),
+        "bytes": np.array(byte_values or [100] * n, dtype=np.int64),
+    }
+
+
+def test_gaps_and_keys_split_sessions():
+    result = Sessionizer(gap=60).update(batch([0, 30, 200, 10, np.nan], ["a", "a", "a", "b", "a"]))
+    ids = result.features["session_id"]
+    assert ids[0] == ids[1]
+    assert len({ids[0], ids[2], ids[3]}) == 3
+    assert np.isnan(ids[4]) and result.scores[4] == 0
+    assert result.features["events"][:4].tolist() == [2, 2, 1, 1]
+    assert result.features["duration"][0] == 30
+
+
+def test_sessions_continue_across_batches():
+    sessions = Sessionizer(gap=60)
+    first = sessions.update(batch([0, 30], ["a", "a"], urls=["/x", "/y"], status=[200, 404]))
+    second = sessions.update(batch([50, 500], ["a", "a"], urls=["/x", "/z"]))
+    assert second.features["session_id"][0] == first.features["session_id"][0]
+    assert second.features["session_id"][1] != first.features["session_id"][0]
+    assert second.features["events"][0] == 3
+    assert second.features["distinct_paths"][0] == 2
+    assert second.features["error_ratio"][0] > 0
+
+
+def test_batch_without_timestamps():
+    result = Sessionizer(gap=60).update(batch([np.nan, np.nan], ["a", "b"]))
+    assert result.scores.tolist() == [0, 0] and result.reasons == [None, None]
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from worker.detectors.sketches import CountMinSketch, HyperLogLogSet, ScanSketches, SpaceSaving
+
+
+def obj(values):
+    return np.array(values, dtype=object)
+
+
+def test_hyperloglog_estimates_distinct_values_per_key():
+    hll = HyperLogLogSet(precision=10)
+    urls = [f"/page/{i}" for i in range(2000)]
+    hll.add(obj(["scanner"] * 2000 + ["user"] * 3), obj(urls + ["/", "/", "/home"]))
+    scanner, user, unseen = hll.estimate(obj(["scanner", "user", "nobody"]))
+    assert scanner == pytest.approx(2000, rel=0.1)
+    assert round(user) == 2
+    assert unseen == 0
+
+
+def test_hyperloglog_ignores_empty_keys_and_values():
+    hll = HyperLogLogSet(precision=8)
+    hll.add(obj(["", "a", "a"]), obj(["/x", "", "/y"]))
+    assert list(hll.rows) == ["a"]
+    assert round(hll.estimate(obj(["a"]))[0]) == 1
+
+
+def test_hyperloglog_merge_is_a_union():
+    a, b = HyperLogLogSet(precision=10), HyperLogLogSet(precision=10)
+    a.add(obj(["ip"] * 500), obj([f"/{i}" for i in range(500)]))
+    b.add(obj(["ip"] * 500 + ["other"]), obj([f"/{i}" for i in range(250, 750)] + ["/"]))
+    a.merge(b)
+    assert a.estimate(obj(["ip"]))[0] == pytest.approx(750, rel=0.1)
+    assert round(a.estimate(obj(["other"]))[0]) == 1
+    with pytest.raises(ValueError):
+        a.merge(HyperLogLogSet(precision=8))
+
+
+def test_count_min_never_underestimates():
+    cms = CountMinSketch(width=64, depth=4)
+    values = obj([f"ip{i % 200}" for i in range(5000)] + ["heavy"] * 1000)
+    cms.add(values)
+    estimates = cms.estimate(obj(["heavy", "ip0", "absent"]))
+    assert estimates[0] >= 1000 and estimates[1] >= 25
+    assert cms.total == 6000
+
+
+def test_count_min_weights_and_merge():
+    a, b = CountMinSketch(width=1024, depth=4), CountMinSketch(width=1024, depth=4)
+    a.add(obj(["x", "y"]), weights=np.array([3, 1]))
+    b.add(obj(["x"]), weights=np.array([2]))
+    a.merge(b)
+    assert a.estimate(obj(["x", "y"])).tolist() == [5, 1]
+    assert a.total == 6
+    with pytest.raises(ValueError):
+        a.merge(CountMinSketch(width=8, depth=4))
+
+
+def test_space_saving_tracks_heavy_hitters_with_error_bounds():
+    ss = SpaceSaving(k=2)
+    ss.update(obj(["a"] * 10 + ["b"] * 5 + ["c"] * 2 + [""] * 7))
+    ss.update(obj(["d"]))
+    top = ss.top()
+    assert top[0] == ("a", 10, 0)
+    assert len(top) == 2
+    # Whatever holds the second slot is bounded by its error
+    value, count, error = top[1]
+    assert count - error <= {"b": 5, "c": 2, "d": 1}[value] <= count
+
+
+def test_space_saving_merge_adds_counts():
+    a, b = SpaceSaving(k=3), SpaceSaving(k=3)
+    a.update(obj(["x", "x", "y"]))
+    b.update(obj(["x", "z"]), weights=np.array([2, 1]))
+    a.merge(b)
+    assert dict((v, c) for v, c, _ in a.top()) == {"x": 4, "y": 1, "z": 1}
+
+
+def test_scan_sketches_columns():
+    sketches = ScanSketches()
+    n = 40
+    columns = {
+        "src_ip": obj(["scanner"] * 30 + ["user"] * 9 + [""]),
+        "url": obj([f"/admin/{i}" for i in range(30)] + ["/"] * 10),
+        "dest_ip": obj(["10.0.0.1"] * n),
+        "domain": obj(["example.com"] * 30 + [""] * 10),
+        "count": np.ones(n, dtype=np.int64),
+    }
+    out = sketches.update(columns)
+    assert out["distinct_urls"][0] == pytest.approx(30, abs=2)
+    assert out["distinct_urls"][30] == 1 and out["distinct_urls"][-1] == 0
+    assert out["distinct_dests"][0] == 1
+    assert out["ip_requests"][0] == 30 and out["ip_requests"][-1] == 0
+    assert out["ip_share"][0] == pytest.approx(30 / 39)
+    assert out["domain_share"][0] == pytest.approx(1.0) and out["domain_share"][-1] == 0
+    assert sketches.top_ips.top(1) == [("scanner", 30, 0)]
@@ -0,0 +1,52 @@
+import numpy as np
+
+from worker.embeddings.similarity import distance_to_score, self_knn_distances
+
+
+def cluster(rng, n, center, spread=0.05):
+    return (center + rng.normal(0, spread, (n, len(center)))).astype(np.float32)
+
+
+def test_outlier_is_furthest_from_its_neighbours():
+    rng = np.random.default_rng(0)
+    center = np.ones(16)
+    outlier = -np.ones((1, 16), dtype=np.float32)
+    embeddings = np.concatenate([cluster(rng, 50, center), outlier])
+    distances = self_knn_distances(embeddings, k=3, block_size=8)
+    assert distances.argmax() == 50
+    assert distances[:50].max() < 0.05
+    assert distances[50] > 1.5
+
+
+def test_blocking_and_sampling_do_not_change_exact_results():
+    rng = np.random.default_rng(1)
+    embeddings = rng.normal(size=(300, 8)).astype(np.float32)
+    reference = self_knn_distances(embeddings, k=4, block_size=1000)
+    np.testing.assert_allclose(self_knn_distances(embeddings, k=4, block_size=7), reference, rtol=1e-5)
+    sampled = self_knn_distances(embeddings, k=4, block_size=64, sample_size=100)
+    assert np.isfinite(sampled).all()
+
+
+def test_a_row_is_not_its_own_neighbour_and_zero_rows_are_skipped():
+    embeddings = np.array([[1, 0], [1, 0], [0, 1], [0, 0]], dtype=np.float32)
+    distances = self_knn_distances(embeddings, k=1)
+    np.testing.assert_allclose(distances[:3], [0.0, 0.0, 1.0], atol=1e-6)
+    assert np.isnan(distances[3])
+
+
+def test_earlier_batches_are_part_of_the_reference_set():
+    rng = np.random.default_rng(2)
+    center = np.ones(16)
+    earlier = cluster(rng, 100, center)
+    # A batch whose rows are unlike each other but like the earlier batches
+    batch = np.concatenate([cluster(rng, 1, center), -np.ones((1, 16), dtype=np.float32)])
+    alone = self_knn_distances(batch, k=3)
+    with_earlier = self_knn_distances(batch, k=3, earlier=earlier)
+    assert alone[0] > 1.0
+    assert with_earlier[0] < 0.05
+    assert with_earlier[1] > 1.5
+
+
+def test_distance_to_score():
+    scores = distance_to_score(np.array([0.1, 0.35, 0.5, 0.7, 2.0, np.nan]), 0.35)
+    np.testing.assert_allclose(scores, [0, 0, 0.5 / 0.7, 1.0, 1.0, 0], rtol=1e-6)
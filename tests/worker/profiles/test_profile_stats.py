@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from worker.profiles.stats import batch_profiles, empty_profile, merge_profile, status_class
+
+
+def columns(byte_values, statuses, hours, urls):
+    return {
+        "bytes": np.array(byte_values, dtype=np.int64),
+        "status": np.array(statuses, dtype=np.int32),
+        "hour": np.array(hours, dtype=np.float64),
+        "url": np.array(urls, dtype=object),
+    }
+
+
+def test_status_class():
+    assert status_class(np.array([200, 302, 404, 503, -1, 101])).tolist() == [0, 1, 2, 3, 4, 4]
+
+
+def test_batch_profiles_group_by_entity():
+    entities = np.array(["a", "a", "b", ""], dtype=object)
+    profiles = batch_profiles(entities, columns([100, 300, 50, 999], [200, 404, 200, 200],
+                                                [1, np.nan, 23, 5], ["/x", "/x", "/y", "/z"]))
+    assert set(profiles) == {"a", "b"}
+    a = profiles["a"]
+    assert (a["count"], a["bytes_mean"], a["bytes_m2"]) == (2, 200.0, 20000.0)
+    assert a["status"] == [1, 0, 1, 0, 0]
+    assert a["hours"][1] == 1 and sum(a["hours"]) == 1
+    assert len(a["urls"]) == 1
+    assert batch_profiles(np.array(["", ""], dtype=object), columns([1, 2], [200, 200], [0, 0], ["/", "/"])) == {}
+
+
+def test_merge_matches_a_single_pass():
+    values = np.array([10, 20, 30, 40, 1000], dtype=np.float64)
+    entities = np.array(["a"] * 5, dtype=object)
+
+    def cols(sl):
+        n = len(values[sl])
+        return columns(values[sl], [200] * n, [0] * n, [f"/{v}" for v in values[sl]])
+
+    merged = empty_profile()
+    for sl in (slice(0, 2), slice(2, 5)):
+        merged = merge_profile(merged, batch_profiles(entities[sl], cols(sl))["a"])
+    assert merged["count"] == 5
+    assert merged["bytes_mean"] == pytest.approx(values.mean())
+    assert merged["bytes_m2"] / merged["count"] == pytest.approx(values.var())
+    assert merged["status"][0] == 5 and len(merged["urls"]) == 5
+    assert merge_profile(empty_profile(), empty_profile()) == empty_profile()
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from worker.profiles import LocalProfileStore, ProfileStore, batch_profiles
+
+
+def batch(entity, n, size=1000):
+    columns = {
+        "bytes": np.full(n, size, dtype=np.int64),
+        "status": np.full(n, 200, dtype=np.int32),
+        "hour": np.full(n, 10.0),
+        "url": np.array([f"/page/{i % 5}" for i in range(n)], dtype=object),
+    }
+    return batch_profiles(np.array([entity] * n, dtype=object), columns)
+
+
+def test_profile_store_is_abstract():
+    with pytest.raises(TypeError):
+        ProfileStore()
+
+
+def test_local_stores_sharing_a_file_do_not_lose_updates(tmp_path):
+    path = str(tmp_path / "profiles.sqlite")
+    first, second = LocalProfileStore(path), LocalProfileStore(path)
+    first.merge_many(batch("ip:10.0.0.1", 10))
+    second.merge_many(batch("ip:10.0.0.1", 5))
+    second.merge_many(batch("user:alice", 3))
+    first.merge_many(batch("ip:10.0.0.1", 1))
+
+    fresh = LocalProfileStore(path)
+    profiles = fresh.get_many(["ip:10.0.0.1", "user:alice", "user:nobody"])
+    assert profiles["ip:10.0.0.1"]["count"] == 16
+    assert profiles["user:alice"]["count"] == 3
+    assert profiles["user:nobody"]["count"] == 0
+    # Readers see other processes' writes without reopening the store
+    assert first.get_many(["user:alice"])["user:alice"]["count"] == 3
+
+
+def test_local_store_starts_empty_on_a_corrupt_file(tmp_path):
+    path = tmp_path / "profiles.sqlite"
+    path.write_bytes(b"not a database" * 100)
+    store = LocalProfileStore(str(path))
+    assert store.get_many(["ip:x"])["ip:x"]["count"] == 0
+    store.merge_many(batch("ip:x", 2))
+    assert LocalProfileStore(str(path)).get_many(["ip:x"])["ip:x"]["count"] == 2
+    assert (tmp_path / "profiles.sqlite.corrupt").exists()
+
+
+def test_local_merge_touches_only_the_batch_rows(tmp_path):
+    store = LocalProfileStore(str(tmp_path / "profiles.sqlite"))
+    store.put_many({f"ip:{i}": batch(f"ip:{i}", 1)[f"ip:{i}"] for i in range(2000)})
+    changes = store.conn.total_changes
+    store.merge_many(batch("ip:7", 4))
+    assert store.conn.total_changes - changes == 1
+    assert store.get_many(["ip:7", "ip:8"])["ip:7"]["count"] == 5
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+from shared.schemas import ParsedEvent
+from worker.dedup import collapse_duplicates, line_keys
+
+T0 = datetime(2025, 1, 14, 8, 0, tzinfo=timezone.utc)
+
+
+def make_event(seconds=0.0, **overrides):
+    fields = dict.fromkeys(ParsedEvent.model_fields)
+    fields.update(
+        timestamp=T0 + timedelta(seconds=seconds) if seconds is not None else None,
+        src_ip="10.0.0.1", method="GET", url="/", status=200, bytes=10,
+    )
+    fields.update(overrides)
+    return ParsedEvent(**fields)
+
+
+def test_line_keys_ignore_timestamp_and_raw_line():
+    a = make_event(0, raw_line="line 1")
+    b = make_event(30, raw_line="line 2")
+    c = make_event(0, url="/other")
+    keys = line_keys([a, b, c])
+    assert keys[0] == keys[1] != keys[2]
+
+
+def test_duplicates_in_one_window_collapse_into_the_earliest():
+    events = [make_event(3), make_event(1, url="/x"), make_event(1), make_event(2)]
+    batch = collapse_duplicates(events, window=60)
+    # Representatives keep their input order
+    assert batch.events == [events[1], events[2]]
+    assert batch.counts.tolist() == [1, 3]
+    assert batch.first_seen[1] == T0 + timedelta(seconds=1)
+    assert batch.last_seen[1] == T0 + timedelta(seconds=3)
+    assert batch.lines == 4 and batch.collapsed == 2
+
+
+def test_duplicates_in_different_windows_stay_apart():
+    batch = collapse_duplicates([make_event(10), make_event(70)], window=60)
+    assert batch.counts.tolist() == [1, 1]
+
+
+def test_untimestamped_duplicates_collapse_together():
+    events = [make_event(None), make_event(0), make_event(None)]
+    batch = collapse_duplicates(events, window=60)
+    assert batch.events == [events[0], events[1]]
+    assert batch.counts.tolist() == [2, 1]
+    assert batch.first_seen[0] is None
+
+
+def test_empty_batch():
+    batch = collapse_duplicates([])
+    assert batch.events == [] and batch.lines == 0 and len(batch.counts) == 0
@@ -0,0 +1,102 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from worker import explain_cache
+from worker.explain_cache import (
+    ExplanationCache, LRU_KEY, anomaly_signature, render_template, to_template,
+)
+
+EVENT = {"src_ip": "10.0.0.5", "url": "/admin/users/42?id=10.0.0.5", "username": "-", "method": "get", "status": 403}
+
+
+def test_signature_ignores_ids_and_values():
+    a = anomaly_signature("rules", "Blocked 10.0.0.5 after 12 tries", 0.83, EVENT)
+    b = anomaly_signature("rules", "Blocked 10.9.9.9 after 99 tries", 0.87,
+                          {**EVENT, "url": "/admin/users/7", "method": "GET", "status": 401})
+    assert a == b
+    assert a != anomaly_signature("rules", "Blocked 10.0.0.5 after 12 tries", 0.95, EVENT)
+    assert a != anomaly_signature("isolation_forest", "Blocked 10.0.0.5 after 12 tries", 0.83, EVENT)
+
+
+def test_template_round_trip():
+    explanation = "Host 10.0.0.5 probed /admin/users/42?id=10.0.0.5 {twice}; user - unknown"
+    template = to_template(explanation, EVENT)
+    # The URL is replaced whole before the IP; "-" is too short to template
+    assert template == "Host {src_ip} probed {url} {{twice}}; user - unknown"
+    other = {"src_ip": "192.168.1.1", "url": "/admin/users/7", "username": None}
+    assert render_template(template, other) == "Host 192.168.1.1 probed /admin/users/7 {twice}; user - unknown"
+
+
+def test_template_covers_every_prompt_field():
+    event = {
+        "timestamp": datetime(2025, 1, 14, 8, 15, tzinfo=timezone.utc), "src_ip": "10.0.0.5",
+        "url": "/login", "username": "alice", "method": "POST", "status": 401, "bytes": 512,
+        "user_agent": "sqlmap/1.7",
+    }
+    explanation = (
+        "At 2025-01-14T08:15:00+00:00 alice (10.0.0.5, sqlmap/1.7) sent POST /login, "
+        "got 401 with 512 bytes; 14010 similar requests."
+    )
+    template = to_template(explanation, event)
+    assert template == (
+        "At {timestamp} {username} ({src_ip}, {user_agent}) sent {method} {url}, "
+        "got {status} with {bytes} bytes; 14010 similar requests."
+    )
+    other = {**event, "timestamp": datetime(2025, 1, 15, 9, 0, tzinfo=timezone.utc), "username": "bob",
+             "status": 403, "bytes": 2048, "user_agent": "curl/8.4.0"}
+    rendered = render_template(template, other)
+    assert "bob" in rendered and "403" in rendered and "2048" in rendered and "curl/8.4.0" in rendered
+    assert "2025-01-15 09:00:00+00:00" in rendered
+    assert "alice" not in rendered and "512" not in rendered and "sqlmap" not in rendered
+
+
+def test_placeholders_are_not_matched_again():
+    template = to_template("User url fetched /url", {"username": "url", "url": "/url"})
+    assert template == "User {username} fetched {url}"
+
+
+def test_values_too_short_to_template_split_the_signature():
+    a = anomaly_signature("rules", "Large response", 0.8, {**EVENT, "bytes": 12})
+    b = anomaly_signature("rules", "Large response", 0.8, {**EVENT, "bytes": 64})
+    c = anomaly_signature("rules", "Large response", 0.8, {**EVENT, "bytes": 4096})
+    d = anomaly_signature("rules", "Large response", 0.8, {**EVENT, "bytes": 8192})
+    assert a != b and c == d
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(explain_cache.aioredis.Redis, "from_url",
+                        lambda url, **kw: fakeredis.FakeAsyncRedis(server=server, **kw))
+    monkeypatch.setattr(explain_cache, "EXPLAIN_CACHE_MAX_ENTRIES", 2)
+    return ExplanationCache("redis://fake")
+
+
+def test_least_recently_used_signatures_are_evicted(cache, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(explain_cache.time, "time", lambda: clock[0])
+
+    async def scenario():
+        await cache.put_many({"a": "A"})
+        clock[0] += 1
+        await cache.put_many({"b": "B"})
+        clock[0] += 1
+        assert await cache.get_many(["a", "missing"]) == {"a": "A"}  # touches a
+        clock[0] += 1
+        await cache.put_many({"c": "C"})
+        return await cache.get_many(["a", "b", "c"]), await cache.client.zcard(LRU_KEY)
+
+    hits, size = asyncio.run(scenario())
+    assert hits == {"a": "A", "c": "C"}
+    assert size == 2
+
+
+def test_record_stats_accumulates(cache):
+    async def scenario():
+        await cache.record_stats("u1", anomalies=5, cache_hits=2, llm_calls=3)
+        return await cache.record_stats("u1", anomalies=1, cache_hits=1, llm_calls=0)
+
+    assert asyncio.run(scenario()) == {"anomalies": 6, "cache_hits": 3, "llm_calls": 3}
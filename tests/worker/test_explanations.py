@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+from ipaddress import ip_address
+from types import SimpleNamespace
+
+from worker.explanations import event_context
+from worker.llm import build_explanation_prompt
+
+
+def make_event(**overrides):
+    fields = dict(timestamp=datetime(2024, 1, 1, tzinfo=timezone.utc), src_ip=ip_address("10.0.0.7"),
+                  url="/admin", username="bob", method="GET", status=403, bytes=512, user_agent="curl/8.4.0")
+    fields.update(overrides)
+    return SimpleNamespace(**fields)
+
+
+def test_event_context_stringifies_inet_values():
+    ctx = event_context(make_event(src_ip=ip_address("2001:db8::1")))
+    assert ctx["src_ip"] == "2001:db8::1"
+    assert ctx["status"] == 403
+    assert ctx["user_agent"] == "curl/8.4.0" and ctx["timestamp"].year == 2024
+
+
+def test_event_context_keeps_missing_ip():
+    assert event_context(make_event(src_ip=None))["src_ip"] is None
+
+
+def test_prompt_accepts_ip_address_objects():
+    event = {"src_ip": ip_address("10.0.0.7"), "timestamp": datetime(2024, 1, 1, tzinfo=timezone.utc), "url": "/"}
+    prompt = build_explanation_prompt(event, ["Admin path"], 0.5, 0.8)
+    assert '"src_ip": "10.0.0.7"' in prompt
@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from worker.features import epoch_seconds, factorize, normalize_text, stable_hash64, url_shape
+
+
+def test_normalize_text_masks_values():
+    assert normalize_text("Blocked 10.1.2.3 after 42 tries (id DEADBEEF01)") == "blocked <ip> after <n> tries (id <n>)"
+    assert normalize_text(None) == ""
+
+
+def test_url_shape_drops_query_and_ids():
+    assert url_shape("/Users/1234/orders/abcdef0123?page=2") == "/users/<n>/orders/<n>"
+    assert url_shape("") == ""
+
+
+def test_factorize_codes_round_trip():
+    values = np.array(["b", "a", "b", "c"], dtype=object)
+    uniques, codes = factorize(values)
+    assert uniques[codes].tolist() == values.tolist()
+    assert codes.tolist() == [1, 0, 1, 2]
+
+
+def test_stable_hash64_is_deterministic():
+    values = np.array(["x", "y", "x"], dtype=object)
+    hashed = stable_hash64(values)
+    assert hashed.dtype == np.uint64
+    assert hashed[0] == hashed[2] != hashed[1]
+    # blake2b, not hash(): identical across processes and runs
+    assert int(hashed[0]) == 0x4F586EF96743DF4A
+    assert len(stable_hash64(np.array([], dtype=object))) == 0
+
+
+def test_naive_timestamps_are_utc():
+    naive = datetime(2025, 1, 14, 8, 15)
+    assert epoch_seconds(naive) == epoch_seconds(naive.replace(tzinfo=timezone.utc)) == 1736842500.0
+    assert np.isnan(epoch_seconds(None))
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+
+from worker import incidents as incidents_module
+from worker.incidents import IncidentAggregator, reason_class_for
+
+T0 = datetime(2025, 1, 14, 8, 0, tzinfo=timezone.utc)
+
+
+def anomaly(i, seconds, ip="10.0.0.1", score=0.8, detector="rule_based", reason_class="rule:scan"):
+    return {
+        "event_index": i, "timestamp": T0 + timedelta(seconds=seconds), "src_ip": ip, "username": None,
+        "detector": detector, "reason_class": reason_class, "reason": f"reason {i}", "score": score,
+    }
+
+
+def test_anomalies_beyond_the_cap_are_counted_but_not_members(monkeypatch):
+    monkeypatch.setattr(incidents_module, "INCIDENT_MAX_ANOMALIES", 3)
+    aggregator = IncidentAggregator("upload-1")
+    assigned = aggregator.assign([anomaly(i, i) for i in range(5)])
+    assert len(assigned) == 5
+    assert len({id(incident) for incident, _ in assigned}) == 1
+    assert [member for _, member in assigned] == [True, True, True, False, False]
+    incident = assigned[0][0]
+    assert incident.count == 5
+
+    # The count keeps growing across batches; membership stays capped
+    assigned = aggregator.assign([anomaly(5, 10)])
+    assert assigned[0] == (incident, False)
+    (snap_incident, values, _), = aggregator.snapshot()
+    assert snap_incident is incident and values["count"] == 6
+
+
+def test_gap_longer_than_the_window_starts_a_new_incident():
+    aggregator = IncidentAggregator("upload-1")
+    gap = incidents_module.INCIDENT_WINDOW_SECONDS + 1
+    assigned = aggregator.assign([anomaly(0, 0), anomaly(1, 10), anomaly(2, 10 + gap)])
+    assert assigned[0][0] is assigned[1][0]
+    assert assigned[2][0] is not assigned[0][0]
+
+
+def test_highest_score_represents_the_incident():
+    aggregator = IncidentAggregator("upload-1")
+    aggregator.assign([anomaly(0, 0, score=0.6), anomaly(1, 1, score=0.9), anomaly(2, 2, score=0.7)])
+    (_, values, rep_index), = aggregator.snapshot()
+    assert rep_index == 1
+    assert values["max_score"] == 0.9 and values["reason"] == "reason 1"
+    assert values["first_seen"] == T0 and values["last_seen"] == T0 + timedelta(seconds=2)
+
+
+def test_entities_and_reason_classes_group_separately():
+    aggregator = IncidentAggregator("upload-1")
+    assigned = aggregator.assign([
+        anomaly(0, 0), anomaly(1, 0, ip="10.0.0.2"), anomaly(2, 0, reason_class="rule:other"),
+    ])
+    assert len({id(incident) for incident, _ in assigned}) == 3
+
+
+def test_reason_class_for():
+    assert reason_class_for("rule_based", "large_transfer", "Large data transfer detected: 123 bytes") == "rule:large_transfer"
+    assert reason_class_for("self_similarity", None, None) == "self_similarity"
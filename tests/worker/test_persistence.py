@@ -0,0 +1,115 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from worker import persistence
+from worker.persistence import PersistenceStage
+
+
+@pytest.fixture
+def stage(monkeypatch):
+    async def no_bump(reason=""):
+        return None
+
+    monkeypatch.setattr(persistence, "bump_data_version", no_bump)
+    s = PersistenceStage("upload-1", incidents=None)
+    s.recorded = []
+
+    async def record(status, **values):
+        s.recorded.append((status, values))
+
+    s._set_status = record
+    return s
+
+
+@pytest.mark.parametrize("written, failed, expected", [
+    (100, 0, "completed"),
+    (100, 2, "partial"),
+    (0, 3, "failed"),
+])
+def test_final_status_reflects_failed_batches(stage, written, failed, expected):
+    stage.events_written, stage.failed_batches = written, failed
+    asyncio.run(stage.close())
+    assert stage.recorded == [(expected, {"failed_batches": failed})]
+
+
+def test_failed_upload_stays_failed(stage):
+    asyncio.run(stage.close("failed"))
+    assert stage.recorded[0][0] == "failed"
+
+
+def test_dead_writer_does_not_block_submit_or_close(stage):
+    async def scenario():
+        stage.queue = asyncio.Queue(maxsize=1)
+
+        async def crash():
+            raise RuntimeError("connection lost during rollback")
+
+        stage._run = crash
+        stage.start()
+        await asyncio.sleep(0)
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(stage.submit("batch"), timeout=1)
+        await stage.queue.put("queued")
+        await asyncio.wait_for(stage.close(), timeout=1)
+
+    asyncio.run(scenario())
+    assert stage.recorded == [("failed", {"failed_batches": 1})]
+
+
+def test_writer_dying_on_a_full_queue_releases_submit(stage):
+    async def scenario():
+        stage.queue = asyncio.Queue(maxsize=1)
+        release = asyncio.Event()
+
+        async def crash_later():
+            await release.wait()
+            raise RuntimeError("boom")
+
+        stage._run = crash_later
+        stage.start()
+        await stage.submit("first")  # fills the queue
+        blocked = asyncio.create_task(stage.submit("second"))
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(blocked, timeout=1)
+        stage.events_written = 10
+        await asyncio.wait_for(stage.close(), timeout=1)
+
+    asyncio.run(scenario())
+    # The queued first batch was never written
+    assert stage.recorded == [("partial", {"failed_batches": 1})]
+
+
+def test_failed_anomaly_write_counts_as_failed_batch(stage, monkeypatch):
+    async def noop(*args, **kwargs):
+        return 0
+
+    for name in ("ensure_partitions", "add_event_rollups", "add_anomaly_rollups"):
+        monkeypatch.setattr(persistence, name, noop)
+
+    class FakeDB:
+        commit = rollback = noop
+
+    class FakeWriter:
+        async def write_events(self, rows):
+            return [101, 102]
+
+        async def write_anomalies(self, rows):
+            raise RuntimeError("COPY failed")
+
+    class FakeIncidents:
+        flush = noop
+
+    stage.incidents = FakeIncidents()
+    batch = persistence.ScoredBatch(
+        events=[{"timestamp": None}, {"timestamp": None}],
+        anomalies=[{"event_id": 1}], anomaly_incidents=[None], anomaly_ml_scores=[0.9],
+        incident_updates=[], embeddings=np.zeros((0, 4)), embed_idx=np.zeros(0, dtype=int),
+    )
+    asyncio.run(stage._write(FakeDB(), FakeWriter(), batch))
+    assert (stage.events_written, stage.anomalies_written, stage.failed_batches) == (2, 0, 1)
+    asyncio.run(stage.close())
+    assert stage.recorded[-1] == ("partial", {"failed_batches": 1})
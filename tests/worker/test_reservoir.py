@@ -0,0 +1,28 @@
+import numpy as np
+
+from worker.reservoir import Reservoir
+
+
+def test_sample_is_uniform_across_batches():
+    reservoir = Reservoir(1000)
+    rows = np.arange(20000, dtype=np.float32)[:, None]
+    for chunk in np.array_split(rows, 20):
+        reservoir.add(chunk)
+    assert reservoir.seen == 20000
+    assert reservoir.rows.shape == (1000, 1)
+    # Later batches are represented as much as the first one
+    assert 8000 < reservoir.rows.mean() < 12000
+    assert (reservoir.rows >= 1000).mean() > 0.9
+
+
+def test_keeps_everything_below_its_size():
+    reservoir = Reservoir(100)
+    reservoir.add(np.ones((30, 4)))
+    reservoir.add(np.zeros((20, 4)))
+    assert len(reservoir) == 50
+    assert reservoir.rows[:30].all() and not reservoir.rows[30:].any()
+
+
+def test_empty_reservoir():
+    reservoir = Reservoir(10)
+    assert len(reservoir) == 0 and reservoir.rows is None
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from worker import tiering
+from worker.tiering import event_templates, plan_tiers
+
+
+@pytest.fixture(autouse=True)
+def tiers(monkeypatch):
+    monkeypatch.setattr(tiering, "TIERED_SCORING", True)
+    monkeypatch.setattr(tiering, "TIER_DECIDED_SCORE", 0.9)
+    monkeypatch.setattr(tiering, "TIER_TEMPLATE_MIN_COUNT", 3)
+    monkeypatch.setattr(tiering, "TIER_TEMPLATE_SAMPLES", 1)
+
+
+def columns(urls, status=None, method="GET", agent="Mozilla/5.0"):
+    n = len(urls)
+    return {
+        "url": np.array(urls, dtype=object),
+        "user_agent": np.array([agent] * n, dtype=object),
+        "method": np.array([method] * n, dtype=object),
+        "status": np.array(status or [200] * n, dtype=np.int32),
+    }
+
+
+def test_templates_mask_ids_and_query_strings():
+    cols = columns(["/item/1", "/item/22?x=1", "/cart", "/item/3"], status=[200, 200, 200, 404])
+    codes = event_templates(cols)
+    assert codes[0] == codes[1]
+    assert len({codes[0], codes[2], codes[3]}) == 3
+    assert len(event_templates(columns([]))) == 0
+
+
+def test_frequent_templates_embed_only_representatives():
+    cols = columns(["/item/1", "/item/2", "/item/3", "/item/4", "/cart"])
+    scores = np.array([0.95, 0.1, 0.2, 0.3, 0.1])
+    plan = plan_tiers(scores, cols)
+    # Item 1 is decided; item 2 is the template's first undecided event; /cart is rare
+    assert plan.decided.tolist() == [True, False, False, False, False]
+    assert plan.embed.tolist() == [False, True, False, False, True]
+    stats = plan.stats()
+    assert stats["embedded"] == 2 and stats["frequent_template"] == 3
+    assert stats["embedding_calls_avoided"] == pytest.approx(0.6)
+
+
+def test_share_template_scores_fills_skipped_members():
+    cols = columns(["/item/1", "/item/2", "/item/3", "/item/4", "/cart"])
+    plan = plan_tiers(np.array([0.95, 0.1, 0.2, 0.3, 0.1]), cols)
+    scores = np.array([0.95, 0.7, 0.0, 0.0, 0.4])
+    assert plan.share_template_scores(scores).tolist() == [0.95, 0.7, 0.7, 0.7, 0.4]
+
+
+def test_disabled_tiering_embeds_everything(monkeypatch):
+    monkeypatch.setattr(tiering, "TIERED_SCORING", False)
+    plan = plan_tiers(np.array([1.0, 0.0]), columns(["/a", "/a"]))
+    assert plan.embed.all() and not plan.decided.any()
@@ -0,0 +1,199 @@
+"""
+Persistence throughput benchmark: rows/s of the COPY writer.
+
+Writes synthetic batches shaped like the scorer's output (events with raw
+lines, ANOMALY_SHARE of them with an anomaly) through BulkWriter, and
+through a plain executemany INSERT of the same rows for comparison, into
+the configured database. Each run happens in a transaction that is rolled
+back, so nothing is left behind:
+
+    python -m worker.benchmarks.copy_throughput --rows 100000 --runs 3
+
+Rates cover the whole write of a batch (id allocation, raw-line blocks,
+events and anomalies), not the raw COPY alone. Index maintenance is part of
+the cost, so results depend on which of the events indexes exist; the
+"unindexed" path COPYs the same rows into unindexed temporary tables as
+the ceiling the host allows. The JSON output records the server version,
+CPU count and events indexes next to the rates; copy_throughput.json holds
+the last checked-in run.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from shared.db import settings as db_settings
+from shared.models import Anomaly, Event, EventRawBlock, Upload
+from shared.partitions import batch_periods, ensure_partitions
+from shared.raw_lines import build_blocks
+from worker.bulk_writer import ANOMALY_COLUMNS, EVENT_COLUMNS, BulkWriter
+
+ANOMALY_SHARE = 0.05
+METHODS = ("GET", "GET", "GET", "POST", "PUT", "DELETE")
+STATUSES = (200, 200, 200, 301, 404, 500)
+AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "curl/8.4.0",
+    "python-requests/2.31.0",
+)
+
+
+def make_batch(upload_id: uuid.UUID, n: int, start: datetime, seed: int = 0):
+    """n event rows over one day from start, and anomaly rows whose event_id is a batch index."""
+    rng = random.Random(seed)
+    events, anomalies = [], []
+    for i in range(n):
+        ts = start + timedelta(seconds=86400 * i / n)
+        src_ip = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        method, status = rng.choice(METHODS), rng.choice(STATUSES)
+        url = f"/api/v1/items/{rng.randrange(5000)}?page={rng.randrange(20)}"
+        agent = rng.choice(AGENTS)
+        size = rng.randrange(200, 50000)
+        events.append({
+            "upload_id": upload_id,
+            "timestamp": ts,
+            "src_ip": src_ip,
+            "dest_ip": "192.168.0.10",
+            "user_agent": agent,
+            "username": f"user{rng.randrange(500)}",
+            "url": url,
+            "method": method,
+            "status": status,
+            "bytes": size,
+            "raw_line": f'{src_ip} - - [{ts:%d/%b/%Y:%H:%M:%S +0000}] "{method} {url} HTTP/1.1" {status} {size} "-" "{agent}"',
+            "src_country": "US",
+            "src_asn": 64512 + rng.randrange(100),
+            "dest_country": None,
+            "dest_asn": None,
+            "count": 1,
+        })
+        if rng.random() < ANOMALY_SHARE:
+            anomalies.append({
+                "event_id": i,
+                "event_timestamp": ts,
+                "detector": "isolation_forest",
+                "score": round(rng.uniform(0.6, 1.0), 4),
+                "reason": "Unusual request pattern",
+                "incident_id": None,
+            })
+    return events, anomalies
+
+
+async def copy_path(db, events, anomalies) -> None:
+    writer = BulkWriter(db)
+    event_ids = await writer.write_events(events)
+    for a in anomalies:
+        a["event_id"] = event_ids[a["event_id"]]
+    await writer.write_anomalies(anomalies)
+
+
+async def insert_path(db, events, anomalies) -> None:
+    writer = BulkWriter(db)
+    event_ids = await writer.allocate_ids("events", len(events))
+    for e, event_id in zip(events, event_ids):
+        e["id"] = event_id
+    await db.execute(insert(Event), [{c: e.get(c) for c in EVENT_COLUMNS} for e in events])
+    await db.execute(insert(EventRawBlock), build_blocks(events[0]["upload_id"], events, writer.block_lines))
+    anomaly_ids = await writer.allocate_ids("anomalies", len(anomalies))
+    for a, anomaly_id in zip(anomalies, anomaly_ids):
+        a["id"] = anomaly_id
+        a["event_id"] = event_ids[a["event_id"]]
+    if anomalies:
+        await db.execute(insert(Anomaly), [{c: a.get(c) for c in ANOMALY_COLUMNS} for a in anomalies])
+
+
+async def unindexed_path(db, events, anomalies) -> None:
+    # Temporary tables skip WAL, and LIKE copies no indexes
+    for i, e in enumerate(events):
+        e["id"] = i
+    for i, a in enumerate(anomalies):
+        a["id"] = i
+    await db.execute(text("CREATE TEMP TABLE bench_events (LIKE events) ON COMMIT DROP"))
+    await db.execute(text("CREATE TEMP TABLE bench_anomalies (LIKE anomalies) ON COMMIT DROP"))
+    writer = BulkWriter(db)
+    await writer.copy("bench_events", EVENT_COLUMNS, events)
+    await writer.copy("bench_anomalies", ANOMALY_COLUMNS, anomalies)
+
+
+PATHS = {"copy": copy_path, "insert": insert_path, "unindexed": unindexed_path}
+
+
+async def environment(db) -> dict:
+    version = (await db.execute(text("SHOW server_version"))).scalar()
+    indexes = await db.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'events' ORDER BY indexname"
+    ))
+    return {"server_version": version, "cpus": os.cpu_count(), "events_indexes": list(indexes.scalars())}
+
+
+async def run(rows: int, runs: int, paths) -> dict:
+    engine = create_async_engine(db_settings.DATABASE_URL)
+    start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    result = {"environment": {}, "paths": {}}
+    try:
+        Session = async_sessionmaker(engine)
+        # Committed like the persister does, so the timed writes find their partitions
+        async with Session() as db:
+            await ensure_partitions(db, batch_periods([start, start + timedelta(days=1)]))
+            await db.commit()
+            result["environment"] = await environment(db)
+        for name in paths:
+            rates = []
+            for attempt in range(runs + 1):  # the first run warms up
+                upload_id = uuid.uuid4()
+                events, anomalies = make_batch(upload_id, rows, start, seed=attempt)
+                async with Session() as db:
+                    db.add(Upload(id=upload_id, filename="copy-benchmark.log", status="processing"))
+                    await db.flush()
+                    started = time.perf_counter()
+                    await PATHS[name](db, events, anomalies)
+                    elapsed = time.perf_counter() - started
+                    await db.rollback()
+                if attempt:
+                    rates.append((len(events) + len(anomalies)) / elapsed)
+            result["paths"][name] = {
+                "events": rows,
+                "anomalies": len(anomalies),
+                "rows_per_s_median": round(statistics.median(rates)),
+                "rows_per_s_min": round(min(rates)),
+                "rows_per_s_max": round(max(rates)),
+            }
+    finally:
+        await engine.dispose()
+    return result
+
+
+def print_table(result: dict) -> None:
+    print(f"{'path':<10}{'events':>9}{'anomalies':>11}{'median rows/s':>15}{'min':>10}{'max':>10}")
+    for name, r in result["paths"].items():
+        print(
+            f"{name:<10}{r['events']:>9}{r['anomalies']:>11}{r['rows_per_s_median']:>15}"
+            f"{r['rows_per_s_min']:>10}{r['rows_per_s_max']:>10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000, help="events per batch")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per path")
+    parser.add_argument("--paths", nargs="+", choices=sorted(PATHS), default=list(PATHS), help="write paths to time")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.rows, args.runs, args.paths))
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(result, fh, indent=2)
+    print_table(result)
+
+
+if __name__ == "__main__":
+    main()
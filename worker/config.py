@@ -18,13 +18,105 @@ DISTANCE_THRESHOLD = 0.75  # Cosine distance threshold for anomalies
 MIN_NEIGHBORS_FOR_COMPARISON = 5  # Minimum neighbors needed for comparison
 ANOMALY_SCORE_THRESHOLD = 0.7  # Final score threshold
 
+# Intra-upload self-similarity (k-NN over the upload's own embeddings)
+SELF_SIMILARITY_K = 5  # Neighbours averaged per event
+SELF_SIMILARITY_DISTANCE_THRESHOLD = 0.35  # Cosine distance threshold for anomalies
+SELF_SIMILARITY_BLOCK_SIZE = 1024  # Rows per GEMM block (peak memory ~ block^2 floats)
+SELF_SIMILARITY_SAMPLE_SIZE = 20000  # Reference rows sampled from a batch, and kept from its earlier batches
+
+# Sliding-window request rate: "window_seconds:max_requests" pairs, comma separated
+RATE_WINDOWS = {
+    int(window): int(limit)
+    for window, limit in (
+        pair.split(":") for pair in os.getenv("RATE_WINDOWS", "60:100,600:500").split(",") if pair
+    )
+}
+
+# Declarative rules (JSON or YAML), re-read when the file changes
+RULES_PATH = os.getenv(
+    "RULES_PATH", os.path.join(os.path.dirname(__file__), "detectors", "default_rules.json")
+)
+RULES_RELOAD_INTERVAL = 5  # Seconds between rule file mtime checks
+
+# Scan / heavy-hitter sketches (fixed memory per source IP)
+SKETCH_HLL_PRECISION = 10  # 2^p HyperLogLog registers per IP (~3% error)
+SKETCH_CMS_WIDTH = 65536  # Count-Min counters per row
+SKETCH_CMS_DEPTH = 4  # Count-Min rows (independent hashes)
+SKETCH_TOP_K = 100  # Heavy hitters tracked by Space-Saving
+
+# CIDR allow/deny lists and GeoIP/ASN enrichment; list paths are files or
+# directories of files with one CIDR per line, comma separated
+IPLIST_DENY_PATHS = [p for p in os.getenv("IPLIST_DENY_PATHS", "").split(",") if p]
+IPLIST_ALLOW_PATHS = [p for p in os.getenv("IPLIST_ALLOW_PATHS", "").split(",") if p]
+GEOIP_CSV_PATH = os.getenv("GEOIP_CSV_PATH", "")  # network,country_iso_code
+ASN_CSV_PATH = os.getenv("ASN_CSV_PATH", "")  # network,autonomous_system_number,autonomous_system_organization
+IPLIST_RELOAD_INTERVAL = 60  # Seconds between list file mtime checks
+
+# Cross-upload entity profiles (per source IP and username)
+PROFILE_STORE = os.getenv("PROFILE_STORE", "redis")  # "redis" or "local"
+PROFILE_REDIS_URL = os.getenv("PROFILE_REDIS_URL", "redis://redis:6379/2")
+PROFILE_LOCAL_PATH = os.path.join(MODEL_BASE_DIR, "profiles.sqlite")
+PROFILE_TTL_DAYS = 30  # Profiles expire after this many days without updates (redis only)
+PROFILE_MAX_URLS = 500  # Distinct URL hashes remembered per entity
+PROFILE_MIN_EVENTS = 50  # Events an entity needs before deviations are scored
+PROFILE_BYTES_Z_THRESHOLD = 3.0  # Bytes z-score where deviation scoring starts
+PROFILE_BYTES_MIN_EVENTS = 100  # Events an entity needs before its transfer sizes are z-scored
+PROFILE_BYTES_STD_FLOOR = 0.05  # Bytes std is at least this fraction of the mean (and 1 byte)
+PROFILE_RARE_PROBABILITY = 0.01  # Status classes / hours below this frequency are rare
+PROFILE_NEW_URL_SCORE = 0.3  # Score for a URL never requested by the entity
+
+# Sessions keyed by (src_ip, username, user_agent)
+SESSION_GAP_SECONDS = int(os.getenv("SESSION_GAP_SECONDS", "1800"))  # Inactivity that closes a session
+SESSION_MAX_OPEN = 200000  # Open sessions kept between batches; least recently active are closed first
+SESSION_MAX_TRACKED_PATHS = 256  # URL hashes remembered per open session for distinct-path counts
+SESSION_MIN_EVENTS = 5  # Sessions shorter than this are not scored
+SESSION_MIN_SESSIONS = 10  # Scored sessions needed in a batch to form a baseline
+SESSION_Z_THRESHOLD = 3.5  # Robust z-score where session scoring starts
+
+# IsolationForest over numeric event features
+ISOLATION_N_ESTIMATORS = 100
+ISOLATION_N_JOBS = int(os.getenv("ISOLATION_N_JOBS", os.cpu_count() or 1))
+ISOLATION_MAX_FIT_SAMPLES = 100000  # Size of the reservoir sample of an upload's rows models are fitted on
+ISOLATION_MIN_FIT_EVENTS = 100  # Minimum events to fit a new model
+ISOLATION_MODEL_MAX_AGE_HOURS = 24  # Cached per-source models are refitted after this
+ISOLATION_SCORE_OFFSET = 0.5  # Raw IsolationForest score mapped to 0
+ISOLATION_SCORE_RANGE = 0.15  # Raw score span mapped onto [0, 1]
+
+# Background LLM explanations
+EXPLAIN_CONCURRENCY = int(os.getenv("EXPLAIN_CONCURRENCY", "4"))  # Concurrent LLM calls per task
+EXPLAIN_TASK_BATCH_SIZE = 200  # Anomalies per explanation task message
+EXPLAIN_CACHE_REDIS_URL = os.getenv("EXPLAIN_CACHE_REDIS_URL", "redis://redis:6379/2")
+EXPLAIN_CACHE_TTL_DAYS = 7  # Cached explanations expire after this many days unused
+EXPLAIN_CACHE_MAX_ENTRIES = 50000  # Least recently used signatures are evicted beyond this
+EXPLAIN_CACHE_SCORE_BUCKET = 0.1  # Width of final-score buckets in the signature
+
+# Incident aggregation
+INCIDENT_WINDOW_SECONDS = 900  # Gap after which repeated anomalies start a new incident
+INCIDENT_MAX_ANOMALIES = int(os.getenv("INCIDENT_MAX_ANOMALIES", "100"))  # Anomalies linked to an incident as its members
+
 # Processing
 EMBEDDING_BATCH_SIZE = 50  # Process embeddings in batches
 EMBEDDING_TIMEOUT = 30  # Timeout for embedding generation (seconds)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "10000"))  # Lines scored and persisted per micro-batch
+PERSIST_MAX_IN_FLIGHT = 2  # Scored micro-batches waiting for the persistence stage before ingest blocks
+COPY_CHUNK_SIZE = int(os.getenv("COPY_CHUNK_SIZE", "50000"))  # Rows per COPY into Postgres
+DEDUP_EVENTS = os.getenv("DEDUP_EVENTS", "false").lower() == "true"  # Collapse duplicate lines into one event with a count
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "1"))  # Time bucket within which duplicates collapse
+RAW_BLOCK_LINES = int(os.getenv("RAW_BLOCK_LINES", "1000"))  # Raw lines compressed together per event_raw_blocks row
 
 # Hybrid detection
 ML_SCALE = 0.9  # Weight of embeddings score in hybrid detection
 RULE_SCALE = 1.0  # Weight of rule-based score
+SELF_SIMILARITY_SCALE = 0.8  # Weight of intra-upload self-similarity score
+PROFILE_SCALE = 0.8  # Weight of profile deviation score
+ISOLATION_SCALE = 0.9  # Weight of IsolationForest score
+SESSION_SCALE = 0.8  # Weight of session-level score
 
 # Logging
 LOG_EMBEDDINGS_PROGRESS = True
+
+# Tiered scoring: only events the cheap detectors leave undecided are embedded
+TIERED_SCORING = os.getenv("TIERED_SCORING", "true").lower() == "true"
+TIER_DECIDED_SCORE = 0.9  # Cheap-tier score at which an event skips embedding
+TIER_TEMPLATE_MIN_COUNT = 20  # Events sharing a template before it counts as high-frequency
+TIER_TEMPLATE_SAMPLES = 2  # Events per high-frequency template still embedded as representatives
@@ -0,0 +1,79 @@
+"""
+Exact-duplicate collapsing at ingest (DEDUP_EVENTS).
+
+A line is normalized to its parsed fields without the timestamp and
+hashed; events of a batch with the same hash whose timestamps fall in the
+same DEDUP_WINDOW_SECONDS bucket collapse into their earliest event, which
+carries the occurrence count and the first/last timestamps. Events without
+a timestamp collapse with every identical untimestamped line of the batch.
+
+Downstream, the count is used as a weight by the rate windows and traffic
+sketches, so rate rules see the true request volume while only one row is
+stored and at most one embedding is computed per group.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+
+from shared.schemas import ParsedEvent
+from worker.features import epoch_seconds, stable_hash64
+from worker.config import DEDUP_WINDOW_SECONDS
+
+# Fields that make two lines duplicates of each other
+DEDUP_FIELDS = ("src_ip", "dest_ip", "method", "url", "status", "bytes", "user_agent", "username")
+
+
+@dataclass
+class CollapsedBatch:
+    """Representative events of a batch, in input order, with their duplicates folded in."""
+    events: List[ParsedEvent]
+    counts: np.ndarray  # int64 occurrences per representative
+    first_seen: List[Optional[datetime]]
+    last_seen: List[Optional[datetime]]
+    lines: int  # events before collapsing
+
+    @property
+    def collapsed(self) -> int:
+        return self.lines - len(self.events)
+
+
+def line_keys(events: List[ParsedEvent]) -> np.ndarray:
+    """Stable 64-bit hash of each event's normalized line."""
+    lines = np.array(
+        ["\x1f".join("" if getattr(e, f) is None else str(getattr(e, f)) for f in DEDUP_FIELDS) for e in events],
+        dtype=object,
+    )
+    return stable_hash64(lines)
+
+
+def collapse_duplicates(events: List[ParsedEvent], window: float = DEDUP_WINDOW_SECONDS) -> CollapsedBatch:
+    n = len(events)
+    if n == 0:
+        return CollapsedBatch([], np.zeros(0, dtype=np.int64), [], [], 0)
+
+    keys = line_keys(events)
+    ts = np.array([epoch_seconds(e.timestamp) for e in events], dtype=np.float64)
+    has_ts = ~np.isnan(ts)
+    buckets = np.full(n, -1, dtype=np.int64)
+    buckets[has_ts] = np.floor(ts[has_ts] / window).astype(np.int64)
+
+    # Group by (key, bucket), time-ordered inside a group (input order without timestamps)
+    order = np.lexsort((np.arange(n), np.where(has_ts, ts, 0.0), buckets, keys))
+    k, b = keys[order], buckets[order]
+    starts = np.flatnonzero(np.concatenate([[True], (k[1:] != k[:-1]) | (b[1:] != b[:-1])]))
+    ends = np.concatenate([starts[1:], [n]]) - 1
+    counts = (ends - starts + 1).astype(np.int64)
+
+    # Keep the representatives in input order
+    reps = order[starts]
+    by_input = np.argsort(reps, kind="stable")
+    reps, counts, last = reps[by_input], counts[by_input], order[ends][by_input]
+    return CollapsedBatch(
+        events=[events[i] for i in reps],
+        counts=counts,
+        first_seen=[events[i].timestamp for i in reps],
+        last_seen=[events[i].timestamp for i in last],
+        lines=n,
+    )
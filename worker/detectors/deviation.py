@@ -0,0 +1,159 @@
+"""
+Behaviour deviation against cross-upload entity profiles.
+
+Each event is compared with the stored profile of its source IP and of its
+username (as they were before this batch): transfer size z-score, rarity of
+the status class and of the hour of activity, and whether the URL is new
+for the entity. Profiles are then updated with the batch.
+"""
+import logging
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional
+
+from worker.config import (
+    PROFILE_MIN_EVENTS,
+    PROFILE_BYTES_Z_THRESHOLD,
+    PROFILE_BYTES_MIN_EVENTS,
+    PROFILE_BYTES_STD_FLOOR,
+    PROFILE_RARE_PROBABILITY,
+    PROFILE_NEW_URL_SCORE,
+    PROFILE_MAX_URLS,
+)
+from worker.features import factorize, stable_hash64
+from worker.profiles import ProfileStore, batch_profiles, get_profile_store, STATUS_CLASSES
+from worker.profiles.stats import status_class, N_HOURS
+
+logger = logging.getLogger("worker.deviation")
+
+# (entity kind, column) pairs profiled per event
+ENTITY_KINDS = (("ip", "src_ip"), ("user", "username"))
+MISSING_USERNAMES = ("", "-")
+
+_PAIR_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+class DeviationResult(NamedTuple):
+    scores: np.ndarray  # float32 in [0, 1]
+    reasons: List[Optional[str]]
+
+
+def _entity_column(kind: str, values: np.ndarray) -> np.ndarray:
+    """Prefix entity values with their kind; missing values become ""."""
+    missing = np.isin(values, MISSING_USERNAMES) if kind == "user" else values == ""
+    uniques, codes = factorize(values)
+    prefixed = np.array([f"{kind}:{u}" for u in uniques], dtype=object)
+    out = prefixed[codes] if len(codes) else np.empty(0, dtype=object)
+    out[missing] = ""
+    return out
+
+
+class ProfileDeviationDetector:
+    """Scores events against stored profiles, then folds the batch into them."""
+
+    def __init__(self, store: Optional[ProfileStore] = None):
+        self.store = store or get_profile_store()
+
+    def _score_kind(self, entities: np.ndarray, columns: Dict[str, np.ndarray]):
+        n = len(entities)
+        scores = np.zeros((4, n), dtype=np.float32)
+        keep = np.flatnonzero(entities != "")
+        if keep.size == 0:
+            return scores
+
+        keys, codes = factorize(entities[keep])
+        profiles = self.store.get_many([str(k) for k in keys])
+        profiles = [profiles[str(k)] for k in keys]
+
+        count = np.array([p["count"] for p in profiles], dtype=np.float64)
+        mean = np.array([p["bytes_mean"] for p in profiles], dtype=np.float64)
+        std = np.sqrt(np.array([p["bytes_m2"] for p in profiles]) / np.maximum(count - 1, 1))
+        status = np.array([p["status"] for p in profiles], dtype=np.float64)
+        hours = np.array([p["hours"] for p in profiles], dtype=np.float64)
+
+        eligible = count[codes] >= PROFILE_MIN_EVENTS
+        if not eligible.any():
+            return scores
+        c = count[codes]
+
+        # Transfer size far from the entity's usual volume. An entity that always
+        # transfers the same size has a std near 0, so the std is floored relative
+        # to the mean; z-scores also need more history than frequencies do
+        floor = np.maximum(PROFILE_BYTES_STD_FLOOR * np.abs(mean), 1.0)
+        z = np.abs(columns["bytes"][keep] - mean[codes]) / np.maximum(std, floor)[codes]
+        bytes_score = np.clip((z - PROFILE_BYTES_Z_THRESHOLD) / PROFILE_BYTES_Z_THRESHOLD, 0, 1)
+        bytes_score = np.where(c >= PROFILE_BYTES_MIN_EVENTS, bytes_score, 0.0)
+
+        # Rare status class / hour (Laplace-smoothed frequencies)
+        cls = status_class(columns["status"][keep])
+        status_p = (status[codes, cls] + 1) / (c + len(STATUS_CLASSES))
+        status_score = np.clip(1 - status_p / PROFILE_RARE_PROBABILITY, 0, 1)
+
+        hour_col = columns["hour"][keep]
+        has_hour = ~np.isnan(hour_col)
+        hour_idx = np.where(has_hour, hour_col, 0).astype(np.int64)
+        hour_p = (hours[codes, hour_idx] + 1) / (c + N_HOURS)
+        hour_score = np.where(has_hour, np.clip(1 - hour_p / PROFILE_RARE_PROBABILITY, 0, 1), 0)
+
+        # URL never seen for this entity (only meaningful while the URL set is not saturated)
+        known_pairs = [
+            (i, h) for i, p in enumerate(profiles) for h in p["urls"]
+        ]
+        saturated = np.array([len(p["urls"]) >= PROFILE_MAX_URLS for p in profiles], dtype=bool)
+        event_keys = stable_hash64(columns["url"][keep]) ^ (codes.astype(np.uint64) * _PAIR_MIX)
+        if known_pairs:
+            pair_codes, pair_hashes = np.array(known_pairs, dtype=np.uint64).T
+            known_keys = pair_hashes ^ (pair_codes * _PAIR_MIX)
+            novel = ~np.isin(event_keys, known_keys)
+        else:
+            novel = np.ones(keep.size, dtype=bool)
+        url_score = np.where(novel & ~saturated[codes], PROFILE_NEW_URL_SCORE, 0.0)
+
+        components = np.stack([bytes_score, status_score, hour_score, url_score])
+        scores[:, keep] = np.where(eligible, components, 0.0)
+        return scores
+
+    def score(self, columns: Dict[str, np.ndarray]) -> DeviationResult:
+        """Score a batch against profiles built from earlier batches and uploads."""
+        n = len(columns["src_ip"])
+        best = np.zeros(n, dtype=np.float32)
+        best_component = np.zeros(n, dtype=np.int64)
+        best_kind = np.full(n, "", dtype=object)
+        best_entity = np.empty(n, dtype=object)
+
+        for kind, field in ENTITY_KINDS:
+            entities = _entity_column(kind, columns[field])
+            try:
+                components = self._score_kind(entities, columns)
+            except Exception:
+                logger.exception("Profile lookup failed for %s entities", kind)
+                continue
+            kind_best = components.max(axis=0)
+            better = kind_best > best
+            best[better] = kind_best[better]
+            best_component[better] = components.argmax(axis=0)[better]
+            best_entity[better] = columns[field][better]
+            best_kind[better] = kind
+
+        reasons: List[Optional[str]] = [None] * n
+        for idx in np.flatnonzero(best > 0):
+            who = f"{'IP' if best_kind[idx] == 'ip' else 'user'} {best_entity[idx]}"
+            component = best_component[idx]
+            if component == 0:
+                reasons[idx] = f"Transfer of {columns['bytes'][idx]} bytes far from usual volume for {who}"
+            elif component == 1:
+                status = columns["status"][idx]
+                reasons[idx] = f"Status {status} is rare for {who}"
+            elif component == 2:
+                reasons[idx] = f"Activity at {int(columns['hour'][idx]):02d}:00 is unusual for {who}"
+            else:
+                reasons[idx] = f"First request to {columns['url'][idx]} from {who}"
+        return DeviationResult(best, reasons)
+
+    def update(self, columns: Dict[str, np.ndarray]) -> None:
+        """Fold the batch into the stored profiles."""
+        for kind, field in ENTITY_KINDS:
+            entities = _entity_column(kind, columns[field])
+            try:
+                self.store.merge_many(batch_profiles(entities, columns))
+            except Exception:
+                logger.exception("Failed updating %s profiles", kind)
@@ -0,0 +1,289 @@
+"""
+CIDR allow/deny lists and GeoIP/ASN enrichment.
+
+Prefixes are inserted into binary tries (one for IPv4, one for IPv6) that
+are compiled into flat numpy arrays, so a batch is matched by walking all
+of its distinct addresses down the trie together, one bit level per step.
+Each distinct IP is parsed once per batch, however many lists are loaded.
+
+Lists are plain files with one CIDR (or address) per line and "#"
+comments; the file name is the list label. GeoIP and ASN data are CSVs
+with a "network" column plus country_iso_code, or autonomous_system_number
+and autonomous_system_organization (the GeoLite2 ASN CSV layout).
+Files are re-read when their mtime changes.
+"""
+import os
+import csv
+import time
+import logging
+import ipaddress
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from worker.features import factorize
+from worker.config import (
+    IPLIST_DENY_PATHS,
+    IPLIST_ALLOW_PATHS,
+    GEOIP_CSV_PATH,
+    ASN_CSV_PATH,
+    IPLIST_RELOAD_INTERVAL,
+)
+
+logger = logging.getLogger("worker.iplists")
+
+
+class PrefixTrie:
+    """Longest-prefix-match trie for one address family, compiled to arrays."""
+
+    def __init__(self, width: int):
+        self.width = width
+        self._children: List[List[int]] = [[-1, -1]]
+        self._values: List[int] = [-1]
+        self.depth = 0
+        self.children = np.full((1, 2), -1, dtype=np.int32)
+        self.values = np.full(1, -1, dtype=np.int32)
+
+    def insert(self, network, value: int) -> None:
+        addr = int(network.network_address)
+        node = 0
+        for d in range(network.prefixlen):
+            bit = (addr >> (self.width - 1 - d)) & 1
+            child = self._children[node][bit]
+            if child < 0:
+                child = len(self._children)
+                self._children[node][bit] = child
+                self._children.append([-1, -1])
+                self._values.append(-1)
+            node = child
+        self._values[node] = value
+        self.depth = max(self.depth, network.prefixlen)
+
+    def compile(self) -> None:
+        self.children = np.array(self._children, dtype=np.int32)
+        self.values = np.array(self._values, dtype=np.int32)
+
+    def lookup(self, hi: np.ndarray, lo: np.ndarray) -> np.ndarray:
+        """
+        Value of the longest matching prefix per address, -1 where none matches.
+
+        Addresses are given as the high and low 64 bits of their integer value.
+        """
+        n = len(lo)
+        best = np.full(n, self.values[0], dtype=np.int32)
+        node = np.zeros(n, dtype=np.int32)
+        active = np.ones(n, dtype=bool)
+        for d in range(self.depth):
+            idx = np.flatnonzero(active)
+            if not len(idx):
+                break
+            pos = self.width - 1 - d
+            if pos >= 64:
+                bits = (hi[idx] >> np.uint64(pos - 64)) & np.uint64(1)
+            else:
+                bits = (lo[idx] >> np.uint64(pos)) & np.uint64(1)
+            nxt = self.children[node[idx], bits.astype(np.int64)]
+            active[idx[nxt < 0]] = False
+            moved = idx[nxt >= 0]
+            node[moved] = nxt[nxt >= 0]
+            values = self.values[node[moved]]
+            best[moved[values >= 0]] = values[values >= 0]
+        return best
+
+
+class PrefixTable:
+    """IPv4 + IPv6 tries mapping prefixes to payload indexes."""
+
+    def __init__(self):
+        self.tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        self.payloads: List = []
+        self.size = 0
+
+    def add(self, cidr: str, payload) -> bool:
+        try:
+            network = ipaddress.ip_network(cidr.strip(), strict=False)
+        except ValueError:
+            return False
+        self.payloads.append(payload)
+        self.tries[network.version].insert(network, len(self.payloads) - 1)
+        self.size += 1
+        return True
+
+    def compile(self) -> "PrefixTable":
+        for trie in self.tries.values():
+            trie.compile()
+        return self
+
+    def lookup(self, addrs: "ParsedAddresses") -> np.ndarray:
+        """Payload index per distinct address, -1 where nothing matches."""
+        out = np.full(len(addrs.version), -1, dtype=np.int32)
+        for version, trie in self.tries.items():
+            mask = addrs.version == version
+            if mask.any() and trie.depth:
+                out[mask] = trie.lookup(addrs.hi[mask], addrs.lo[mask])
+        return out
+
+
+class ParsedAddresses:
+    """Distinct addresses of a column as (version, hi, lo) arrays plus codes back to events."""
+
+    def __init__(self, values: np.ndarray):
+        uniques, self.codes = factorize(values)
+        self.version = np.zeros(len(uniques), dtype=np.int8)
+        self.hi = np.zeros(len(uniques), dtype=np.uint64)
+        self.lo = np.zeros(len(uniques), dtype=np.uint64)
+        for i, value in enumerate(uniques):
+            try:
+                addr = ipaddress.ip_address(value)
+            except ValueError:
+                continue
+            as_int = int(addr)
+            self.version[i] = addr.version
+            self.hi[i] = as_int >> 64
+            self.lo[i] = as_int & 0xFFFFFFFFFFFFFFFF
+
+
+def _list_files(paths: Iterable[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if os.path.isfile(os.path.join(path, name))
+            )
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            logger.warning("IP list not found: %s", path)
+    return files
+
+
+def load_cidr_lists(paths: Iterable[str]) -> PrefixTable:
+    """One CIDR per line; the payload is the list label (file name without extension)."""
+    table = PrefixTable()
+    for path in _list_files(paths):
+        label = os.path.splitext(os.path.basename(path))[0]
+        with open(path, "r", encoding="utf-8", errors="ignore") as fh:
+            for line in fh:
+                entry = line.split("#", 1)[0].split(";", 1)[0].strip()
+                if entry and not table.add(entry.split()[0], label):
+                    logger.debug("Skipping invalid CIDR in %s: %s", path, entry)
+    return table.compile()
+
+
+def country_code(value: Optional[str]) -> str:
+    """Upper-cased two-letter ISO code, "" for anything else (events store it as String(2))."""
+    value = (value or "").strip().upper()
+    return value if len(value) == 2 and value.isalpha() else ""
+
+
+def load_network_csv(
+    path: str, columns: Tuple[str, ...], clean: Optional[Dict[str, Callable[[str], str]]] = None
+) -> PrefixTable:
+    """CSV with a "network" column; the payload is the tuple of the given columns,
+    each passed through its `clean` function if it has one."""
+    table = PrefixTable()
+    if not path:
+        return table.compile()
+    clean = clean or {}
+    with open(path, "r", encoding="utf-8", errors="ignore", newline="") as fh:
+        for row in csv.DictReader(fh):
+            payload = tuple(clean.get(c, str)(row.get(c) or "") for c in columns)
+            table.add(row.get("network") or "", payload)
+    return table.compile()
+
+
+class IPMatcher:
+    """All loaded lists, matched in bulk against a batch's src_ip/dest_ip columns."""
+
+    def __init__(self, deny: PrefixTable, allow: PrefixTable, geo: PrefixTable, asn: PrefixTable):
+        self.deny = deny
+        self.allow = allow
+        self.geo = geo
+        self.asn = asn
+
+    @classmethod
+    def load(cls) -> "IPMatcher":
+        matcher = cls(
+            load_cidr_lists(IPLIST_DENY_PATHS),
+            load_cidr_lists(IPLIST_ALLOW_PATHS),
+            load_network_csv(GEOIP_CSV_PATH, ("country_iso_code",), clean={"country_iso_code": country_code}),
+            load_network_csv(ASN_CSV_PATH, ("autonomous_system_number", "autonomous_system_organization")),
+        )
+        logger.info(
+            "Loaded IP lists: deny=%d allow=%d geoip=%d asn=%d prefixes",
+            matcher.deny.size, matcher.allow.size, matcher.geo.size, matcher.asn.size
+        )
+        return matcher
+
+    @staticmethod
+    def _labels(table: PrefixTable, hits: np.ndarray, field: int = None) -> np.ndarray:
+        payloads = np.array(
+            [p if field is None else p[field] for p in table.payloads] + [""], dtype=object
+        )
+        return payloads[hits]  # -1 picks the trailing ""
+
+    def annotate(self, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Per-event list and enrichment columns for the batch.
+
+        Returns:
+            src_ip_valid, dest_ip_valid: bool, the value parses as an address
+            src_deny, dest_deny, src_allow: bool
+            src_deny_list, dest_deny_list: object, matching list label or ""
+            src_country, dest_country: object, ISO code or ""
+            src_asn, dest_asn: int64, -1 when unknown
+            src_asn_org: object, "" when unknown
+        """
+        out: Dict[str, np.ndarray] = {}
+        for side in ("src", "dest"):
+            addrs = ParsedAddresses(columns[f"{side}_ip"])
+            out[f"{side}_ip_valid"] = (addrs.version > 0)[addrs.codes]
+            deny = self.deny.lookup(addrs)
+            out[f"{side}_deny"] = (deny >= 0)[addrs.codes]
+            out[f"{side}_deny_list"] = self._labels(self.deny, deny)[addrs.codes]
+            if side == "src":
+                out["src_allow"] = (self.allow.lookup(addrs) >= 0)[addrs.codes]
+
+            out[f"{side}_country"] = self._labels(self.geo, self.geo.lookup(addrs), 0)[addrs.codes]
+            asn_hits = self.asn.lookup(addrs)
+            asn_numbers = self._labels(self.asn, asn_hits, 0)
+            out[f"{side}_asn"] = np.array(
+                [int(a) if str(a).isdigit() else -1 for a in asn_numbers], dtype=np.int64
+            )[addrs.codes]
+            if side == "src":
+                out["src_asn_org"] = self._labels(self.asn, asn_hits, 1)[addrs.codes]
+        return out
+
+
+def _signature(paths: Iterable[str]) -> Tuple:
+    files = _list_files(paths)
+    return tuple((f, os.path.getmtime(f)) for f in files)
+
+
+_matcher: Optional[IPMatcher] = None
+_matcher_signature: Optional[Tuple] = None
+_checked_at = 0.0
+
+
+def get_ip_matcher() -> IPMatcher:
+    """Process-wide matcher, rebuilt when any list file is added, removed or modified."""
+    global _matcher, _matcher_signature, _checked_at
+    now = time.monotonic()
+    if _matcher is not None and now - _checked_at < IPLIST_RELOAD_INTERVAL:
+        return _matcher
+    _checked_at = now
+
+    paths = IPLIST_DENY_PATHS + IPLIST_ALLOW_PATHS + [p for p in (GEOIP_CSV_PATH, ASN_CSV_PATH) if p]
+    try:
+        signature = _signature(paths)
+    except OSError:
+        signature = None
+    if _matcher is None or signature != _matcher_signature:
+        try:
+            _matcher = IPMatcher.load()
+            _matcher_signature = signature
+        except Exception:
+            logger.exception("Failed to load IP lists, keeping previous lists")
+            if _matcher is None:
+                _matcher = IPMatcher(*(PrefixTable().compile() for _ in range(4)))
+    return _matcher
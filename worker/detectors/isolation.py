@@ -0,0 +1,148 @@
+"""
+IsolationForest over the numeric features carried by ParsedEvent.
+
+Models are cached per log source on disk and reused by later uploads from
+the same source until they age out. Without a usable cached model, an
+upload's micro-batches feed a uniform reservoir sample of at most
+ISOLATION_MAX_FIT_SAMPLES rows: a provisional model is fitted once the
+sample holds ISOLATION_MIN_FIT_EVENTS rows and refitted each time the
+number of rows seen doubles, so early batches are scored by a model of
+the upload so far and later ones by one of the whole upload. finish()
+fits the final model on the complete sample and caches it. Scoring is done
+in chunks spread over ISOLATION_N_JOBS threads.
+"""
+import os
+import re
+import time
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional
+from filelock import FileLock
+
+import joblib
+from joblib import Parallel, delayed
+from sklearn.ensemble import IsolationForest
+
+from worker.reservoir import Reservoir
+from worker.config import (
+    MODEL_BASE_DIR,
+    ISOLATION_N_ESTIMATORS,
+    ISOLATION_N_JOBS,
+    ISOLATION_MAX_FIT_SAMPLES,
+    ISOLATION_MIN_FIT_EVENTS,
+    ISOLATION_MODEL_MAX_AGE_HOURS,
+    ISOLATION_SCORE_OFFSET,
+    ISOLATION_SCORE_RANGE,
+)
+
+logger = logging.getLogger("worker.isolation")
+
+FEATURES = ("entropy", "url_length", "ua_length", "hour", "bytes", "requests_per_ip")
+# Heavy-tailed counts are compared on a log scale
+LOG_FEATURES = {"bytes", "requests_per_ip"}
+
+
+def source_key(file_path: str) -> str:
+    """
+    Derive a log source name from an uploaded file path.
+
+    Uploads are stored as "<upload_id>_<filename>"; digits and separators are
+    dropped so e.g. "access-2025-01-14.log" and "access-2025-01-15.log" share a model.
+    """
+    name = os.path.basename(file_path)
+    name = re.sub(r"^[0-9a-f\-]{36}_", "", name)
+    stem = name.split(".")[0].lower()
+    return re.sub(r"[^a-z]+", "-", stem).strip("-") or "default"
+
+
+def feature_matrix(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Stack numeric features into an (n, len(FEATURES)) float32 matrix, NaN -> 0."""
+    matrix = np.column_stack([
+        np.log1p(np.maximum(columns[f], 0).astype(np.float64)) if f in LOG_FEATURES
+        else columns[f].astype(np.float64)
+        for f in FEATURES
+    ])
+    return np.nan_to_num(matrix, nan=0.0).astype(np.float32)
+
+
+class IsolationForestDetector:
+    """Fits or reuses a per-source IsolationForest and scores batches in bulk."""
+
+    def __init__(self, source: str = "default", model_dir: Optional[str] = None,
+                 max_fit_samples: int = ISOLATION_MAX_FIT_SAMPLES):
+        self.source = source
+        self.model_path = os.path.join(model_dir or os.path.join(MODEL_BASE_DIR, "isolation"), f"{source}.joblib")
+        self.model: Optional[IsolationForest] = None
+        self.provisional = False  # model fitted on this upload's sample so far, not cached yet
+        self.sample = Reservoir(max_fit_samples)
+        self.fitted_seen = 0  # rows seen when the current model was fitted
+
+    def _load_cached(self) -> Optional[IsolationForest]:
+        if not os.path.exists(self.model_path):
+            return None
+        age_hours = (time.time() - os.path.getmtime(self.model_path)) / 3600
+        if age_hours > ISOLATION_MODEL_MAX_AGE_HOURS:
+            logger.info("Cached IsolationForest for %s is %.1fh old, refitting", self.source, age_hours)
+            return None
+        try:
+            with FileLock(f"{self.model_path}.lock", timeout=10):
+                return joblib.load(self.model_path)
+        except Exception:
+            logger.exception("Failed to load cached IsolationForest %s", self.model_path)
+            return None
+
+    def _fit(self) -> None:
+        """Fit a provisional model on the current sample."""
+        self.model = IsolationForest(
+            n_estimators=ISOLATION_N_ESTIMATORS,
+            n_jobs=ISOLATION_N_JOBS,
+            random_state=0,
+        ).fit(self.sample.rows)
+        self.provisional = True
+        self.fitted_seen = self.sample.seen
+        logger.info(
+            "Fitted IsolationForest for source %s on a sample of %d of %d events",
+            self.source, len(self.sample), self.sample.seen
+        )
+
+    def finish(self) -> None:
+        """Fit the final model on the upload's whole sample and cache it for later uploads."""
+        if not self.provisional:
+            return
+        if self.sample.seen > self.fitted_seen:
+            self._fit()
+        Path(self.model_path).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with FileLock(f"{self.model_path}.lock", timeout=10):
+                joblib.dump(self.model, self.model_path)
+        except Exception:
+            logger.exception("Failed to cache IsolationForest %s", self.model_path)
+        self.provisional = False
+
+    def score(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Anomaly scores in [0, 1] for a batch.
+
+        Raw IsolationForest scores (-score_samples, ~0.5 for inliers) are
+        mapped linearly from ISOLATION_SCORE_OFFSET to 1.0 over ISOLATION_SCORE_RANGE.
+        """
+        X = feature_matrix(columns)
+        if self.model is None and not self.sample.seen:
+            self.model = self._load_cached()
+        if self.model is None or self.provisional:
+            self.sample.add(X)
+            if len(self.sample) >= ISOLATION_MIN_FIT_EVENTS and (
+                self.model is None or self.sample.seen >= 2 * self.fitted_seen
+            ):
+                self._fit()
+        if self.model is None:
+            logger.info("Too few events (%d) to fit IsolationForest for %s", self.sample.seen, self.source)
+            return np.zeros(len(X), dtype=np.float32)
+
+        chunks = np.array_split(X, max(1, min(ISOLATION_N_JOBS, len(X) // 10000 + 1)))
+        raw = Parallel(n_jobs=ISOLATION_N_JOBS, prefer="threads")(
+            delayed(self.model.score_samples)(chunk) for chunk in chunks
+        )
+        anomaly = -np.concatenate(raw)
+        return np.clip((anomaly - ISOLATION_SCORE_OFFSET) / ISOLATION_SCORE_RANGE, 0, 1).astype(np.float32)
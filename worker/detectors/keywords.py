@@ -0,0 +1,89 @@
+"""
+Aho-Corasick keyword automaton for matching many keywords in one pass.
+
+Uses pyahocorasick when it is installed and falls back to a pure-Python
+automaton with the same interface otherwise.
+"""
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger("worker.keywords")
+
+
+class KeywordAutomaton:
+    """Case-insensitive multi-keyword matcher returning the ids of matched keywords."""
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: List[str] = []
+        index: Dict[str, int] = {}
+        for keyword in keywords:
+            keyword = keyword.lower()
+            if keyword and keyword not in index:
+                index[keyword] = len(self.keywords)
+                self.keywords.append(keyword)
+        self.index = index
+
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword, kid in index.items():
+                self._automaton.add_word(keyword, kid)
+            if self.keywords:
+                self._automaton.make_automaton()
+        else:
+            self._automaton = None
+            self._build()
+
+    def _build(self) -> None:
+        """Build goto/fail/output tables for the pure-Python fallback."""
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[int]] = [set()]
+
+        for keyword, kid in self.index.items():
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                state = nxt
+            self._out[state].add(kid)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> Set[int]:
+        """Return the ids of all keywords occurring in text."""
+        if not text or not self.keywords:
+            return set()
+        text = text.lower()
+
+        if self._automaton is not None:
+            return {kid for _, kid in self._automaton.iter(text)}
+
+        found: Set[int] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            if self._out[state]:
+                found |= self._out[state]
+        return found
@@ -0,0 +1,110 @@
+"""
+Sliding-window per-IP request counts.
+
+Events are sorted by (ip, time) and each event's window is resolved with a
+single vectorized searchsorted over a composite (ip code, time rank) key,
+so counting is O(n log n) regardless of how many IPs or windows there are.
+A tail of recent events is carried between calls so windows stay correct
+when an upload is processed in consecutive, time-ordered batches. Events
+can carry a weight (the occurrence count of a collapsed duplicate), and
+windows then sum weights instead of counting events.
+"""
+import logging
+import numpy as np
+from typing import Dict, Iterable
+
+from worker.config import RATE_WINDOWS
+from worker.features import factorize
+
+logger = logging.getLogger("worker.rate")
+
+
+class SlidingWindowRate:
+    """Counts requests per source IP over one or more trailing time windows."""
+
+    def __init__(self, windows: Iterable[int] = None):
+        self.windows = sorted(windows or RATE_WINDOWS.keys())
+        self._tail_ips = np.empty(0, dtype=object)
+        self._tail_ts = np.empty(0, dtype=np.int64)
+        self._tail_weights = np.empty(0, dtype=np.int64)
+
+    def update(self, src_ips: np.ndarray, timestamps: np.ndarray, weights: np.ndarray = None) -> Dict[int, np.ndarray]:
+        """
+        Count, for every event, the requests from the same IP in [t - window, t].
+
+        Args:
+            src_ips: Object array of source IPs ("" when missing)
+            timestamps: float64 epoch seconds, NaN when missing
+            weights: int64 requests per event (default 1)
+
+        Returns:
+            {window_seconds: int64 array of counts aligned with the input}.
+            Events without a timestamp get the count of untimestamped events
+            from the same IP in this batch for every window.
+        """
+        n = len(src_ips)
+        counts = {w: np.zeros(n, dtype=np.int64) for w in self.windows}
+        if n == 0:
+            return counts
+
+        weights = np.ones(n, dtype=np.int64) if weights is None else weights.astype(np.int64)
+        has_ts = ~np.isnan(timestamps)
+        n_tail = len(self._tail_ips)
+
+        ips = np.concatenate([self._tail_ips, src_ips[has_ts]])
+        ts_ms = np.concatenate([self._tail_ts, (timestamps[has_ts] * 1000).astype(np.int64)])
+        ws = np.concatenate([self._tail_weights, weights[has_ts]])
+
+        if len(ips):
+            _, codes = factorize(ips)
+            # Timestamps are replaced by their rank among the distinct ones, so
+            # the composite (ip code, time rank) key stays below n^2 however far
+            # apart the timestamps are; window bounds are ranked the same way
+            times = np.unique(ts_ms)
+            stride = np.int64(len(times) + 1)
+            codes = codes.astype(np.int64)
+            keys = codes * stride + np.searchsorted(times, ts_ms)
+            # Each IP's events end up contiguous and in time order
+            order = np.lexsort((ts_ms, codes))
+            sorted_keys = keys[order]
+            # Weight of the sorted events before each position
+            cum_weights = np.concatenate([[0], np.cumsum(ws[order])])
+
+            new_keys = keys[n_tail:]
+            new_codes, new_ts = codes[n_tail:], ts_ms[n_tail:]
+            hi = np.searchsorted(sorted_keys, new_keys, side="right")
+            for w in self.windows:
+                lo_keys = new_codes * stride + np.searchsorted(times, new_ts - w * 1000, side="left")
+                lo = np.searchsorted(sorted_keys, lo_keys, side="left")
+                counts[w][has_ts] = cum_weights[hi] - cum_weights[lo]
+
+            # Keep only what the widest window can still reach
+            keep = ts_ms >= ts_ms.max() - max(self.windows) * 1000
+            self._tail_ips = ips[keep]
+            self._tail_ts = ts_ms[keep]
+            self._tail_weights = ws[keep]
+
+        if (~has_ts).any():
+            _, codes = factorize(src_ips[~has_ts])
+            fallback = np.bincount(codes, weights=weights[~has_ts]).astype(np.int64)[codes]
+            for w in self.windows:
+                counts[w][~has_ts] = fallback
+
+        return counts
+
+
+def rate_ratios(counts: Dict[int, np.ndarray], thresholds: Dict[int, int] = None):
+    """
+    Pick, per event, the window whose count is furthest above its threshold.
+
+    Returns:
+        (ratio, window, count) arrays: count / threshold for the worst window,
+        that window's size and its count
+    """
+    thresholds = thresholds or RATE_WINDOWS
+    windows = sorted(counts)
+    stacked = np.stack([counts[w] for w in windows])
+    ratios = stacked / np.array([thresholds[w] for w in windows])[:, None]
+    worst = ratios.argmax(axis=0)
+    cols = np.arange(ratios.shape[1])
+    return ratios[worst, cols], np.asarray(windows)[worst], stacked[worst, cols]
@@ -1,29 +1,322 @@
-# Simple rule-based detectors. Add as many as needed.
-def rule_high_request_rate(sliding_count: int, threshold: int = 200):
-    if sliding_count > threshold:
-        score = min(1.0, sliding_count / threshold)
-        return True, score, "High request rate from same IP"
-    return False, 0.0, None
-
-# Unusual HTTP Method
-def rule_unusual_method(method: str):
-    common = {"GET", "POST", "PUT", "DELETE", "HEAD"}
-    if method not in common:
-        return True, 0.9, f"Unusual HTTP method detected: {method}"
-    return False, 0.0, None
-
-# Suspicious User-Agent
-def rule_suspicious_user_agent(ua: str):
-    if ua is None:
-        return False, 0, None
-
-    bad_keywords = ["bot", "curl", "python", "nmap", "scanner"]
-    if any(k.lower() in ua.lower() for k in bad_keywords):
-        return True, 0.9, f"Suspicious user agent: {ua}"
-    return False, 0, None
-
-# High Byte Count
-def rule_large_transfer(bytes_sent: int):
-    if bytes_sent and bytes_sent > 5_000_000:  # > 5MB
-        return True, 0.8, f"Large data transfer detected: {bytes_sent} bytes"
-    return False, 0, None
+"""
+Declarative rule engine.
+
+Rules live in a JSON (or YAML, when PyYAML is installed) file and are compiled
+into vectorized predicates over a whole batch of event columns
+(see worker.features.event_columns). Each rule is a list of conditions that
+must all hold, a score and a reason template:
+
+    {
+        "name": "large_transfer",
+        "when": [{"field": "bytes", "op": ">", "value": 5000000}],
+        "score": 0.8,
+        "reason": "Large data transfer detected: {bytes} bytes"
+    }
+
+Supported ops: >, >=, <, <=, ==, !=, in, not_in, regex, contains_any.
+All contains_any keywords for a field share a single Aho-Corasick automaton.
+"score" is either a constant or {"field": ..., "scale": ..., "max": ...}
+for scores proportional to a numeric column.
+
+Fields must be one of RULE_COLUMNS, and ops and values must suit the
+field's kind; a file with any invalid rule is rejected as a whole.
+
+The rule file is re-read when its mtime changes, so workers pick up edits
+without a restart; a rejected file leaves the previous rules in place.
+"""
+import os
+import re
+import json
+import time
+import string
+import logging
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from worker.config import RULES_PATH, RULES_RELOAD_INTERVAL
+from worker.features import TEXT_FIELDS, factorize
+from worker.detectors.keywords import KeywordAutomaton
+
+logger = logging.getLogger("worker.rules")
+
+NUMERIC_OPS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+TEXT_OPS = {"in", "not_in", "regex", "contains_any"}
+ORDER_OPS = {">", ">=", "<", "<="}
+
+# Columns the worker builds before evaluating rules (see score_batch in
+# worker.tasks) and their kind: "text" (object, "" when missing), "number"
+# or "flag" (bool)
+RULE_COLUMNS = {
+    **{field: "text" for field in TEXT_FIELDS},
+    **{field: "text" for field in (
+        "src_deny_list", "dest_deny_list", "src_country", "dest_country", "src_asn_org",
+    )},
+    **{field: "number" for field in (
+        "timestamp", "status", "bytes", "entropy", "url_length", "ua_length", "hour", "count",
+        "requests_per_ip", "rate_ratio", "rate_window", "rate_count",
+        "distinct_urls", "distinct_dests", "ip_requests", "ip_share", "domain_share",
+        "src_asn", "dest_asn",
+    )},
+    **{field: "flag" for field in ("src_ip_valid", "dest_ip_valid", "src_deny", "dest_deny", "src_allow")},
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_value(name: str, field: str, op: str, value) -> None:
+    """Raise ValueError when value does not suit op on a column of field's kind."""
+    kind = RULE_COLUMNS[field]
+    if op in ORDER_OPS:
+        if kind != "number" or not _is_number(value):
+            raise ValueError(f"Rule {name!r}: {op} needs a numeric field and value, got {field} ({kind}) {value!r}")
+    elif op in ("==", "!="):
+        ok = {"text": isinstance(value, str), "number": _is_number(value), "flag": isinstance(value, bool)}[kind]
+        if not ok:
+            raise ValueError(f"Rule {name!r}: {op} on {field} ({kind}) cannot compare with {value!r}")
+    elif op in ("in", "not_in"):
+        if not isinstance(value, list) or not value:
+            raise ValueError(f"Rule {name!r}: {op} needs a non-empty list")
+        if kind == "text":
+            ok = all(isinstance(v, str) for v in value)
+        else:
+            ok = all(_is_number(v) or isinstance(v, bool) for v in value)
+        if not ok:
+            raise ValueError(f"Rule {name!r}: {op} values do not match {field} ({kind})")
+    else:  # regex, contains_any
+        if kind != "text":
+            raise ValueError(f"Rule {name!r}: {op} needs a text field, got {field} ({kind})")
+        if op == "regex" and not isinstance(value, str):
+            raise ValueError(f"Rule {name!r}: regex needs a string pattern")
+        if op == "contains_any" and (
+            not isinstance(value, list) or not value or not all(isinstance(v, str) and v for v in value)
+        ):
+            raise ValueError(f"Rule {name!r}: contains_any needs a non-empty list of non-empty strings")
+
+
+class RuleMatches(NamedTuple):
+    """Best rule hit per event."""
+    scores: np.ndarray  # float32, 0.0 where no rule fired
+    reasons: List[Optional[str]]  # formatted reason of the best rule, None where no rule fired
+    rules: List[Optional[str]]  # name of the best rule, None where no rule fired
+
+
+class CompiledRule:
+    """A single rule with validated conditions and a parsed reason template.
+    Raises ValueError for anything evaluate() could not run."""
+
+    def __init__(self, spec: Dict):
+        if not isinstance(spec, dict) or not isinstance(spec.get("name"), str) or not spec["name"]:
+            raise ValueError(f"Rule without a name: {spec!r}")
+        self.name = spec["name"]
+        self.conditions = spec.get("when") or []
+        if not isinstance(self.conditions, list) or not self.conditions:
+            raise ValueError(f"Rule {self.name!r} has no conditions")
+        for cond in self.conditions:
+            if not isinstance(cond, dict):
+                raise ValueError(f"Rule {self.name!r}: condition {cond!r} is not an object")
+            op, field = cond.get("op"), cond.get("field")
+            if op not in NUMERIC_OPS and op not in TEXT_OPS:
+                raise ValueError(f"Rule {self.name!r}: unsupported op {op!r}")
+            if field not in RULE_COLUMNS:
+                raise ValueError(f"Rule {self.name!r}: unknown field {field!r}")
+            _check_value(self.name, field, op, cond.get("value"))
+            if op == "regex":
+                try:
+                    cond["_pattern"] = re.compile(cond["value"], re.IGNORECASE)
+                except re.error as e:
+                    raise ValueError(f"Rule {self.name!r}: invalid regex {cond['value']!r}: {e}")
+
+        self.score = spec.get("score", 1.0)
+        if isinstance(self.score, dict):
+            if RULE_COLUMNS.get(self.score.get("field")) != "number":
+                raise ValueError(f"Rule {self.name!r}: score field must be numeric, got {self.score.get('field')!r}")
+            if not all(_is_number(self.score.get(k, 1.0)) for k in ("scale", "max")):
+                raise ValueError(f"Rule {self.name!r}: score scale and max must be numbers")
+        elif not _is_number(self.score):
+            raise ValueError(f"Rule {self.name!r}: score must be a number or a field scaling")
+
+        self.reason = spec.get("reason") or self.name
+        try:
+            self.reason_fields = [
+                field for _, field, _, _ in string.Formatter().parse(self.reason) if field
+            ]
+        except ValueError as e:
+            raise ValueError(f"Rule {self.name!r}: invalid reason template: {e}")
+        unknown = [field for field in self.reason_fields if field not in RULE_COLUMNS]
+        if unknown:
+            raise ValueError(f"Rule {self.name!r}: reason uses unknown fields {', '.join(unknown)}")
+
+
+class RuleSet:
+    """Rules compiled against one shared keyword automaton per text field."""
+
+    def __init__(self, specs: List[Dict]):
+        """Compile every spec; raises ValueError listing all invalid rules if there are any."""
+        self.rules, errors = [], []
+        for spec in specs:
+            try:
+                self.rules.append(CompiledRule(spec))
+            except (ValueError, TypeError) as e:
+                errors.append(str(e))
+        if errors:
+            raise ValueError(f"{len(errors)} invalid rule(s): " + "; ".join(errors))
+
+        keywords: Dict[str, List[str]] = {}
+        for rule in self.rules:
+            for cond in rule.conditions:
+                if cond["op"] == "contains_any":
+                    keywords.setdefault(cond["field"], []).extend(cond["value"])
+        self.automata = {field: KeywordAutomaton(words) for field, words in keywords.items()}
+        for rule in self.rules:
+            for cond in rule.conditions:
+                if cond["op"] == "contains_any":
+                    automaton = self.automata[cond["field"]]
+                    cond["_ids"] = {automaton.index[w.lower()] for w in cond["value"] if w}
+
+    def _keyword_hits(self, columns: Dict[str, np.ndarray]) -> Dict[str, Tuple[List[set], np.ndarray]]:
+        """Run each field's automaton once per distinct value; return (ids per value, value codes)."""
+        hits = {}
+        for field, automaton in self.automata.items():
+            if field not in columns:
+                continue
+            uniques, codes = factorize(columns[field])
+            found = [automaton.find(value) for value in uniques]
+            hits[field] = (found, codes)
+        return hits
+
+    def _mask(self, cond: Dict, columns: Dict[str, np.ndarray], keyword_hits) -> np.ndarray:
+        op = cond["op"]
+        values = columns[cond["field"]]
+
+        if op in NUMERIC_OPS:
+            with np.errstate(invalid="ignore"):
+                return NUMERIC_OPS[op](values, cond["value"])
+        if op == "in":
+            return np.isin(values, cond["value"])
+        if op == "not_in":
+            return ~np.isin(values, cond["value"])
+        if op == "regex":
+            uniques, codes = factorize(values)
+            matched = np.array([bool(cond["_pattern"].search(v)) for v in uniques], dtype=bool)
+            return matched[codes]
+        # contains_any
+        found, codes = keyword_hits[cond["field"]]
+        matched = np.array([bool(ids & cond["_ids"]) for ids in found], dtype=bool)
+        return matched[codes]
+
+    def evaluate(self, columns: Dict[str, np.ndarray]) -> RuleMatches:
+        """Evaluate all rules over a batch and keep the highest-scoring hit per event."""
+        n = len(next(iter(columns.values()))) if columns else 0
+        best_scores = np.zeros(n, dtype=np.float32)
+        best_rule = np.full(n, -1, dtype=np.int32)
+        keyword_hits = self._keyword_hits(columns)
+
+        for rule_idx, rule in enumerate(self.rules):
+            # A rule that fails on a batch is skipped; the other rules still apply
+            try:
+                mask = np.ones(n, dtype=bool)
+                for cond in rule.conditions:
+                    mask &= self._mask(cond, columns, keyword_hits)
+                if not mask.any():
+                    continue
+
+                if isinstance(rule.score, dict):
+                    scores = columns[rule.score["field"]] * rule.score.get("scale", 1.0)
+                    scores = np.minimum(scores, rule.score.get("max", 1.0)).astype(np.float32)
+                else:
+                    scores = np.full(n, rule.score, dtype=np.float32)
+            except Exception:
+                logger.exception("Rule %r failed on this batch, skipping it", rule.name)
+                continue
+
+            better = mask & (scores > best_scores)
+            best_scores[better] = scores[better]
+            best_rule[better] = rule_idx
+
+        reasons: List[Optional[str]] = [None] * n
+        names: List[Optional[str]] = [None] * n
+        for idx in np.flatnonzero(best_rule >= 0):
+            rule = self.rules[best_rule[idx]]
+            try:
+                row = {field: columns[field][idx] for field in rule.reason_fields}
+                reasons[idx] = rule.reason.format_map(row)
+            except Exception:
+                logger.exception("Rule %r reason could not be formatted", rule.name)
+                reasons[idx] = rule.name
+            names[idx] = rule.name
+        return RuleMatches(best_scores, reasons, names)
+
+
+def load_rule_specs(path: str) -> List[Dict]:
+    """Read rule specs from a JSON or YAML file."""
+    with open(path, "r", encoding="utf-8") as fh:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ImportError("PyYAML is required for YAML rule files")
+            data = yaml.safe_load(fh)
+        else:
+            data = json.load(fh)
+    return data["rules"] if isinstance(data, dict) else data
+
+
+class RuleEngine:
+    """Holds the compiled rule set and recompiles it when the rule file changes."""
+
+    def __init__(self, path: str = RULES_PATH, reload_interval: float = RULES_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.ruleset = RuleSet([])
+        self.maybe_reload(force=True)
+
+    def maybe_reload(self, force: bool = False) -> None:
+        """Recompile rules if the file changed; keep the previous set on errors."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            logger.warning("Rule file not found: %s", self.path)
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            self.ruleset = RuleSet(load_rule_specs(self.path))
+            self._mtime = mtime
+            logger.info("Loaded %d rules from %s", len(self.ruleset.rules), self.path)
+        except Exception:
+            logger.exception("Failed to load rules from %s, keeping previous rules", self.path)
+
+    def evaluate(self, columns: Dict[str, np.ndarray]) -> RuleMatches:
+        self.maybe_reload()
+        return self.ruleset.evaluate(columns)
+
+
+_engine: Optional[RuleEngine] = None
+
+
+def get_rule_engine() -> RuleEngine:
+    """Process-wide rule engine so hot reloads carry across tasks."""
+    global _engine
+    if _engine is None:
+        _engine = RuleEngine()
+    return _engine
@@ -0,0 +1,239 @@
+"""
+Session reconstruction and session-level scoring.
+
+Events are grouped into sessions by (src_ip, username, user_agent); a gap
+of more than SESSION_GAP_SECONDS between consecutive events of the same key
+starts a new session. Batches are expected in time order (as a streaming
+ingest delivers them): each batch is sorted by (key, time) and split into
+sessions with vectorized gap checks, and the last session of every key
+stays open so the next batch can continue it. Open state is bounded by
+SESSION_MAX_OPEN and by SESSION_MAX_TRACKED_PATHS URL hashes per session.
+
+Each session gets duration, request rate, distinct paths, error ratio and
+bytes. Sessions are scored by robust z-scores (median / MAD) of these
+features against the other sessions of the batch, and every event carries
+the score of its session as of the end of the batch.
+"""
+import logging
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional
+
+from worker.features import factorize, stable_hash64
+from worker.config import (
+    SESSION_GAP_SECONDS,
+    SESSION_MAX_OPEN,
+    SESSION_MAX_TRACKED_PATHS,
+    SESSION_MIN_EVENTS,
+    SESSION_MIN_SESSIONS,
+    SESSION_Z_THRESHOLD,
+)
+
+logger = logging.getLogger("worker.sessions")
+
+KEY_FIELDS = ("src_ip", "username", "user_agent")
+# Scored features, with the smallest spread used for their robust z-scores
+SCORED_FEATURES = (
+    ("rate", 0.5),  # log1p(requests per minute)
+    ("distinct_paths", 0.5),  # log1p
+    ("error_ratio", 0.1),  # shrunk for short sessions
+    ("bytes", 0.5),  # log1p
+)
+LOG_SCORED = {"rate", "distinct_paths", "bytes"}
+
+
+class _OpenSession:
+    __slots__ = ("session_id", "start", "last", "count", "bytes", "errors", "distinct", "paths")
+
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        self.start = 0.0
+        self.last = 0.0
+        self.count = 0
+        self.bytes = 0
+        self.errors = 0
+        self.distinct = 0
+        self.paths: Optional[set] = set()  # None once more than SESSION_MAX_TRACKED_PATHS were seen
+
+
+class SessionResult(NamedTuple):
+    scores: np.ndarray  # float32 in [0, 1], 0 for events without a timestamp
+    reasons: List[Optional[str]]
+    features: Dict[str, np.ndarray]  # per-event session features (NaN without a timestamp)
+
+
+class Sessionizer:
+    """Streaming sessionizer over time-ordered batches of event columns."""
+
+    def __init__(self, gap: float = SESSION_GAP_SECONDS, max_open: int = SESSION_MAX_OPEN):
+        self.gap = gap
+        self.max_open = max_open
+        self._open: Dict[tuple, _OpenSession] = {}
+        self._next_id = 0
+        self.closed = 0
+
+    def update(self, columns: Dict[str, np.ndarray]) -> SessionResult:
+        """Assign a batch to sessions and score them."""
+        n = len(columns["timestamp"])
+        features = {
+            name: np.full(n, np.nan, dtype=np.float64)
+            for name in ("session_id", "duration", "rate", "distinct_paths", "error_ratio", "bytes", "events")
+        }
+        timestamps = columns["timestamp"]
+        timed = np.flatnonzero(~np.isnan(timestamps))
+        if timed.size == 0:
+            return SessionResult(np.zeros(n, dtype=np.float32), [None] * n, features)
+
+        # Dense key codes over (src_ip, username, user_agent)
+        field_codes = []
+        field_uniques = []
+        for field in KEY_FIELDS:
+            uniques, codes = factorize(columns[field][timed])
+            field_uniques.append(uniques)
+            field_codes.append(codes)
+        key_rows, key_codes = np.unique(np.column_stack(field_codes), axis=0, return_inverse=True)
+        key_codes = key_codes.reshape(-1)
+
+        # Sort by (key, time) and split where the key changes or the gap is exceeded
+        order = np.lexsort((timestamps[timed], key_codes))
+        events = timed[order]
+        k = key_codes[order]
+        t = timestamps[events]
+        m = len(events)
+        key_change = np.ones(m, dtype=bool)
+        key_change[1:] = k[1:] != k[:-1]
+        new_segment = key_change.copy()
+        new_segment[1:] |= (t[1:] - t[:-1]) > self.gap
+        starts = np.flatnonzero(new_segment)
+        ends = np.append(starts[1:], m)
+        segment = np.cumsum(new_segment) - 1
+
+        count = np.diff(np.append(starts, m))
+        total_bytes = np.add.reduceat(columns["bytes"][events], starts)
+        errors = np.add.reduceat((columns["status"][events] >= 400).astype(np.int64), starts)
+        first_ts = t[starts]
+        last_ts = np.maximum.reduceat(t, starts)
+        url_hashes = stable_hash64(columns["url"][events])
+        _, url_codes = factorize(url_hashes)
+        pair = np.unique(segment.astype(np.int64) * (int(url_codes.max()) + 1) + url_codes)
+        distinct = np.bincount(pair // (int(url_codes.max()) + 1), minlength=len(starts))
+
+        # Segments closed inside the batch need no per-key state; only the first
+        # segment of a key (which may continue an open session) and the last one
+        # (which stays open) go through the loop below
+        session_ids = self._next_id + np.arange(len(starts), dtype=np.int64)
+        self._next_id += len(starts)
+        first_of_key = key_change[starts]
+        last_of_key = np.append(first_of_key[1:], True)
+        self.closed += int((~last_of_key).sum())
+
+        for s in np.flatnonzero(first_of_key | last_of_key):
+            start = starts[s]
+            row = key_rows[k[start]]
+            key = tuple(field_uniques[f][row[f]] for f in range(len(KEY_FIELDS)))
+            segment_hashes = url_hashes[start:ends[s]]
+
+            session = self._open.pop(key, None) if first_of_key[s] else None
+            if session is not None and first_ts[s] - session.last > self.gap:
+                self.closed += 1
+                session = None
+            if session is not None:
+                # Continue the carried session: merge its state into this segment
+                session_ids[s] = session.session_id
+                count[s] += session.count
+                total_bytes[s] += session.bytes
+                errors[s] += session.errors
+                first_ts[s] = session.start
+                if session.paths is not None:
+                    before = len(session.paths)
+                    session.paths.update(segment_hashes.tolist())
+                    session.distinct += len(session.paths) - before
+                else:
+                    # Saturated: count the segment's distinct paths as new (upper bound)
+                    session.distinct += int(distinct[s])
+                distinct[s] = session.distinct
+            elif last_of_key[s]:
+                session = _OpenSession(int(session_ids[s]))
+                session.start = first_ts[s]
+                session.distinct = int(distinct[s])
+                session.paths = set(segment_hashes.tolist())
+
+            if last_of_key[s]:
+                if session.paths is not None and len(session.paths) > SESSION_MAX_TRACKED_PATHS:
+                    session.paths = None
+                session.last = last_ts[s]
+                session.count = int(count[s])
+                session.bytes = int(total_bytes[s])
+                session.errors = int(errors[s])
+                self._open[key] = session
+
+        self._evict(float(t.max()))
+
+        duration = last_ts - first_ts
+        rate = count / np.maximum(duration / 60.0, 1.0)  # per minute, at least one minute
+        session_features = {
+            "session_id": session_ids.astype(np.float64),
+            "duration": duration,
+            "rate": rate,
+            "distinct_paths": distinct.astype(np.float64),
+            "error_ratio": errors / count,
+            "bytes": total_bytes.astype(np.float64),
+            "events": count.astype(np.float64),
+        }
+        for name, values in session_features.items():
+            features[name][events] = values[segment]
+
+        session_scores, top_feature = self._score(session_features)
+        scores = np.zeros(n, dtype=np.float32)
+        scores[events] = session_scores[segment]
+
+        reasons: List[Optional[str]] = [None] * n
+        event_segment = np.full(n, -1, dtype=np.int64)
+        event_segment[events] = segment
+        for idx in np.flatnonzero(scores > 0):
+            name = SCORED_FEATURES[top_feature[event_segment[idx]]][0]
+            reasons[idx] = (
+                f"Session with unusual {name.replace('_', ' ')} ({features[name][idx]:.3g}): "
+                f"{int(features['events'][idx])} requests over {features['duration'][idx]:.0f}s, "
+                f"{int(features['distinct_paths'][idx])} distinct paths, "
+                f"{features['error_ratio'][idx]:.0%} errors"
+            )
+        return SessionResult(scores, reasons, features)
+
+    def _score(self, f: Dict[str, np.ndarray]):
+        """Robust z-score per session; returns (scores, index of the most deviating feature)."""
+        n = len(f["events"])
+        scores = np.zeros(n, dtype=np.float32)
+        top = np.zeros(n, dtype=np.int64)
+        eligible = f["events"] >= SESSION_MIN_EVENTS
+        if eligible.sum() < SESSION_MIN_SESSIONS:
+            return scores, top
+
+        z = np.zeros((len(SCORED_FEATURES), n), dtype=np.float64)
+        for i, (name, min_spread) in enumerate(SCORED_FEATURES):
+            if name == "error_ratio":
+                # Shrink towards zero so a couple of errors in a short session do not stand out
+                values = f[name] * f["events"] / (f["events"] + SESSION_MIN_EVENTS)
+            else:
+                values = np.log1p(f[name]) if name in LOG_SCORED else f[name]
+            baseline = values[eligible]
+            median = np.median(baseline)
+            spread = max(1.4826 * np.median(np.abs(baseline - median)), min_spread)
+            z[i] = (values - median) / spread  # only unusually high values count
+        z_max = z.max(axis=0)
+        scores = np.where(
+            eligible, np.clip((z_max - SESSION_Z_THRESHOLD) / SESSION_Z_THRESHOLD, 0, 1), 0
+        ).astype(np.float32)
+        return scores, z.argmax(axis=0)
+
+    def _evict(self, now: float) -> None:
+        """Close sessions idle past the gap, then the least recently active beyond max_open."""
+        idle = [key for key, s in self._open.items() if now - s.last > self.gap]
+        for key in idle:
+            del self._open[key]
+        overflow = len(self._open) - self.max_open
+        if overflow > 0:
+            oldest = sorted(self._open, key=lambda key: self._open[key].last)[:overflow]
+            for key in oldest:
+                del self._open[key]
+            logger.info("Closed %d sessions early to stay within %d open sessions", overflow, self.max_open)
+        self.closed += len(idle) + max(overflow, 0)
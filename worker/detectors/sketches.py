@@ -0,0 +1,260 @@
+"""
+Sketch-based scan and heavy-hitter detection.
+
+Directory brute-forcing and horizontal scans show up as one source IP
+requesting many distinct URLs or destination IPs. Exact distinct sets per
+IP grow without bound on large files, so they are approximated with:
+
+- HyperLogLog: 2^SKETCH_HLL_PRECISION one-byte registers per IP for the
+  number of distinct URLs and destination IPs.
+- Count-Min: a fixed SKETCH_CMS_DEPTH x SKETCH_CMS_WIDTH table of request
+  counts per IP and per domain, for each event's share of traffic.
+- Space-Saving: the SKETCH_TOP_K heaviest IPs and domains, for reporting.
+
+All sketches are updated in bulk from a batch's columns and can be merged,
+so shards of one upload can be sketched separately and combined. The
+per-event columns they produce (distinct_urls, distinct_dests,
+ip_requests, ip_share, domain_share) are consumed by the declarative rules.
+"""
+import logging
+import numpy as np
+from typing import Dict, List, Tuple
+
+from worker.features import factorize, stable_hash64
+from worker.config import (
+    SKETCH_HLL_PRECISION,
+    SKETCH_CMS_WIDTH,
+    SKETCH_CMS_DEPTH,
+    SKETCH_TOP_K,
+)
+
+logger = logging.getLogger("worker.sketches")
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Bit length of uint64 values (0 for 0), exact via two 32-bit halves."""
+    hi = (values >> np.uint64(32)).astype(np.float64)
+    lo = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, 32 + np.frexp(hi)[1], np.frexp(lo)[1])
+
+
+class HyperLogLogSet:
+    """One HyperLogLog per key, stored as rows of a shared uint8 register matrix."""
+
+    def __init__(self, precision: int = SKETCH_HLL_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.rows: Dict[str, int] = {}
+        self.registers = np.zeros((0, self.m), dtype=np.uint8)
+
+    def _row_ids(self, keys: np.ndarray, create: bool) -> np.ndarray:
+        uniques, codes = factorize(keys)
+        ids = np.full(len(uniques), -1, dtype=np.int64)
+        for i, key in enumerate(uniques):
+            row = self.rows.get(key)
+            if row is None and create:
+                row = self.rows[key] = len(self.rows)
+            if row is not None:
+                ids[i] = row
+        if create and len(self.rows) > len(self.registers):
+            grown = np.zeros((max(len(self.rows), 2 * len(self.registers)), self.m), dtype=np.uint8)
+            grown[:len(self.registers)] = self.registers
+            self.registers = grown
+        return ids[codes]
+
+    def add(self, keys: np.ndarray, values: np.ndarray) -> None:
+        """Add values to the sketch of their key; empty keys and values are ignored."""
+        keep = (keys != "") & (values != "")
+        if not keep.any():
+            return
+        rows = self._row_ids(keys[keep], create=True)
+        hashed = stable_hash64(values[keep])
+        p = np.uint64(self.precision)
+        index = (hashed >> (np.uint64(64) - p)).astype(np.int64)
+        rest = hashed << p
+        # Position of the first set bit in the remaining 64 - p bits
+        rank = np.minimum(64 - _bit_length(rest) + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, (rows, index), rank)
+
+    def estimate(self, keys: np.ndarray) -> np.ndarray:
+        """Estimated distinct counts per key (0 for unseen keys)."""
+        rows = self._row_ids(keys, create=False)
+        out = np.zeros(len(keys), dtype=np.float64)
+        seen = rows >= 0
+        if not seen.any():
+            return out
+        unique_rows, inverse = np.unique(rows[seen], return_inverse=True)
+        regs = self.registers[unique_rows].astype(np.float64)
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / np.exp2(-regs).sum(axis=1)
+        zeros = (regs == 0).sum(axis=1)
+        # Linear counting for small cardinalities
+        small = (raw <= 2.5 * self.m) & (zeros > 0)
+        raw[small] = self.m * np.log(self.m / zeros[small])
+        out[seen] = raw[inverse]
+        return out
+
+    def merge(self, other: "HyperLogLogSet") -> None:
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        keys = np.array(list(other.rows), dtype=object)
+        if not len(keys):
+            return
+        rows = self._row_ids(keys, create=True)
+        other_rows = np.array([other.rows[k] for k in keys], dtype=np.int64)
+        self.registers[rows] = np.maximum(self.registers[rows], other.registers[other_rows])
+
+
+class CountMinSketch:
+    """Count-Min sketch with double hashing over stable 64-bit value hashes."""
+
+    def __init__(self, width: int = SKETCH_CMS_WIDTH, depth: int = SKETCH_CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _buckets(self, values: np.ndarray) -> np.ndarray:
+        hashed = stable_hash64(values)
+        h1 = hashed & np.uint64(0xFFFFFFFF)
+        h2 = (hashed >> np.uint64(32)) | np.uint64(1)
+        seeds = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((h1[None, :] + seeds * h2[None, :]) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, values: np.ndarray, weights: np.ndarray = None) -> None:
+        if not len(values):
+            return
+        weights = np.ones(len(values), dtype=np.int64) if weights is None else weights.astype(np.int64)
+        uniques, codes = factorize(values)
+        counts = np.bincount(codes, weights=weights, minlength=len(uniques)).astype(np.int64)
+        buckets = self._buckets(uniques)
+        for row in range(self.depth):
+            np.add.at(self.table[row], buckets[row], counts)
+        self.total += int(weights.sum())
+
+    def estimate(self, values: np.ndarray) -> np.ndarray:
+        """Upper-bound count estimates per value."""
+        if not len(values):
+            return np.zeros(0, dtype=np.int64)
+        uniques, codes = factorize(values)
+        buckets = self._buckets(uniques)
+        per_value = self.table[np.arange(self.depth)[:, None], buckets].min(axis=0)
+        return per_value[codes]
+
+    def merge(self, other: "CountMinSketch") -> None:
+        if other.table.shape != self.table.shape:
+            raise ValueError("Cannot merge Count-Min sketches with different dimensions")
+        self.table += other.table
+        self.total += other.total
+
+
+class SpaceSaving:
+    """
+    Mergeable Space-Saving summary of the k heaviest values.
+
+    Values not currently tracked have a count of at most `floor`; a value
+    that enters the summary starts from that floor, which is its error bound.
+    """
+
+    def __init__(self, k: int = SKETCH_TOP_K):
+        self.k = k
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.floor = 0
+
+    def _add_counts(self, items) -> None:
+        for value, count in items:
+            if value in self.counts:
+                self.counts[value] += count
+            else:
+                self.counts[value] = self.floor + count
+                self.errors[value] = self.floor
+        self._trim()
+
+    def _trim(self) -> None:
+        if len(self.counts) > self.k:
+            ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+            self.floor = max(self.floor, ranked[self.k][1])
+            for value, _ in ranked[self.k:]:
+                del self.counts[value]
+                del self.errors[value]
+
+    def update(self, values: np.ndarray, weights: np.ndarray = None) -> None:
+        present = values != ""
+        values = values[present]
+        if not len(values):
+            return
+        uniques, codes = factorize(values)
+        if weights is None:
+            counts = np.bincount(codes, minlength=len(uniques))
+        else:
+            counts = np.bincount(codes, weights=weights[present], minlength=len(uniques)).astype(np.int64)
+        self._add_counts(zip(uniques.tolist(), counts.tolist()))
+
+    def merge(self, other: "SpaceSaving") -> None:
+        # A value missing from one summary may have up to that summary's floor there
+        for value in set(self.counts) | set(other.counts):
+            mine = self.counts.get(value)
+            theirs = other.counts.get(value)
+            self.counts[value] = (self.floor if mine is None else mine) + (other.floor if theirs is None else theirs)
+            self.errors[value] = (
+                (self.floor if mine is None else self.errors[value])
+                + (other.floor if theirs is None else other.errors[value])
+            )
+        self.floor += other.floor
+        self._trim()
+
+    def top(self, n: int = 10) -> List[Tuple[str, int, int]]:
+        """(value, estimated count, max overestimate), heaviest first."""
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:n]
+        return [(value, count, self.errors[value]) for value, count in ranked]
+
+
+class ScanSketches:
+    """The sketches for one upload (or shard), updated batch by batch."""
+
+    def __init__(self):
+        self.distinct_urls = HyperLogLogSet()
+        self.distinct_dests = HyperLogLogSet()
+        self.ip_counts = CountMinSketch()
+        self.domain_counts = CountMinSketch()
+        self.top_ips = SpaceSaving()
+        self.top_domains = SpaceSaving()
+
+    def update(self, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Fold a batch into the sketches and return per-event columns.
+
+        Values reflect everything seen so far, including this whole batch.
+        Request counts are weighted by the optional "count" column
+        (occurrences of collapsed duplicates).
+        """
+        src_ips = columns["src_ip"]
+        domains = columns["domain"]
+        weights = columns.get("count")
+        has_ip = src_ips != ""
+        has_domain = domains != ""
+        self.distinct_urls.add(src_ips, columns["url"])
+        self.distinct_dests.add(src_ips, columns["dest_ip"])
+        self.ip_counts.add(src_ips[has_ip], None if weights is None else weights[has_ip])
+        self.domain_counts.add(domains[has_domain], None if weights is None else weights[has_domain])
+        self.top_ips.update(src_ips, weights)
+        self.top_domains.update(domains, weights)
+
+        ip_requests = np.where(src_ips != "", self.ip_counts.estimate(src_ips), 0)
+        domain_requests = np.where(domains != "", self.domain_counts.estimate(domains), 0)
+        return {
+            "distinct_urls": np.rint(self.distinct_urls.estimate(src_ips)).astype(np.int64),
+            "distinct_dests": np.rint(self.distinct_dests.estimate(src_ips)).astype(np.int64),
+            "ip_requests": ip_requests.astype(np.int64),
+            "ip_share": ip_requests / max(self.ip_counts.total, 1),
+            "domain_share": domain_requests / max(self.domain_counts.total, 1),
+        }
+
+    def merge(self, other: "ScanSketches") -> None:
+        self.distinct_urls.merge(other.distinct_urls)
+        self.distinct_dests.merge(other.distinct_dests)
+        self.ip_counts.merge(other.ip_counts)
+        self.domain_counts.merge(other.domain_counts)
+        self.top_ips.merge(other.top_ips)
+        self.top_domains.merge(other.top_domains)
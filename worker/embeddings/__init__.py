@@ -8,11 +8,14 @@ from worker.embeddings.generator import (
     is_zero_vector
 )
 from worker.embeddings.vector_store import FaissVectorStore
+from worker.embeddings.similarity import distance_to_score, self_knn_distances
 
 __all__ = [
     'generate_embedding',
     'generate_embeddings_batch',
     'prepare_log_text',
     'is_zero_vector',
-    'FaissVectorStore'
+    'FaissVectorStore',
+    'distance_to_score',
+    'self_knn_distances'
 ]
@@ -0,0 +1,115 @@
+"""
+Blocked k-NN over an upload's own embeddings (intra-upload self-similarity).
+
+An upload is scored in micro-batches, so each batch is compared with its
+own rows plus a reference sample of the earlier batches' embeddings (see
+worker.reservoir); an event is scored against the upload up to and
+including its batch.
+"""
+import logging
+import numpy as np
+from typing import Optional
+
+from worker.config import (
+    SELF_SIMILARITY_K,
+    SELF_SIMILARITY_BLOCK_SIZE,
+    SELF_SIMILARITY_SAMPLE_SIZE,
+)
+
+logger = logging.getLogger("worker.similarity")
+
+
+def distance_to_score(distances: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Convert neighbour distances to anomaly scores in [0, 1].
+
+    Distances at or below the threshold score 0; above it the score grows
+    linearly and saturates at twice the threshold. NaN distances score 0.
+    """
+    distances = np.asarray(distances, dtype=np.float32)
+    scores = np.where(distances > threshold, np.minimum(1.0, distances / (threshold * 2)), 0.0)
+    return np.nan_to_num(scores, nan=0.0).astype(np.float32)
+
+
+def _unit_rows(matrix: np.ndarray):
+    """L2-normalize rows; zero rows (failed embeddings) stay zero and are flagged invalid."""
+    norms = np.linalg.norm(matrix, axis=1)
+    valid = norms > 0
+    unit = np.zeros_like(matrix, dtype=np.float32)
+    unit[valid] = matrix[valid] / norms[valid, None]
+    return unit, valid
+
+
+def self_knn_distances(
+    embeddings: np.ndarray,
+    k: int = SELF_SIMILARITY_K,
+    block_size: int = SELF_SIMILARITY_BLOCK_SIZE,
+    sample_size: int = SELF_SIMILARITY_SAMPLE_SIZE,
+    seed: int = 0,
+    earlier: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Mean cosine distance from every row to its k nearest neighbours in the same upload.
+
+    Similarities are computed block by block (query block x reference block GEMM)
+    while a running top-k is kept per query row, so peak memory is bounded by
+    block_size^2 floats regardless of upload size. For huge batches the batch's
+    own reference rows are a uniform sample of sample_size rows.
+
+    Args:
+        embeddings: Array of shape (n, dim)
+        k: Number of neighbours to average
+        block_size: Rows per GEMM block
+        sample_size: Maximum number of reference rows taken from embeddings
+        seed: RNG seed for reference sampling
+        earlier: Optional (m, dim) embeddings of earlier batches of the upload,
+            added to the reference rows
+
+    Returns:
+        Array of shape (n,) with mean distances, NaN where no valid vector or neighbours exist
+    """
+    n = embeddings.shape[0]
+    distances = np.full(n, np.nan, dtype=np.float32)
+    if n == 0:
+        return distances
+
+    unit, valid = _unit_rows(np.asarray(embeddings, dtype=np.float32))
+    query_idx = np.flatnonzero(valid)
+    ref_idx = query_idx
+    if ref_idx.size > sample_size:
+        rng = np.random.default_rng(seed)
+        ref_idx = np.sort(rng.choice(ref_idx, size=sample_size, replace=False))
+    ref_vectors = unit[ref_idx]
+    if earlier is not None and len(earlier):
+        earlier_unit, earlier_valid = _unit_rows(np.asarray(earlier, dtype=np.float32))
+        earlier_unit = earlier_unit[earlier_valid]
+        # Earlier rows get index -1 so they are never mistaken for the query row itself
+        ref_vectors = np.concatenate([earlier_unit, ref_vectors])
+        ref_idx = np.concatenate([np.full(len(earlier_unit), -1), ref_idx])
+
+    k = min(k, ref_idx.size - 1)
+    if k < 1:
+        return distances
+
+    for qs in range(0, query_idx.size, block_size):
+        q = query_idx[qs:qs + block_size]
+        q_vectors = unit[q]
+        best = np.full((q.size, k), -np.inf, dtype=np.float32)
+
+        for rs in range(0, ref_idx.size, block_size):
+            r = ref_idx[rs:rs + block_size]
+            sims = q_vectors @ ref_vectors[rs:rs + block_size].T
+            # Never count a row as its own neighbour
+            sims[q[:, None] == r[None, :]] = -np.inf
+
+            merged = np.concatenate([best, sims], axis=1)
+            top = np.argpartition(merged, -k, axis=1)[:, -k:]
+            best = np.take_along_axis(merged, top, axis=1)
+
+        distances[q] = 1.0 - best.mean(axis=1)
+
+    logger.debug(
+        "Computed self-similarity for %d rows against %d reference rows (k=%d)",
+        query_idx.size, ref_idx.size, k
+    )
+    return distances
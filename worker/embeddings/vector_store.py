@@ -80,15 +80,16 @@ class FaissVectorStore:
         Search for k nearest neighbors.
         
         Args:
-            query: Query vector of shape (1, dim) or (dim,)
+            query: Query vectors of shape (n, dim) or a single vector (dim,)
             k: Number of neighbors to return
             
         Returns:
-            (distances, indices) - Both of shape (1, k)
+            (distances, indices) - Both of shape (n, k)
         """
         if self.n_vectors == 0:
             # No vectors in index yet
-            return np.array([[]], dtype=np.float32), np.array([[]], dtype=np.int64)
+            n = 1 if query.ndim == 1 else query.shape[0]
+            return np.empty((n, 0), dtype=np.float32), np.empty((n, 0), dtype=np.int64)
         
         # Ensure correct shape
         if query.ndim == 1:
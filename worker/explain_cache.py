@@ -0,0 +1,148 @@
+"""
+Explanation cache keyed by anomaly signature.
+
+Anomalies that share a cause (same detector, same normalized reason, a
+similar score and the same request shape) get the same explanation. The
+explanation is stored as a template with every event field the LLM saw
+(timestamp, IP, URL, user, method, status, bytes, user agent) replaced by
+placeholders, and re-rendered with each anomaly's own event.
+
+Entries live in Redis with a TTL; a sorted set of last-access times keeps
+the cache bounded by evicting the least recently used signatures.
+"""
+import re
+import time
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+import redis.asyncio as aioredis
+
+from worker.features import normalize_text, url_shape
+from worker.config import (
+    EXPLAIN_CACHE_REDIS_URL,
+    EXPLAIN_CACHE_TTL_DAYS,
+    EXPLAIN_CACHE_MAX_ENTRIES,
+    EXPLAIN_CACHE_SCORE_BUCKET,
+)
+
+logger = logging.getLogger("worker.explain_cache")
+
+# v2: templates cover every prompt field; v1 entries age out by TTL
+KEY_PREFIX = "explain:cache:v2:"
+LRU_KEY = "explain:cache:v2:lru"
+# Event fields given to the LLM; each becomes a placeholder in the cached
+# template, so a group member's explanation only carries its own values
+TEMPLATE_FIELDS = ("timestamp", "src_ip", "url", "username", "method", "status", "bytes", "user_agent")
+# Shorter values would match inside ordinary words and numbers; they are
+# part of the signature instead, so every member of a group shares them
+MIN_TEMPLATE_LENGTH = 3
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value)
+
+
+def _forms(value) -> List[str]:
+    """Ways the value may be written in an explanation; the prompt shows str(value)."""
+    forms = [_text(value)]
+    if isinstance(value, datetime):
+        forms.append(value.isoformat())
+        forms.append(value.strftime("%Y-%m-%d %H:%M:%S"))
+    return [f for f in dict.fromkeys(forms) if len(f) >= MIN_TEMPLATE_LENGTH]
+
+
+def anomaly_signature(detector: str, reason: str, final_score: float, event: Dict) -> str:
+    """Stable signature for anomalies that should share an explanation."""
+    status = event.get("status")
+    short = [
+        f"{field}={_text(event.get(field))}" for field in TEMPLATE_FIELDS
+        if 0 < len(_text(event.get(field))) < MIN_TEMPLATE_LENGTH
+    ]
+    parts = (
+        detector or "",
+        normalize_text(reason),
+        f"{int(final_score / EXPLAIN_CACHE_SCORE_BUCKET)}",
+        (event.get("method") or "").upper(),
+        f"{status // 100}xx" if status else "",
+        url_shape(event.get("url")),
+        ",".join(short),
+    )
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def to_template(explanation: str, event: Dict) -> str:
+    """Replace the event's own TEMPLATE_FIELDS values in an explanation with placeholders."""
+    template = explanation.replace("{", "{{").replace("}", "}}")
+    fields: Dict[str, str] = {}
+    for field in TEMPLATE_FIELDS:
+        for form in _forms(event.get(field)):
+            fields.setdefault(form, field)
+    if not fields:
+        return template
+    # One pass, longest values first, so a URL containing the IP is replaced
+    # as a whole and placeholders are never matched again; values only match
+    # as whole tokens, so status 403 leaves bytes 14035 alone
+    pattern = "|".join(re.escape(v) for v in sorted(fields, key=len, reverse=True))
+    return re.sub(
+        rf"(?<![\w.])(?:{pattern})(?!\w)", lambda m: "{" + fields[m.group(0)] + "}", template
+    )
+
+
+def render_template(template: str, event: Dict) -> str:
+    return template.format_map({field: _text(event.get(field)) or "unknown" for field in TEMPLATE_FIELDS})
+
+
+class ExplanationCache:
+    """Redis-backed signature -> explanation template cache with TTL and LRU eviction."""
+
+    def __init__(self, url: str = EXPLAIN_CACHE_REDIS_URL):
+        self.client = aioredis.Redis.from_url(url, decode_responses=True)
+        self.ttl = EXPLAIN_CACHE_TTL_DAYS * 86400
+
+    async def get_many(self, signatures: List[str]) -> Dict[str, str]:
+        if not signatures:
+            return {}
+        values = await self.client.mget([KEY_PREFIX + s for s in signatures])
+        hits = {s: v for s, v in zip(signatures, values) if v is not None}
+        if hits:
+            now = time.time()
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zadd(LRU_KEY, {s: now for s in hits})
+            for s in hits:
+                pipe.expire(KEY_PREFIX + s, self.ttl)
+            await pipe.execute()
+        return hits
+
+    async def put_many(self, templates: Dict[str, str]) -> None:
+        if not templates:
+            return
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for signature, template in templates.items():
+            pipe.set(KEY_PREFIX + signature, template, ex=self.ttl)
+        pipe.zadd(LRU_KEY, {s: now for s in templates})
+        pipe.zcard(LRU_KEY)
+        size = (await pipe.execute())[-1]
+
+        overflow = size - EXPLAIN_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = [s for s, _ in await self.client.zpopmin(LRU_KEY, overflow)]
+            if evicted:
+                await self.client.delete(*[KEY_PREFIX + s for s in evicted])
+                logger.info("Evicted %d least recently used explanations", len(evicted))
+
+    async def record_stats(self, upload_id: str, anomalies: int, cache_hits: int, llm_calls: int) -> Dict[str, int]:
+        """Accumulate per-upload counters and return the running totals."""
+        key = f"explain:stats:{upload_id}"
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hincrby(key, "anomalies", anomalies)
+        pipe.hincrby(key, "cache_hits", cache_hits)
+        pipe.hincrby(key, "llm_calls", llm_calls)
+        pipe.expire(key, self.ttl)
+        totals = await pipe.execute()
+        return {"anomalies": totals[0], "cache_hits": totals[1], "llm_calls": totals[2]}
+
+    async def close(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,151 @@
+"""
+Background LLM explanations for persisted anomalies.
+
+process_file stores anomalies with their rule/detector reason and enqueues
+their ids here; this module replaces each reason with an LLM explanation
+later. Anomalies are grouped by signature (see worker.explain_cache): a
+cached explanation template is rendered for known signatures, and one LLM
+call is made per new signature through the async OpenAI client with
+bounded concurrency. Anomalies that already carry an explanation are skipped.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from ipaddress import IPv4Address, IPv6Address
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import select, update
+
+from shared.db import AsyncSessionLocal
+from shared.models import Event, Anomaly
+from worker.llm import explain_anomaly_with_llm_async
+from worker.explain_cache import (
+    ExplanationCache, TEMPLATE_FIELDS, anomaly_signature, to_template, render_template,
+)
+from worker.config import EXPLAIN_CONCURRENCY
+
+logger = logging.getLogger("worker.explanations")
+
+# Event fields passed to the prompt; all of them are templated when cached
+PROMPT_FIELDS = TEMPLATE_FIELDS
+
+
+def event_context(event) -> dict:
+    """PROMPT_FIELDS of an event; INET columns load as ipaddress objects and are passed on as text."""
+    ctx = {field: getattr(event, field) for field in PROMPT_FIELDS}
+    for field, value in ctx.items():
+        if isinstance(value, (IPv4Address, IPv6Address)):
+            ctx[field] = str(value)
+    return ctx
+
+
+async def explain_anomalies(items: Sequence[Tuple[int, float]]) -> int:
+    """
+    Generate explanations for anomalies and write them to Anomaly.reason.
+
+    Args:
+        items: (anomaly_id, ml_score) pairs
+
+    Returns:
+        Number of anomalies updated
+    """
+    ml_scores = {int(anomaly_id): float(ml_score) for anomaly_id, ml_score in items}
+    if not ml_scores:
+        return 0
+
+    async with AsyncSessionLocal() as db:
+        stmt = (
+            select(Anomaly, Event)
+            .join(Event, (Event.id == Anomaly.event_id) & (Event.timestamp == Anomaly.event_timestamp))
+            .where(Anomaly.id.in_(list(ml_scores)))
+            .where(Anomaly.explained_at.is_(None))
+        )
+        rows = (await db.execute(stmt)).all()
+    if not rows:
+        return 0
+
+    # Group anomalies by signature; the first member's context is sent to the LLM
+    groups: Dict[str, List[Tuple[Tuple[int, datetime], str, dict]]] = defaultdict(list)
+    prompts: Dict[str, dict] = {}
+    for anomaly, event in rows:
+        event_ctx = event_context(event)
+        final_score = float(anomaly.score) if anomaly.score else 0.0
+        signature = anomaly_signature(anomaly.detector, anomaly.reason, final_score, event_ctx)
+
+        groups[signature].append(((anomaly.id, anomaly.event_timestamp), str(event.upload_id), event_ctx))
+        prompts.setdefault(signature, {
+            "event": event_ctx,
+            "rules": [anomaly.reason] if anomaly.reason else [],
+            "ml_score": ml_scores[anomaly.id],
+            "final_score": final_score,
+        })
+
+    cache = ExplanationCache()
+    try:
+        try:
+            templates = await cache.get_many(list(groups))
+        except Exception:
+            logger.exception("Explanation cache lookup failed")
+            templates = {}
+        cached = set(templates)
+
+        semaphore = asyncio.Semaphore(EXPLAIN_CONCURRENCY)
+
+        async def run(signature):
+            async with semaphore:
+                return signature, await explain_anomaly_with_llm_async(**prompts[signature])
+
+        misses = [s for s in groups if s not in cached]
+        generated = {}
+        for signature, explanation in await asyncio.gather(*(run(s) for s in misses)):
+            if explanation:
+                generated[signature] = to_template(explanation, prompts[signature]["event"])
+        templates.update(generated)
+
+        try:
+            await cache.put_many(generated)
+        except Exception:
+            logger.exception("Failed storing explanations in cache")
+
+        explained_at = datetime.now(timezone.utc)
+        updates = [
+            {
+                "id": anomaly_id,
+                "event_timestamp": event_timestamp,
+                "reason": render_template(templates[signature], event_ctx),
+                "explained_at": explained_at,
+            }
+            for signature, members in groups.items() if signature in templates
+            for (anomaly_id, event_timestamp), _, event_ctx in members
+        ]
+        if updates:
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(Anomaly), updates)
+                await db.commit()
+
+        # Per-upload savings: anomalies served from cache vs LLM calls made
+        stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"anomalies": 0, "cache_hits": 0, "llm_calls": 0})
+        for signature, members in groups.items():
+            for _, upload_id, _ in members:
+                stats[upload_id]["anomalies"] += 1
+                if signature in cached:
+                    stats[upload_id]["cache_hits"] += 1
+            if signature not in cached:
+                stats[members[0][1]]["llm_calls"] += 1
+
+        for upload_id, counts in stats.items():
+            try:
+                totals = await cache.record_stats(upload_id, **counts)
+            except Exception:
+                logger.exception("Failed recording explanation stats for upload %s", upload_id)
+                totals = counts
+            saved = 1 - totals["llm_calls"] / totals["anomalies"] if totals["anomalies"] else 0.0
+            logger.info(
+                "Upload %s explanations: anomalies=%d cache_hits=%d llm_calls=%d savings=%.1f%%",
+                upload_id, totals["anomalies"], totals["cache_hits"], totals["llm_calls"], saved * 100
+            )
+    finally:
+        await cache.close()
+
+    return len(updates)
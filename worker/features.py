@@ -0,0 +1,90 @@
+"""
+Columnar views over parsed events for batch (vectorized) detectors.
+"""
+import re
+import numpy as np
+from hashlib import blake2b
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from shared.schemas import ParsedEvent
+
+# Text columns are object arrays with "" for missing values so they can be
+# sorted, factorized and compared without None checks.
+TEXT_FIELDS = ("src_ip", "dest_ip", "method", "url", "user_agent", "username", "domain")
+
+_IP_RE = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b")
+_ID_RE = re.compile(r"[0-9a-f]{8,}|\d+", re.IGNORECASE)
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Mask IPs, numbers and hex ids so reasons differing only in values compare equal."""
+    if not text:
+        return ""
+    text = _IP_RE.sub("<ip>", text.lower())
+    return _ID_RE.sub("<n>", text)
+
+
+def url_shape(url: Optional[str]) -> str:
+    """Path of a URL with ids masked and the query string dropped."""
+    if not url:
+        return ""
+    return normalize_text(url.split("?", 1)[0])
+
+
+def epoch_seconds(ts: Optional[datetime]) -> float:
+    """POSIX seconds, NaN when missing. Naive values are UTC, as in tasks.normalize_timestamp
+    (datetime.timestamp() would read them as local time)."""
+    if ts is None:
+        return np.nan
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def event_columns(events: List[ParsedEvent]) -> Dict[str, np.ndarray]:
+    """
+    Build a dict of column arrays from parsed events.
+
+    Columns:
+        timestamp: float64 epoch seconds, NaN when missing
+        status: int32, -1 when missing
+        bytes: int64, 0 when missing
+        entropy, url_length, ua_length, hour: float64, NaN when missing
+        src_ip, dest_ip, method, url, user_agent, username, domain: object ("" when missing)
+    """
+    columns: Dict[str, np.ndarray] = {
+        field: np.array([getattr(e, field) or "" for e in events], dtype=object)
+        for field in TEXT_FIELDS
+    }
+    columns["timestamp"] = np.array([epoch_seconds(e.timestamp) for e in events], dtype=np.float64)
+    columns["status"] = np.array(
+        [e.status if e.status is not None else -1 for e in events], dtype=np.int32
+    )
+    columns["bytes"] = np.array([e.bytes or 0 for e in events], dtype=np.int64)
+    for field in ("entropy", "url_length", "ua_length", "hour"):
+        columns[field] = np.array(
+            [getattr(e, field) if getattr(e, field) is not None else np.nan for e in events],
+            dtype=np.float64,
+        )
+    return columns
+
+
+def factorize(values: np.ndarray):
+    """Map values to dense integer codes. Returns (uniques, codes)."""
+    uniques, codes = np.unique(values, return_inverse=True)
+    return uniques, codes.reshape(-1)
+
+
+def stable_hash64(values: np.ndarray) -> np.ndarray:
+    """
+    64-bit hashes that are stable across processes (unlike hash()).
+
+    Hashes each distinct value once, so cost scales with cardinality.
+    """
+    uniques, codes = factorize(values)
+    hashed = np.array(
+        [int.from_bytes(blake2b(str(v).encode("utf-8"), digest_size=8).digest(), "little") for v in uniques],
+        dtype=np.uint64,
+    )
+    return hashed[codes] if len(codes) else np.empty(0, dtype=np.uint64)
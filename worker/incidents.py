@@ -0,0 +1,193 @@
+"""
+Incident aggregation: collapse repeated anomalies into grouped incidents.
+
+Anomalies are grouped by (entity, detector, reason class), where the entity
+is the source IP (or the username when there is no IP). A group stays open
+while consecutive anomalies are less than INCIDENT_WINDOW_SECONDS apart;
+a longer gap starts a new incident. Every anomaly is stored as an Anomaly
+row, but only the first INCIDENT_MAX_ANOMALIES of an incident are linked
+to it as its members (the sample listed with the incident); the count
+covers all of them.
+
+The aggregator is fed batch by batch during ingest; each batch's changes
+are snapshotted right away and flushed by the persistence stage after that
+batch's events are inserted.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.models import Incident
+from worker.features import normalize_text
+from worker.config import INCIDENT_WINDOW_SECONDS, INCIDENT_MAX_ANOMALIES
+
+logger = logging.getLogger("worker.incidents")
+
+
+class _OpenIncident:
+    __slots__ = (
+        "key", "entity_type", "entity", "detector", "reason_class", "reason",
+        "first_seen", "last_seen", "count", "max_score",
+        "rep_event_index", "rep_event_id", "incident_id", "dirty",
+    )
+
+    def __init__(self, key, entity_type, entity, detector, reason_class, reason):
+        self.key = key
+        self.entity_type = entity_type
+        self.entity = entity
+        self.detector = detector
+        self.reason_class = reason_class
+        self.reason = reason
+        self.first_seen: Optional[datetime] = None
+        self.last_seen: Optional[datetime] = None
+        self.count = 0
+        self.max_score = 0.0
+        self.rep_event_index: Optional[int] = None  # index into the current batch
+        self.rep_event_id: Optional[int] = None
+        self.incident_id: Optional[int] = None
+        self.dirty = False
+
+
+def reason_class_for(detector: str, rule_name: Optional[str], reason: Optional[str]) -> str:
+    """Rules group by rule name; other detectors by their reason with values masked."""
+    if detector == "rule_based" and rule_name:
+        return f"rule:{rule_name}"
+    return normalize_text(reason)[:256] or detector
+
+
+class IncidentAggregator:
+    """Assigns anomalies to incidents across the batches of one upload."""
+
+    def __init__(self, upload_id: str):
+        self.upload_id = upload_id
+        self._open: Dict[tuple, _OpenIncident] = {}
+        self._pending: List[_OpenIncident] = []  # incidents with unflushed changes
+        self.total_anomalies = 0
+        self.total_incidents = 0
+
+    def assign(self, anomalies: Sequence[Dict]) -> List[Tuple[_OpenIncident, bool]]:
+        """
+        Assign a batch of anomalies to incidents.
+
+        Each anomaly dict needs: event_index, timestamp, src_ip, username,
+        detector, reason_class, reason, score.
+
+        Returns:
+            (incident, member) per anomaly, in input order; member is False
+            for anomalies beyond INCIDENT_MAX_ANOMALIES, which are counted on
+            the incident but not linked to it.
+        """
+        order = sorted(
+            range(len(anomalies)),
+            key=lambda i: (anomalies[i]["timestamp"] is None, anomalies[i]["timestamp"] or datetime.min),
+        )
+        out: List[Optional[Tuple[_OpenIncident, bool]]] = [None] * len(anomalies)
+
+        for i in order:
+            a = anomalies[i]
+            if a.get("src_ip"):
+                entity_type, entity = "ip", a["src_ip"]
+            else:
+                entity_type, entity = "user", a.get("username") or "unknown"
+            key = (entity_type, entity, a["detector"], a["reason_class"])
+            ts = a["timestamp"]
+
+            incident = self._open.get(key)
+            if incident is not None and ts is not None and incident.last_seen is not None:
+                if (ts - incident.last_seen).total_seconds() > INCIDENT_WINDOW_SECONDS:
+                    incident = None
+            if incident is None:
+                incident = _OpenIncident(key, entity_type, entity, a["detector"], a["reason_class"], a["reason"])
+                self._open[key] = incident
+
+            incident.count += 1
+            if ts is not None:
+                if incident.first_seen is None or ts < incident.first_seen:
+                    incident.first_seen = ts
+                if incident.last_seen is None or ts > incident.last_seen:
+                    incident.last_seen = ts
+            # The highest-scoring anomaly represents the incident
+            if incident.count == 1 or a["score"] > incident.max_score:
+                incident.max_score = a["score"]
+                incident.rep_event_index = a["event_index"]
+                incident.reason = a["reason"]
+            if not incident.dirty:
+                incident.dirty = True
+                self._pending.append(incident)
+
+            out[i] = (incident, incident.count <= INCIDENT_MAX_ANOMALIES)
+
+        self.total_anomalies += len(anomalies)
+        return out
+
+    def snapshot(self) -> List[Tuple[_OpenIncident, Dict, Optional[int]]]:
+        """
+        Take the incidents changed since the last snapshot.
+
+        Returns (incident, row values, representative event index in the
+        batch or None) per changed incident. The values are copied now so the
+        next batch can be assigned while this one is still being written.
+        """
+        pending, self._pending = self._pending, []
+        updates = []
+        for incident in pending:
+            updates.append((incident, {
+                "count": incident.count,
+                "max_score": incident.max_score,
+                "first_seen": incident.first_seen,
+                "last_seen": incident.last_seen,
+                "reason": incident.reason,
+            }, incident.rep_event_index))
+            incident.rep_event_index = None
+            incident.dirty = False
+        return updates
+
+    async def flush(
+        self,
+        db: AsyncSession,
+        updates: Sequence[Tuple[_OpenIncident, Dict, Optional[int]]],
+        event_ids: Sequence[int],
+    ) -> None:
+        """
+        Insert new incidents and update changed ones from a snapshot.
+
+        event_ids maps the snapshot batch's indexes to Event ids. Snapshots
+        must be flushed in the order they were taken; whether an incident is
+        new is decided here, after earlier flushes assigned their ids.
+        """
+        for incident, _, rep_index in updates:
+            if rep_index is not None:
+                incident.rep_event_id = event_ids[rep_index]
+
+        def row(incident: _OpenIncident, values: Dict) -> Dict:
+            return {**values, "representative_event_id": incident.rep_event_id}
+
+        new = [(i, v) for i, v, _ in updates if i.incident_id is None]
+        changed = [(i, v) for i, v, _ in updates if i.incident_id is not None]
+
+        if new:
+            stmt = insert(Incident).returning(Incident.id, sort_by_parameter_order=True)
+            res = await db.execute(stmt, [
+                {
+                    "upload_id": self.upload_id,
+                    "entity_type": i.entity_type,
+                    "entity": i.entity,
+                    "detector": i.detector,
+                    "reason_class": i.reason_class,
+                    **row(i, v),
+                }
+                for i, v in new
+            ])
+            for (incident, _), incident_id in zip(new, res.scalars().all()):
+                incident.incident_id = incident_id
+        if changed:
+            await db.execute(update(Incident), [{"id": i.incident_id, **row(i, v)} for i, v in changed])
+
+        self.total_incidents += len(new)
+        logger.info(
+            "Upload %s: %d incidents from %d anomalies so far",
+            self.upload_id, self.total_incidents, self.total_anomalies
+        )
@@ -1,6 +1,6 @@
 import os
 import json
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import logging
 from typing import Optional
 
@@ -9,6 +9,11 @@ logger = logging.getLogger("worker.llm")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "ollama")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "qwen2.5:3b")
 client = OpenAI(api_key=OPENAI_API_KEY, base_url=os.getenv("OPENAI_BASE_URL", "http://ollama:11434/v1"))
+async_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    base_url=os.getenv("OPENAI_BASE_URL", "http://ollama:11434/v1"),
+    timeout=90.0,
+)
 
 
 def build_parse_prompt(line: str, schema: dict) -> str:
@@ -64,25 +69,8 @@ def parse_line_with_llm(line: str, schema: dict):
         return None
 
 
-def explain_anomaly_with_llm(event: dict, rules: list, ml_score: float, final_score: float) -> Optional[str]:
-    """
-    Generate a human-friendly SOC-style explanation for an anomaly using OpenAI LLM.
-
-    Input:
-        - event: dict containing key event fields
-        - rules: list of rule reasons triggered (if any)
-        - ml_score: original ML anomaly score
-        - final_score: hybrid score (rule + ML)
-
-    Output:
-        - short SOC analyst explanation (string)
-        - or None if API not available
-    """
-
-    if not OPENAI_API_KEY:
-        logger.warning("OPENAI_API_KEY not set - skipping LLM explanation")
-        return None
-
+def build_explanation_prompt(event: dict, rules: list, ml_score: float, final_score: float) -> str:
+    """Build the SOC explanation prompt for one anomalous event."""
     # Minimal event context (avoid leaking sensitive large logs)
     # Convert timestamp to string to avoid JSON serialization errors
     context = {
@@ -97,7 +85,7 @@ def explain_anomaly_with_llm(event: dict, rules: list, ml_score: float, final_sc
 
     rule_text = "; ".join(rules) if rules else "No explicit rule triggered."
 
-    prompt = f"""
+    return f"""
 You are a cybersecurity SOC analyst.
 
 A log event has been classified as anomalous by a hybrid detection engine
@@ -106,7 +94,7 @@ explanation (~1–3 sentences) describing *why this event is suspicious*, based
 on the following details.
 
 EVENT (sanitized):
-{json.dumps(context, indent=2)}
+{json.dumps(context, indent=2, default=str)}
 
 ANALYSIS INDICATORS:
 - Rule triggers: {rule_text}
@@ -120,8 +108,29 @@ REQUIREMENTS:
 - Keep it concise, factual, and helpful for analysts.
 """
 
+
+async def explain_anomaly_with_llm_async(event: dict, rules: list, ml_score: float, final_score: float) -> Optional[str]:
+    """
+    Generate a human-friendly SOC-style explanation for an anomaly using OpenAI LLM.
+    Used by the background explanation queue.
+
+    Input:
+        - event: dict containing key event fields
+        - rules: list of rule reasons triggered (if any)
+        - ml_score: original ML anomaly score
+        - final_score: hybrid score (rule + ML)
+
+    Output:
+        - short SOC analyst explanation (string)
+        - or None if no explanation could be generated, so callers keep the rule-based reason
+    """
+    if not OPENAI_API_KEY:
+        logger.warning("OPENAI_API_KEY not set - skipping LLM explanation")
+        return None
+
     try:
-        response = client.chat.completions.create(
+        prompt = build_explanation_prompt(event, rules, ml_score, final_score)
+        response = await async_client.chat.completions.create(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": "You are a SOC analyst generating anomaly explanations."},
@@ -130,11 +139,8 @@ REQUIREMENTS:
             max_tokens=150,
             temperature=0.2
         )
+        return response.choices[0].message.content.strip()
 
-        explanation = response.choices[0].message.content.strip()
-        logger.info(f"Generated LLM explanation: {explanation}")
-        return explanation
-
-    except Exception as e:
-        logger.exception("LLM explanation generation failed")
-        return "Anomaly detected, but explanation could not be generated."
\ No newline at end of file
+    except Exception:
+        logger.exception("Async LLM explanation generation failed")
+        return None
@@ -0,0 +1,194 @@
+"""
+Asynchronous persistence stage for micro-batches of an upload.
+
+process_file scores an upload in micro-batches and hands each one to this
+stage, which writes it on its own database session (and so its own
+connection) while the next batch is parsed, embedded and scored. Every
+batch is committed on its own, so a running upload's events and anomalies
+are queryable as soon as their batch is written. At most
+PERSIST_MAX_IN_FLIGHT scored batches wait in the queue; beyond that,
+submit() blocks and ingest slows down to the database's pace. Closing the
+stage bumps the data version, invalidating the backend's response cache.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import update
+
+from shared.db import AsyncSessionLocal
+from shared.models import Upload
+from shared.data_version import bump_data_version
+from shared.partitions import batch_periods, ensure_partitions
+from shared.rollups import add_event_rollups, add_anomaly_rollups
+from worker.bulk_writer import BulkWriter
+from worker.incidents import IncidentAggregator
+from worker.config import PERSIST_MAX_IN_FLIGHT
+
+logger = logging.getLogger("worker.persistence")
+
+
+@dataclass
+class ScoredBatch:
+    """One scored micro-batch, ready to be written."""
+    events: List[Dict]  # Event rows
+    anomalies: List[Dict]  # Anomaly rows; "event_id" holds the event's index in the batch
+    anomaly_incidents: List  # incident per anomaly row, None when not a member (see IncidentAggregator)
+    anomaly_ml_scores: List[float]
+    incident_updates: List  # IncidentAggregator.snapshot() taken right after scoring
+    embeddings: np.ndarray  # vectors of the embedded events
+    embed_idx: np.ndarray  # batch indexes of the embedded events
+
+
+@dataclass
+class IndexedVectors:
+    """Embeddings of a written batch with the Faiss metadata of their events."""
+    embeddings: np.ndarray
+    metadata: List[Dict] = field(default_factory=list)
+
+
+class PersistenceStage:
+    """Writes scored batches in order on a dedicated session."""
+
+    def __init__(
+        self,
+        upload_id: str,
+        incidents: IncidentAggregator,
+        on_anomalies: Optional[Callable[[List[Tuple[int, float]]], None]] = None,
+        max_in_flight: int = PERSIST_MAX_IN_FLIGHT,
+    ):
+        self.upload_id = upload_id
+        self.incidents = incidents
+        self.on_anomalies = on_anomalies
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_in_flight)
+        self.vectors: List[IndexedVectors] = []
+        self.events_written = 0
+        self.anomalies_written = 0
+        self.failed_batches = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _put(self, item: Optional[ScoredBatch]) -> bool:
+        """
+        Queue item, waiting for room; False when the writer task has ended,
+        which would otherwise leave the put waiting on a full queue forever.
+        """
+        if self._task is None:
+            await self.queue.put(item)
+            return True
+        if self._task.done():
+            return False
+        put = asyncio.ensure_future(self.queue.put(item))
+        done, _ = await asyncio.wait({put, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if put in done:
+            return True
+        put.cancel()
+        return False
+
+    async def submit(self, batch: ScoredBatch) -> None:
+        """Queue a batch; waits while PERSIST_MAX_IN_FLIGHT batches are pending."""
+        if not await self._put(batch):
+            raise RuntimeError("Persistence stage stopped unexpectedly")
+
+    async def close(self, status: str = "completed") -> None:
+        """
+        Drain the queue, stop the stage and record the upload's final status.
+        A completed upload with batches that failed to write is "partial", or
+        "failed" when nothing was written; the count is kept on the upload.
+        """
+        await self._put(None)
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception:
+                logger.exception("Persistence of upload %s stopped unexpectedly", self.upload_id)
+                # Batches still queued behind the failure were never written
+                while not self.queue.empty():
+                    if self.queue.get_nowait() is not None:
+                        self.failed_batches += 1
+                self.failed_batches = max(self.failed_batches, 1)
+        if status == "completed" and self.failed_batches:
+            status = "partial" if self.events_written else "failed"
+        await self._set_status(status, failed_batches=self.failed_batches)
+        await bump_data_version(f"upload {self.upload_id} {status}")
+        logger.info(
+            "Upload %s persisted: events=%d anomalies=%d failed_batches=%d",
+            self.upload_id, self.events_written, self.anomalies_written, self.failed_batches
+        )
+
+    async def _set_status(self, status: str, **values) -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(Upload).where(Upload.id == self.upload_id).values(status=status, **values))
+                await db.commit()
+        except Exception:
+            logger.exception("Failed setting upload %s status to %s", self.upload_id, status)
+
+    async def _run(self) -> None:
+        await self._set_status("processing")
+        async with AsyncSessionLocal() as db:
+            writer = BulkWriter(db)
+            while True:
+                batch = await self.queue.get()
+                if batch is None:
+                    break
+                try:
+                    await self._write(db, writer, batch)
+                except Exception:
+                    logger.exception("Failed persisting a batch of upload %s", self.upload_id)
+                    self.failed_batches += 1
+                    await db.rollback()
+
+    async def _write(self, db, writer: BulkWriter, batch: ScoredBatch) -> None:
+        if not batch.events:
+            return
+        await ensure_partitions(db, batch_periods(e["timestamp"] for e in batch.events))
+        await db.commit()
+
+        event_ids = await writer.write_events(batch.events)
+        # Same transaction as the events, so the rollups never count a batch that was not written
+        await add_event_rollups(db, self.upload_id, batch.events)
+        await db.commit()
+        self.events_written += len(event_ids)
+
+        try:
+            await self.incidents.flush(db, batch.incident_updates, event_ids)
+            await db.commit()
+        except Exception:
+            logger.exception("Failed writing incidents to DB")
+            await db.rollback()
+
+        # Map anomalies' batch event index -> real event id
+        for anomaly, incident in zip(batch.anomalies, batch.anomaly_incidents):
+            anomaly["incident_id"] = incident.incident_id if incident is not None else None
+            anomaly["event_id"] = event_ids[anomaly["event_id"]]
+
+        anomaly_ids: Sequence[int] = []
+        try:
+            anomaly_ids = await writer.write_anomalies(batch.anomalies)
+            await add_anomaly_rollups(db, self.upload_id, batch.anomalies)
+            await db.commit()
+            self.anomalies_written += len(anomaly_ids)
+        except Exception:
+            logger.exception("Failed inserting anomalies into DB")
+            # The batch's events are in, but the upload is no longer complete
+            self.failed_batches += 1
+            await db.rollback()
+            anomaly_ids = []
+
+        if self.on_anomalies and anomaly_ids:
+            self.on_anomalies(list(zip(anomaly_ids, batch.anomaly_ml_scores)))
+
+        if len(batch.embeddings):
+            self.vectors.append(IndexedVectors(batch.embeddings, [
+                {
+                    "event_id": event_ids[i],
+                    "upload_id": self.upload_id,
+                    "timestamp": str(batch.events[i]["timestamp"]) if batch.events[i]["timestamp"] else None,
+                }
+                for i in batch.embed_idx
+            ]))
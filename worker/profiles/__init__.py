@@ -0,0 +1,21 @@
+"""
+Cross-upload entity profiles (per source IP and per username)
+"""
+from worker.profiles.stats import batch_profiles, merge_profile, empty_profile, STATUS_CLASSES
+from worker.profiles.store import (
+    ProfileStore,
+    RedisProfileStore,
+    LocalProfileStore,
+    get_profile_store
+)
+
+__all__ = [
+    'batch_profiles',
+    'merge_profile',
+    'empty_profile',
+    'STATUS_CLASSES',
+    'ProfileStore',
+    'RedisProfileStore',
+    'LocalProfileStore',
+    'get_profile_store'
+]
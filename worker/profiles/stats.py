@@ -0,0 +1,110 @@
+"""
+Per-entity running statistics and their batch aggregation.
+
+Each profile holds a Welford mean/variance of bytes, a status-class mix,
+an active-hour histogram and a bounded set of URL hashes. Batches are
+aggregated with vectorized group-bys and merged into stored profiles with
+Chan's parallel update, so per-event Python work is avoided.
+"""
+import numpy as np
+from typing import Dict, List
+
+from worker.config import PROFILE_MAX_URLS
+from worker.features import factorize, stable_hash64
+
+STATUS_CLASSES = ("2xx", "3xx", "4xx", "5xx", "other")
+N_HOURS = 24
+
+
+def status_class(status: np.ndarray) -> np.ndarray:
+    """Map HTTP status codes to indexes into STATUS_CLASSES."""
+    cls = status // 100 - 2
+    return np.where((cls >= 0) & (cls <= 3), cls, 4).astype(np.int64)
+
+
+def empty_profile() -> Dict:
+    return {
+        "count": 0,
+        "bytes_mean": 0.0,
+        "bytes_m2": 0.0,
+        "status": [0] * len(STATUS_CLASSES),
+        "hours": [0] * N_HOURS,
+        "urls": [],
+    }
+
+
+def merge_profile(profile: Dict, batch: Dict) -> Dict:
+    """Merge batch statistics into a stored profile (Chan et al. parallel variance)."""
+    n_a, n_b = profile["count"], batch["count"]
+    n = n_a + n_b
+    if n == 0:
+        return profile
+    delta = batch["bytes_mean"] - profile["bytes_mean"]
+
+    urls = profile["urls"]
+    if len(urls) < PROFILE_MAX_URLS:
+        known = set(urls)
+        urls = urls + [u for u in batch["urls"] if u not in known][:PROFILE_MAX_URLS - len(urls)]
+
+    return {
+        "count": n,
+        "bytes_mean": profile["bytes_mean"] + delta * n_b / n,
+        "bytes_m2": profile["bytes_m2"] + batch["bytes_m2"] + delta * delta * n_a * n_b / n,
+        "status": [a + b for a, b in zip(profile["status"], batch["status"])],
+        "hours": [a + b for a, b in zip(profile["hours"], batch["hours"])],
+        "urls": urls,
+    }
+
+
+def batch_profiles(entities: np.ndarray, columns: Dict[str, np.ndarray]) -> Dict[str, Dict]:
+    """
+    Aggregate one batch into per-entity statistics.
+
+    Args:
+        entities: Object array with the entity key per event ("" to skip the event)
+        columns: Batch columns from worker.features.event_columns
+
+    Returns:
+        {entity: profile dict} for every entity in the batch
+    """
+    keep = entities != ""
+    if not keep.any():
+        return {}
+    keys, codes = factorize(entities[keep])
+    n_keys = len(keys)
+
+    byte_values = columns["bytes"][keep].astype(np.float64)
+    counts = np.bincount(codes, minlength=n_keys)
+    means = np.bincount(codes, weights=byte_values, minlength=n_keys) / counts
+    m2 = np.bincount(codes, weights=(byte_values - means[codes]) ** 2, minlength=n_keys)
+
+    n_status = len(STATUS_CLASSES)
+    status = np.bincount(
+        codes * n_status + status_class(columns["status"][keep]), minlength=n_keys * n_status
+    ).reshape(n_keys, n_status)
+
+    hours_col = columns["hour"][keep]
+    has_hour = ~np.isnan(hours_col)
+    hours = np.bincount(
+        codes[has_hour] * N_HOURS + hours_col[has_hour].astype(np.int64), minlength=n_keys * N_HOURS
+    ).reshape(n_keys, N_HOURS)
+
+    # Distinct (entity, url) pairs, capped per entity when merged
+    url_hashes = stable_hash64(columns["url"][keep])
+    pairs = np.unique(np.stack([codes.astype(np.uint64), url_hashes], axis=1), axis=0)
+    urls: List[List[int]] = [[] for _ in range(n_keys)]
+    for code, url_hash in pairs:
+        if len(urls[code]) < PROFILE_MAX_URLS:
+            urls[code].append(int(url_hash))
+
+    return {
+        str(key): {
+            "count": int(counts[i]),
+            "bytes_mean": float(means[i]),
+            "bytes_m2": float(m2[i]),
+            "status": status[i].tolist(),
+            "hours": hours[i].tolist(),
+            "urls": urls[i],
+        }
+        for i, key in enumerate(keys)
+    }
@@ -0,0 +1,156 @@
+"""
+Profile stores: Redis for shared state across workers, a local SQLite file as a stand-in.
+"""
+import os
+import json
+import sqlite3
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import redis
+
+from worker.config import (
+    PROFILE_STORE,
+    PROFILE_REDIS_URL,
+    PROFILE_LOCAL_PATH,
+    PROFILE_TTL_DAYS,
+)
+from worker.profiles.stats import empty_profile, merge_profile
+
+logger = logging.getLogger("worker.profiles")
+
+# Keys per IN (...) lookup, below SQLite's default bound-parameter limit
+SQLITE_MAX_PARAMS = 900
+
+
+class ProfileStore(ABC):
+    """Bulk get/merge of per-entity profiles. Keys look like "ip:10.0.0.1" or "user:alice"."""
+
+    @abstractmethod
+    def get_many(self, keys: List[str]) -> Dict[str, Dict]:
+        """Stored profile of each key, an empty profile for unknown keys."""
+
+    @abstractmethod
+    def put_many(self, profiles: Dict[str, Dict]) -> None:
+        """Replace the stored profiles of these keys."""
+
+    def merge_many(self, batch: Dict[str, Dict]) -> None:
+        """Fold batch statistics into the stored profiles."""
+        if not batch:
+            return
+        stored = self.get_many(list(batch))
+        self.put_many({key: merge_profile(stored[key], stats) for key, stats in batch.items()})
+
+
+class RedisProfileStore(ProfileStore):
+    """
+    One JSON value per entity, read with MGET and written in a pipeline.
+
+    Concurrent uploads touching the same entity can interleave their
+    read-merge-write; the last writer wins for that batch, which only
+    loses some counts and never corrupts a profile.
+    """
+
+    def __init__(self, url: str = PROFILE_REDIS_URL, ttl_days: int = PROFILE_TTL_DAYS):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl_days * 86400 if ttl_days else None
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict]:
+        if not keys:
+            return {}
+        values = self.client.mget([f"profile:{k}" for k in keys])
+        return {k: json.loads(v) if v else empty_profile() for k, v in zip(keys, values)}
+
+    def put_many(self, profiles: Dict[str, Dict]) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for key, profile in profiles.items():
+            pipe.set(f"profile:{key}", json.dumps(profile), ex=self.ttl)
+        pipe.execute()
+
+
+class LocalProfileStore(ProfileStore):
+    """
+    Profiles kept in a SQLite file next to the Faiss index (single-host
+    deployments), one JSON row per entity.
+
+    Several worker processes may share the file: a merge reads and rewrites
+    only the batch's rows inside one IMMEDIATE transaction, so SQLite
+    serializes the writers and none of them overwrites the others' updates,
+    and a batch costs the same however many profiles are stored. WAL mode
+    lets reads proceed while another process writes.
+    """
+
+    def __init__(self, path: str = PROFILE_LOCAL_PATH):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.conn = self._connect()
+        except sqlite3.DatabaseError:
+            logger.exception("Failed to open profiles at %s, moving it aside and starting empty", path)
+            os.replace(path, f"{path}.corrupt")
+            self.conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS profiles (key TEXT PRIMARY KEY, profile TEXT NOT NULL)")
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # IMMEDIATE takes the write lock up front, so the rows read are still current when written
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _select(self, keys: List[str]) -> Dict[str, Dict]:
+        found: Dict[str, Dict] = {}
+        for i in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[i:i + SQLITE_MAX_PARAMS]
+            rows = self.conn.execute(
+                f"SELECT key, profile FROM profiles WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            found.update((key, json.loads(profile)) for key, profile in rows)
+        return found
+
+    def _upsert(self, profiles: Dict[str, Dict]) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO profiles (key, profile) VALUES (?, ?)",
+            [(key, json.dumps(profile)) for key, profile in profiles.items()],
+        )
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict]:
+        stored = self._select(keys)
+        return {k: stored.get(k) or empty_profile() for k in keys}
+
+    def put_many(self, profiles: Dict[str, Dict]) -> None:
+        with self._transaction():
+            self._upsert(profiles)
+
+    def merge_many(self, batch: Dict[str, Dict]) -> None:
+        """Merge in one write transaction, against the latest stored profiles."""
+        if not batch:
+            return
+        with self._transaction():
+            stored = self._select(list(batch))
+            self._upsert({
+                key: merge_profile(stored.get(key) or empty_profile(), stats) for key, stats in batch.items()
+            })
+
+
+def get_profile_store() -> ProfileStore:
+    """Build the configured profile store (PROFILE_STORE=redis|local)."""
+    if PROFILE_STORE == "local":
+        return LocalProfileStore()
+    return RedisProfileStore()
@@ -0,0 +1,40 @@
+"""
+Uniform row samples of a stream of micro-batches.
+
+Detectors that used to see a whole upload at once (model fitting, the
+self-similarity reference set) keep a Reservoir instead: every row of the
+upload so far has the same chance of being in it, whatever batch it came
+from, and memory stays bounded by its size.
+"""
+from typing import Optional
+
+import numpy as np
+
+
+class Reservoir:
+    """Uniform sample (algorithm R) of at most `size` rows of all rows added."""
+
+    def __init__(self, size: int, seed: int = 0):
+        self.size = size
+        self.rows: Optional[np.ndarray] = None
+        self.seen = 0  # rows added so far
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        return 0 if self.rows is None else len(self.rows)
+
+    def add(self, X: np.ndarray) -> None:
+        if self.rows is None:
+            self.rows = np.empty((0,) + X.shape[1:], dtype=X.dtype)
+        room = self.size - len(self.rows)
+        if room > 0:
+            self.rows = np.concatenate([self.rows, X[:room]])
+            self.seen += len(X[:room])
+            X = X[room:]
+        if len(X):
+            # Row number t replaces a random slot with probability size / (t + 1)
+            t = self.seen + np.arange(len(X))
+            slots = (self._rng.random(len(X)) * (t + 1)).astype(np.int64)
+            keep = slots < self.size
+            self.rows[slots[keep]] = X[keep]
+            self.seen += len(X)
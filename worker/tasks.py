@@ -5,29 +5,41 @@ Uses Ollama for embeddings and Faiss for similarity search.
 
 import logging
 import asyncio
-from collections import Counter
-from datetime import datetime
-from typing import List, Tuple
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
 
 import numpy as np
 from celery import shared_task
-from sqlalchemy import insert
 
 from shared.db import AsyncSessionLocal
-from shared.models import Event, Anomaly
+from shared.partitions import maintain_partitions
+from shared.data_version import bump_data_version
 from shared.schemas import ParsedEvent
 from worker.parsers.deterministic import parse_line_deterministic
-from worker.detectors.rules import (
-    rule_high_request_rate,
-    rule_unusual_method,
-    rule_suspicious_user_agent,
-    rule_large_transfer,
+from worker.features import event_columns
+from worker.detectors.rate import SlidingWindowRate, rate_ratios
+from worker.detectors.rules import get_rule_engine
+from worker.detectors.sketches import ScanSketches
+from worker.detectors.iplists import get_ip_matcher
+from worker.detectors.sessions import Sessionizer
+from worker.detectors.deviation import ProfileDeviationDetector
+from worker.detectors.isolation import (
+    IsolationForestDetector,
+    source_key,
+    FEATURES as ISOLATION_FEATURES,
 )
-from worker.llm import explain_anomaly_with_llm
+from worker.explanations import explain_anomalies
+from worker.incidents import IncidentAggregator, reason_class_for
+from worker.tiering import plan_tiers
+from worker.dedup import collapse_duplicates
+from worker.reservoir import Reservoir
+from worker.persistence import PersistenceStage, ScoredBatch
 from worker.embeddings import (
     generate_embeddings_batch,
     prepare_log_text,
     is_zero_vector,
+    distance_to_score,
+    self_knn_distances,
     FaissVectorStore
 )
 from worker.config import (
@@ -36,6 +48,16 @@ from worker.config import (
     MIN_NEIGHBORS_FOR_COMPARISON,
     EMBEDDING_BATCH_SIZE,
     ML_SCALE,
+    RULE_SCALE,
+    SELF_SIMILARITY_DISTANCE_THRESHOLD,
+    SELF_SIMILARITY_SAMPLE_SIZE,
+    SELF_SIMILARITY_SCALE,
+    PROFILE_SCALE,
+    ISOLATION_SCALE,
+    SESSION_SCALE,
+    EXPLAIN_TASK_BATCH_SIZE,
+    INGEST_BATCH_SIZE,
+    DEDUP_EVENTS,
     LOG_EMBEDDINGS_PROGRESS
 )
 
@@ -55,8 +77,8 @@ def parse_file_task(upload_id: str, file_path: str):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
-        # Run the async function
-        loop.run_until_complete(process_file(upload_id, file_path))
+        # Run the async function; the tier counts end up in the task result
+        return loop.run_until_complete(process_file(upload_id, file_path))
     except Exception:
         logger.exception("parse_file_task failed")
     finally:
@@ -67,243 +89,451 @@ def parse_file_task(upload_id: str, file_path: str):
             pass
 
 
-# -----------------------------
-# Main async flow (embeddings-based)
-# -----------------------------
-async def process_file(upload_id: str, file_path: str):
-    logger.info("Starting embeddings-based detection for upload_id=%s file=%s", upload_id, file_path)
+@shared_task(name="tasks.explain_anomalies")
+def explain_anomalies_task(items: List[List]):
+    """
+    Celery entrypoint for the explainer queue.
+    items: [anomaly_id, ml_score] pairs.
+    """
+    try:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(explain_anomalies(items))
+    except Exception:
+        logger.exception("explain_anomalies_task failed")
+    finally:
+        try:
+            loop.close()
+        except:
+            pass
+
+
+async def _maintain_partitions():
+    async with AsyncSessionLocal() as db:
+        result = await maintain_partitions(db)
+        await db.commit()
+    if result["dropped"]:
+        await bump_data_version("partitions dropped")
+    return result
+
 
-    # Read file lines
+@shared_task(name="tasks.maintain_partitions")
+def maintain_partitions_task():
+    """
+    Celery beat entrypoint: pre-create upcoming event/anomaly partitions
+    and drop the ones past retention.
+    """
     try:
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as fh:
-            lines = fh.readlines()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(_maintain_partitions())
     except Exception:
-        logger.exception("Failed to read file: %s", file_path)
-        return
+        logger.exception("maintain_partitions_task failed")
+    finally:
+        try:
+            loop.close()
+        except:
+            pass
 
-    # Parse lines
-    parsed_events: List[ParsedEvent] = []
 
-    for line in lines:
-        if not line.strip():
-            continue
-        parsed = parse_line_deterministic(line)
-        if parsed is None:
-            logger.debug("Skipping unparseable line: %s", line.strip())
-            continue
+def enqueue_explanations(items: List[Tuple[int, float]]) -> None:
+    """Send anomaly ids to the explainer queue in fixed-size task messages."""
+    for i in range(0, len(items), EXPLAIN_TASK_BATCH_SIZE):
+        chunk = [[int(anomaly_id), float(ml_score)] for anomaly_id, ml_score in items[i:i + EXPLAIN_TASK_BATCH_SIZE]]
+        try:
+            explain_anomalies_task.delay(chunk)
+        except Exception:
+            logger.exception("Failed to enqueue explanations for %d anomalies", len(chunk))
 
-        parsed_events.append(parsed)
 
-    if not parsed_events:
-        logger.info("No parseable events found in upload %s - finishing.", upload_id)
-        return
+def normalize_timestamp(ts: Optional[datetime]) -> Optional[datetime]:
+    """Naive timestamps are taken as UTC so batches compare and partition consistently."""
+    if ts is not None and ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts
 
-    logger.info(f"Parsed {len(parsed_events)} events from upload {upload_id}")
 
-    # -------------------------
-    # Compute IP counts for rule-based detection
-    # -------------------------
-    src_ips = [e.src_ip for e in parsed_events if e and e.src_ip]
-    ip_counter = Counter(src_ips)
+# -----------------------------
+# Per-upload scoring state (carried across micro-batches)
+# -----------------------------
+class UploadScorer:
+    """Detectors and streaming state for one upload, scored batch by batch."""
 
-    # -------------------------
-    # Generate embeddings
-    # -------------------------
-    logger.info("Generating embeddings for %d events...", len(parsed_events))
-    
-    # Prepare texts for embedding
-    texts = [prepare_log_text(event) for event in parsed_events]
-    
-    # Generate embeddings in batches
-    all_embeddings = []
-    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
-        batch_texts = texts[i:i + EMBEDDING_BATCH_SIZE]
-        batch_embeddings = await generate_embeddings_batch(batch_texts, batch_size=10)
-        all_embeddings.extend(batch_embeddings)
-        
-        if LOG_EMBEDDINGS_PROGRESS:
-            logger.info(f"Generated embeddings for {min(i + EMBEDDING_BATCH_SIZE, len(texts))}/{len(texts)} events")
-    
-    embeddings = np.array(all_embeddings, dtype=np.float32)
-    logger.info(f"Generated {len(embeddings)} embeddings with shape {embeddings.shape}")
+    def __init__(self, upload_id: str, file_path: str):
+        self.upload_id = upload_id
+        self.rate = SlidingWindowRate()
+        self.sketches = ScanSketches()
+        self.sessions = Sessionizer()
+        self.profiles = ProfileDeviationDetector()
+        self.isolation = IsolationForestDetector(source_key(file_path))
+        # Embeddings of earlier batches that self-similarity compares against
+        self.self_reference = Reservoir(SELF_SIMILARITY_SAMPLE_SIZE)
+        self.incidents = IncidentAggregator(upload_id)
+        # Stands in for missing timestamps: events are partitioned by time
+        self.ingested_at = datetime.now(timezone.utc)
+        self.tier_totals = {"events": 0, "decided": 0, "frequent_template": 0, "embedded": 0}
+        self.duplicates_collapsed = 0
 
-    # -------------------------
-    # Load Faiss vector store
-    # -------------------------
-    try:
-        vector_store = FaissVectorStore.load()
-        logger.info("Loaded Faiss index: %s", vector_store.get_stats())
-    except Exception:
-        logger.exception("Failed to load Faiss index, creating new one")
-        vector_store = FaissVectorStore()
+        try:
+            self.vector_store = FaissVectorStore.load()
+            logger.info("Loaded Faiss index: %s", self.vector_store.get_stats())
+        except Exception:
+            logger.exception("Failed to load Faiss index, creating new one")
+            self.vector_store = FaissVectorStore()
 
-    # -------------------------
-    # Score events and collect DB batches
-    # -------------------------
-    batch_events = []
-    batch_anomalies = []
-
-    for idx, (parsed, embedding) in enumerate(zip(parsed_events, embeddings)):
-        # Skip if embedding generation failed
-        if is_zero_vector(embedding):
-            logger.warning(f"Skipping event {idx} due to failed embedding generation")
-            embedding_score = 0.0
+    def finish(self) -> None:
+        """Called once every batch was scored."""
+        try:
+            self.isolation.finish()
+        except Exception:
+            logger.exception("Failed fitting the final IsolationForest for upload %s", self.upload_id)
+
+    def tier_stats(self) -> dict:
+        totals = dict(self.tier_totals)
+        n = totals["events"]
+        totals["embedding_calls_avoided"] = (1 - totals["embedded"] / n) if n else 0.0
+        totals["duplicates_collapsed"] = self.duplicates_collapsed
+        return totals
+
+    async def score_batch(self, parsed_events: List[ParsedEvent]) -> ScoredBatch:
+        upload_id = self.upload_id
+
+        # -------------------------
+        # Optionally collapse duplicate lines into one event with an occurrence count
+        # -------------------------
+        first_seen = last_seen = None
+        if DEDUP_EVENTS:
+            collapsed = collapse_duplicates(parsed_events)
+            parsed_events = collapsed.events
+            counts = collapsed.counts
+            first_seen, last_seen = collapsed.first_seen, collapsed.last_seen
+            self.duplicates_collapsed += collapsed.collapsed
+            if collapsed.collapsed:
+                logger.info(
+                    "Collapsed %d lines of upload %s into %d events",
+                    collapsed.lines, upload_id, len(parsed_events)
+                )
         else:
-            # Search for nearest neighbors
-            distances, indices = vector_store.search(embedding.reshape(1, -1), k=MIN_NEIGHBORS_FOR_COMPARISON)
-            
-            if distances.shape[1] == 0:
-                # No neighbors yet (first upload)
-                embedding_score = 0.0
-                logger.debug(f"Event {idx}: No neighbors in index yet")
+            counts = np.ones(len(parsed_events), dtype=np.int64)
+
+        # -------------------------
+        # Sliding-window per-IP request counts for rule-based detection (weighted by occurrences)
+        # -------------------------
+        columns = event_columns(parsed_events)
+        columns["count"] = counts
+        window_counts = self.rate.update(columns["src_ip"], columns["timestamp"], counts)
+        rate_ratio, rate_window, rate_count = rate_ratios(window_counts)
+        primary_window = min(window_counts)
+        columns["requests_per_ip"] = window_counts[primary_window]
+        for parsed, count in zip(parsed_events, window_counts[primary_window]):
+            parsed.requests_per_ip = int(count)
+
+        columns["rate_ratio"] = rate_ratio
+        columns["rate_window"] = rate_window
+        columns["rate_count"] = rate_count
+
+        # -------------------------
+        # Scan / heavy-hitter sketches: distinct URLs and destinations per IP, traffic shares
+        # -------------------------
+        columns.update(self.sketches.update(columns))
+
+        # -------------------------
+        # CIDR allow/deny lists and GeoIP/ASN enrichment (prefix-trie bulk lookup)
+        # -------------------------
+        columns.update(get_ip_matcher().annotate(columns))
+
+        # -------------------------
+        # Rule-based detection: declarative rules evaluated over the whole batch
+        # -------------------------
+        rule_matches = get_rule_engine().evaluate(columns)
+
+        # -------------------------
+        # Behaviour deviation against cross-upload IP / user profiles
+        # -------------------------
+        deviation = self.profiles.score(columns)
+        self.profiles.update(columns)
+
+        # -------------------------
+        # IsolationForest over numeric features (model cached per log source)
+        # -------------------------
+        try:
+            isolation_scores = self.isolation.score(columns)
+        except Exception:
+            logger.exception("IsolationForest scoring failed")
+            isolation_scores = np.zeros(len(parsed_events), dtype=np.float32)
+
+        # -------------------------
+        # Sessions over (src_ip, username, user_agent) scored against the batch's other sessions
+        # -------------------------
+        sessions = self.sessions.update(columns)
+
+        # -------------------------
+        # Tiering: only events the cheap detectors leave undecided are embedded
+        # -------------------------
+        cheap_scores = np.maximum.reduce([
+            rule_matches.scores * RULE_SCALE,
+            deviation.scores * PROFILE_SCALE,
+            isolation_scores * ISOLATION_SCALE,
+            sessions.scores * SESSION_SCALE,
+        ])
+        tiers = plan_tiers(cheap_scores, columns)
+        tier_stats = tiers.stats()
+        for key in self.tier_totals:
+            self.tier_totals[key] += tier_stats[key]
+        embed_idx = np.flatnonzero(tiers.embed)
+        logger.info(
+            "Tiers for batch of upload %s: events=%d decided=%d frequent_template=%d embedded=%d",
+            upload_id, tier_stats["events"], tier_stats["decided"], tier_stats["frequent_template"],
+            tier_stats["embedded"]
+        )
+
+        # -------------------------
+        # Generate embeddings for the residual events
+        # -------------------------
+        texts = [prepare_log_text(parsed_events[i]) for i in embed_idx]
+
+        all_embeddings = []
+        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch_texts = texts[i:i + EMBEDDING_BATCH_SIZE]
+            batch_embeddings = await generate_embeddings_batch(batch_texts, batch_size=10)
+            all_embeddings.extend(batch_embeddings)
+
+            if LOG_EMBEDDINGS_PROGRESS:
+                logger.info(f"Generated embeddings for {min(i + EMBEDDING_BATCH_SIZE, len(texts))}/{len(texts)} events")
+
+        embeddings = np.array(all_embeddings, dtype=np.float32)
+
+        # -------------------------
+        # Historical similarity: batched k-NN against previous uploads
+        # -------------------------
+        valid_mask = np.array([not is_zero_vector(e) for e in embeddings], dtype=bool)
+        if (~valid_mask).any():
+            logger.warning(f"{int((~valid_mask).sum())} events have no embedding (generation failed)")
+
+        avg_distances = np.full(len(parsed_events), np.nan, dtype=np.float32)
+        if valid_mask.any():
+            distances, _ = self.vector_store.search(embeddings[valid_mask], k=MIN_NEIGHBORS_FOR_COMPARISON)
+            if distances.shape[1] > 0:
+                avg_distances[embed_idx[valid_mask]] = distances.mean(axis=1)
             else:
-                # Calculate average distance
-                avg_distance = distances[0].mean()
-                
-                # Convert distance to anomaly score
-                # Higher distance = more anomalous
-                if avg_distance > DISTANCE_THRESHOLD:
-                    # Normalize to [0, 1] range
-                    embedding_score = min(1.0, avg_distance / (DISTANCE_THRESHOLD * 2))
-                else:
-                    embedding_score = 0.0
-                
-                logger.debug(
-                    f"Event {idx}: avg_distance={avg_distance:.3f}, "
-                    f"embedding_score={embedding_score:.3f}"
-                )
+                # No neighbors yet (first upload)
+                logger.debug("No neighbors in index yet")
+        # Skipped members of frequent templates share their representatives' score
+        embedding_scores = tiers.share_template_scores(distance_to_score(avg_distances, DISTANCE_THRESHOLD))
 
         # -------------------------
-        # Rule-based detection
+        # Self-similarity: blocked k-NN over the batch's embeddings and a sample of the upload's earlier ones
         # -------------------------
-        sliding_count = ip_counter.get(parsed.src_ip, 0)
-        rule_results: List[Tuple[float, str]] = []
-
-        for is_hit, score, reason in [
-            rule_high_request_rate(sliding_count),
-            rule_unusual_method(parsed.method),
-            rule_suspicious_user_agent(parsed.user_agent),
-            rule_large_transfer(parsed.bytes),
-        ]:
-            if is_hit:
-                rule_results.append((score, reason or "rule_triggered"))
-
-        if rule_results:
-            best_rule_score, best_reason = max(rule_results, key=lambda r: r[0])
-        else:
-            best_rule_score, best_reason = 0.0, None
-
-        # Hybrid final score: max of rules and scaled embeddings
-        final_score = max(best_rule_score, embedding_score * ML_SCALE)
-
-        # Prepare event record for DB
-        event_record = {
-            "upload_id": upload_id,
-            "timestamp": parsed.timestamp if isinstance(parsed.timestamp, (str, datetime)) else (parsed.timestamp or None),
-            "src_ip": parsed.src_ip,
-            "dest_ip": parsed.dest_ip,
-            "user_agent": parsed.user_agent,
-            "username": parsed.username,
-            "url": parsed.url,
-            "method": parsed.method,
-            "status": parsed.status,
-            "bytes": parsed.bytes,
-            "raw_line": parsed.raw_line,
+        self_distances = np.full(len(parsed_events), np.nan, dtype=np.float32)
+        if len(embeddings):
+            self_distances[embed_idx] = self_knn_distances(embeddings, earlier=self.self_reference.rows)
+            self.self_reference.add(embeddings[valid_mask])
+        self_scores = distance_to_score(self_distances, SELF_SIMILARITY_DISTANCE_THRESHOLD)
+        # Frequent templates are common within the batch by definition; their
+        # few embedded representatives would otherwise look isolated
+        self_scores[tiers.frequent] = 0.0
+
+        # -------------------------
+        # Hybrid final score: max of rules and scaled detector signals
+        # -------------------------
+        signals = {
+            "rule_based": rule_matches.scores * RULE_SCALE,
+            "embeddings": embedding_scores * ML_SCALE,
+            "self_similarity": self_scores * SELF_SIMILARITY_SCALE,
+            "profile_deviation": deviation.scores * PROFILE_SCALE,
+            "isolation_forest": isolation_scores * ISOLATION_SCALE,
+            "session": sessions.scores * SESSION_SCALE,
         }
-        batch_events.append(event_record)
-
-        # If anomalous, create anomaly record
-        if final_score > ANOMALY_SCORE_THRESHOLD:
-            try:
-                # Determine detector type
-                if embedding_score > best_rule_score:
-                    detector = "embeddings"
-                    base_reason = f"Unusual pattern detected (distance: {avg_distance if not is_zero_vector(embedding) else 'N/A'})"
-                else:
-                    detector = "rule_based"
-                    base_reason = best_reason or "Rule triggered"
-                
-                # Generate LLM explanation
-                explanation = explain_anomaly_with_llm(
-                    event_record,
-                    rules=[base_reason],
-                    ml_score=embedding_score,
-                    final_score=final_score,
+        detector_names = list(signals)
+        stacked = np.stack([signals[name] for name in detector_names])
+        final_scores = stacked.max(axis=0)
+        # Allow-listed (trusted) sources are never reported unless also deny-listed
+        suppressed = columns["src_allow"] & ~(columns["src_deny"] | columns["dest_deny"])
+        if suppressed.any():
+            final_scores[suppressed] = 0.0
+            logger.info("Suppressed %d events from allow-listed sources", int(suppressed.sum()))
+        # Ties resolve to the first detector, so rules win over equal ML scores
+        winners = stacked.argmax(axis=0)
+        ml_scores = np.maximum.reduce([
+            embedding_scores, self_scores, deviation.scores, isolation_scores, sessions.scores
+        ])
+
+        def base_reason_for(detector: str, idx: int) -> str:
+            if detector == "rule_based":
+                return rule_matches.reasons[idx] or "Rule triggered"
+            if detector == "embeddings":
+                if np.isnan(avg_distances[idx]):
+                    return "Unusual pattern detected (shared with other requests of the same template)"
+                return f"Unusual pattern detected (distance: {avg_distances[idx]:.3f})"
+            if detector == "self_similarity":
+                return f"Event unlike the rest of this upload (distance: {self_distances[idx]:.3f})"
+            if detector == "isolation_forest":
+                return (
+                    "Outlier numeric features ("
+                    + ", ".join(f"{f}={columns[f][idx]:g}" for f in ISOLATION_FEATURES)
+                    + ")"
                 )
-            except Exception:
-                logger.exception("LLM explanation failed for index=%d", idx)
-                explanation = base_reason if 'base_reason' in locals() else "Anomaly detected"
-
-            anomaly_record = {
-                "event_id": idx,  # temporary mapping
-                "detector": detector,
-                "score": str(final_score),
-                "reason": explanation,
+            if detector == "session":
+                return sessions.reasons[idx] or "Unusual session"
+            return deviation.reasons[idx] or "Deviation from entity profile"
+
+        # -------------------------
+        # Collect DB rows
+        # -------------------------
+        batch_events = []
+        batch_anomalies = []
+        anomaly_candidates = []
+        anomaly_ml_scores = []
+
+        for idx, parsed in enumerate(parsed_events):
+            final_score = float(final_scores[idx])
+
+            # Prepare event record for DB
+            event_record = {
+                "upload_id": upload_id,
+                "timestamp": normalize_timestamp(parsed.timestamp) or self.ingested_at,
+                # INET columns; unparseable values are only kept in the raw line
+                "src_ip": parsed.src_ip if columns["src_ip_valid"][idx] else None,
+                "dest_ip": parsed.dest_ip if columns["dest_ip_valid"][idx] else None,
+                "user_agent": parsed.user_agent,
+                "username": parsed.username,
+                "url": parsed.url,
+                "method": parsed.method,
+                "status": parsed.status,
+                "bytes": parsed.bytes,
+                "raw_line": parsed.raw_line,
+                "src_country": columns["src_country"][idx] or None,
+                "src_asn": int(columns["src_asn"][idx]) if columns["src_asn"][idx] >= 0 else None,
+                "dest_country": columns["dest_country"][idx] or None,
+                "dest_asn": int(columns["dest_asn"][idx]) if columns["dest_asn"][idx] >= 0 else None,
+                "count": int(counts[idx]),
+                "domain": parsed.domain,  # rollup dimension only, not an events column
             }
-            batch_anomalies.append(anomaly_record)
+            if counts[idx] > 1:
+                event_record["first_seen"] = normalize_timestamp(first_seen[idx])
+                event_record["last_seen"] = normalize_timestamp(last_seen[idx])
+            batch_events.append(event_record)
 
-    # -------------------------
-    # Insert events in a single batch
-    # -------------------------
-    async with AsyncSessionLocal() as db:
-        try:
-            if batch_events:
-                stmt = insert(Event).values(batch_events).returning(Event.id)
-                res = await db.execute(stmt)
-                event_ids = res.scalars().all()
-                await db.commit()
-            else:
-                event_ids = []
-        except Exception:
-            logger.exception("Failed inserting events into DB")
-            await db.rollback()
-            return
-
-        # Map anomalies' temporary event_index -> real event_id
-        for anomaly in batch_anomalies:
-            tmp_index = anomaly.pop("event_id", None)
-            if tmp_index is None:
-                continue
-            try:
-                anomaly["event_id"] = event_ids[int(tmp_index)]
-            except Exception:
-                logger.exception("Failed mapping anomaly event_index=%s", tmp_index)
-                anomaly["event_id"] = None
-
-        # Insert anomalies
-        if batch_anomalies:
-            try:
-                stmt2 = insert(Anomaly).values(batch_anomalies)
-                await db.execute(stmt2)
-                await db.commit()
-            except Exception:
-                logger.exception("Failed inserting anomalies into DB")
-                await db.rollback()
+            # If anomalous, create anomaly record with the detector reason;
+            # the LLM explanation is filled in later by the explainer queue
+            if final_score > ANOMALY_SCORE_THRESHOLD:
+                detector = detector_names[winners[idx]]
+                reason = base_reason_for(detector, idx)
+                anomaly_candidates.append({
+                    "event_index": idx,
+                    "timestamp": normalize_timestamp(parsed.timestamp),
+                    "src_ip": parsed.src_ip,
+                    "username": parsed.username,
+                    "detector": detector,
+                    "reason_class": reason_class_for(detector, rule_matches.rules[idx], reason),
+                    "reason": reason,
+                    "score": final_score,
+                })
+
+        # -------------------------
+        # Group anomalies into incidents; repeats beyond the per-incident cap are
+        # stored and counted but not linked as members
+        # -------------------------
+        assigned_incidents = []
+        for candidate, (incident, member) in zip(anomaly_candidates, self.incidents.assign(anomaly_candidates)):
+            batch_anomalies.append({
+                "event_id": candidate["event_index"],  # batch index, mapped to the id when written
+                "event_timestamp": batch_events[candidate["event_index"]]["timestamp"],
+                "detector": candidate["detector"],
+                "score": candidate["score"],
+                "reason": candidate["reason"],
+            })
+            assigned_incidents.append(incident if member else None)
+            anomaly_ml_scores.append(float(ml_scores[candidate["event_index"]]))
+
+        return ScoredBatch(
+            events=batch_events,
+            anomalies=batch_anomalies,
+            anomaly_incidents=assigned_incidents,
+            anomaly_ml_scores=anomaly_ml_scores,
+            incident_updates=self.incidents.snapshot(),
+            embeddings=embeddings,
+            embed_idx=embed_idx,
+        )
+
+
+def iter_parsed_batches(fh, batch_size: int = INGEST_BATCH_SIZE) -> Iterator[List[ParsedEvent]]:
+    """Parse a file lazily and yield lists of up to batch_size parsed events."""
+    batch: List[ParsedEvent] = []
+    for line in fh:
+        if not line.strip():
+            continue
+        parsed = parse_line_deterministic(line)
+        if parsed is None:
+            logger.debug("Skipping unparseable line: %s", line.strip())
+            continue
+
+        batch.append(parsed)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# -----------------------------
+# Main async flow (embeddings-based)
+# -----------------------------
+async def process_file(upload_id: str, file_path: str):
+    logger.info("Starting embeddings-based detection for upload_id=%s file=%s", upload_id, file_path)
+
+    try:
+        fh = open(file_path, "r", encoding="utf-8", errors="ignore")
+    except Exception:
+        logger.exception("Failed to read file: %s", file_path)
+        return
+
+    # Micro-batches are scored here while the persistence stage writes the
+    # previous ones, so the upload becomes queryable as it is processed
+    scorer = UploadScorer(upload_id, file_path)
+    stage = PersistenceStage(upload_id, scorer.incidents, on_anomalies=enqueue_explanations)
+    stage.start()
+    status = "completed"
+    n_batches = 0
+    try:
+        with fh:
+            for parsed_events in iter_parsed_batches(fh):
+                n_batches += 1
+                logger.info(f"Parsed batch {n_batches} ({len(parsed_events)} events) from upload {upload_id}")
+                await stage.submit(await scorer.score_batch(parsed_events))
+        scorer.finish()
+    except Exception:
+        logger.exception("Failed processing upload %s", upload_id)
+        status = "failed"
+    finally:
+        await stage.close(status)
+
+    if not n_batches:
+        logger.info("No parseable events found in upload %s - finishing.", upload_id)
+        return
 
     # -------------------------
-    # Update Faiss index with new embeddings
+    # Update Faiss index with the embedded events of every written batch
     # -------------------------
     try:
-        # Prepare metadata for new embeddings
-        metadata = [
-            {
-                'event_id': event_id,
-                'upload_id': upload_id,
-                'timestamp': str(parsed_events[i].timestamp) if parsed_events[i].timestamp else None
-            }
-            for i, event_id in enumerate(event_ids)
-        ]
-        
-        # Add to index
-        vector_store.add(embeddings, metadata)
-        
-        # Save updated index
-        vector_store.save()
-        logger.info(f"Updated Faiss index with {len(embeddings)} new vectors")
+        added = 0
+        for vectors in stage.vectors:
+            scorer.vector_store.add(vectors.embeddings, vectors.metadata)
+            added += len(vectors.embeddings)
+        scorer.vector_store.save()
+        logger.info(f"Updated Faiss index with {added} new vectors")
     except Exception:
         logger.exception("Failed to update Faiss index")
 
     logger.info(
-        "Completed embeddings-based detection for upload %s (events=%d, anomalies=%d)",
-        upload_id, len(batch_events), len(batch_anomalies)
+        "Heavy hitters for upload %s: ips=%s domains=%s",
+        upload_id, scorer.sketches.top_ips.top(5), scorer.sketches.top_domains.top(5)
+    )
+    tier_stats = scorer.tier_stats()
+    logger.info(
+        "Completed embeddings-based detection for upload %s (events=%d, anomalies=%d, "
+        "embedded=%d, %.1f%% embedding calls avoided, %d duplicates collapsed)",
+        upload_id, stage.events_written, stage.anomalies_written,
+        tier_stats["embedded"], tier_stats["embedding_calls_avoided"] * 100, tier_stats["duplicates_collapsed"]
     )
+    return tier_stats
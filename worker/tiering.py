@@ -0,0 +1,109 @@
+"""
+Tiered scoring: decide which events need the embedding tier.
+
+The cheap vectorized detectors (rules, profile deviation, IsolationForest)
+run over the whole upload first. Events they already score at or above
+TIER_DECIDED_SCORE skip embedding, as do high-frequency request templates
+(method, URL shape, status and user agent with ids masked): only
+TIER_TEMPLATE_SAMPLES representatives of each such template are embedded,
+and their scores are shared with the rest of the template. Everything
+else is the residual set sent to Ollama and Faiss.
+"""
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+
+from worker.features import factorize, normalize_text, url_shape
+from worker.config import (
+    TIERED_SCORING,
+    TIER_DECIDED_SCORE,
+    TIER_TEMPLATE_MIN_COUNT,
+    TIER_TEMPLATE_SAMPLES,
+)
+
+
+def event_templates(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Dense template codes per event; events differing only in ids/IPs/numbers share a code."""
+    n = len(columns["status"])
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    url_uniques, url_codes = factorize(columns["url"])
+    ua_uniques, ua_codes = factorize(columns["user_agent"])
+    method_uniques, method_codes = factorize(columns["method"])
+    shapes = np.array([url_shape(u) for u in url_uniques], dtype=object)
+    agents = np.array([normalize_text(u) for u in ua_uniques], dtype=object)
+    methods = np.array([m.upper() for m in method_uniques], dtype=object)
+
+    # Factorize the normalized parts again so e.g. /item/1 and /item/2 share a code
+    _, shape_codes = factorize(shapes[url_codes])
+    _, agent_codes = factorize(agents[ua_codes])
+    _, method_codes = factorize(methods[method_codes])
+    keys = np.column_stack([
+        method_codes, shape_codes, columns["status"].astype(np.int64), agent_codes,
+    ])
+    _, codes = np.unique(keys, axis=0, return_inverse=True)
+    return codes.reshape(-1)
+
+
+@dataclass
+class TierPlan:
+    """Which events go to the embedding tier, and why the others do not."""
+    embed: np.ndarray  # bool: event is embedded
+    decided: np.ndarray  # bool: cheap tier already scored it high enough
+    frequent: np.ndarray  # bool: event belongs to a high-frequency template
+    templates: np.ndarray  # template code per event
+
+    def stats(self) -> Dict[str, float]:
+        n = len(self.embed)
+        embedded = int(self.embed.sum())
+        return {
+            "events": n,
+            "decided": int(self.decided.sum()),
+            "frequent_template": int((self.frequent & ~self.decided).sum()),
+            "embedded": embedded,
+            "embedding_calls_avoided": (1 - embedded / n) if n else 0.0,
+        }
+
+    def share_template_scores(self, scores: np.ndarray) -> np.ndarray:
+        """Give skipped members of a high-frequency template the max score of its embedded representatives."""
+        if not self.frequent.any():
+            return scores
+        rep = self.embed & self.frequent
+        template_max = np.zeros(int(self.templates.max()) + 1, dtype=scores.dtype)
+        np.maximum.at(template_max, self.templates[rep], scores[rep])
+        skipped = self.frequent & ~self.embed & ~self.decided
+        out = scores.copy()
+        out[skipped] = template_max[self.templates[skipped]]
+        return out
+
+
+def plan_tiers(cheap_scores: np.ndarray, columns: Dict[str, np.ndarray]) -> TierPlan:
+    """
+    Select the residual events for the embedding tier.
+
+    Args:
+        cheap_scores: max scaled score of the cheap detectors per event
+        columns: event columns (see worker.features.event_columns)
+    """
+    n = len(cheap_scores)
+    templates = event_templates(columns)
+    if not TIERED_SCORING:
+        none = np.zeros(n, dtype=bool)
+        return TierPlan(np.ones(n, dtype=bool), none, none.copy(), templates)
+
+    decided = cheap_scores >= TIER_DECIDED_SCORE
+
+    counts = np.bincount(templates, minlength=int(templates.max()) + 1 if n else 0)
+    frequent = counts[templates] >= TIER_TEMPLATE_MIN_COUNT
+    # Rank of each undecided event within its template, in upload order
+    undecided = np.flatnonzero(~decided)
+    order = undecided[np.argsort(templates[undecided], kind="stable")]
+    undecided_counts = np.bincount(templates[undecided], minlength=len(counts))
+    starts = np.concatenate(([0], np.cumsum(undecided_counts)[:-1]))
+    rank = np.zeros(n, dtype=np.int64)
+    rank[order] = np.arange(len(order)) - starts[templates[order]]
+    representative = frequent & (rank < TIER_TEMPLATE_SAMPLES)
+
+    embed = ~decided & (~frequent | representative)
+    return TierPlan(embed, decided, frequent, templates)